@@ -0,0 +1,92 @@
+import time
+import logging
+import threading
+from django.conf import settings
+from django.db.models import Count, Max
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_configs = None
+_version = None
+_checked_at = 0.0
+
+
+def _recheck_seconds():
+    return getattr(settings, 'API_CONFIG_RECHECK_SECONDS', 5)
+
+
+def _db_version():
+    """
+    Version of the APIConfiguration table as the database sees it
+
+    Saves bump the latest updated_at and deletes change the row count, so
+    every worker process notices a change made by any other one.
+    """
+    from .models import APIConfiguration
+    stats = APIConfiguration.objects.aggregate(latest=Max('updated_at'), count=Count('id'))
+    return stats['latest'], stats['count']
+
+
+def _load_configs():
+    """
+    Return the {service: APIConfiguration} mapping
+
+    It is loaded with a single query the first time it is needed, after an
+    invalidation in this process, or when the table's version has changed.
+    The version is checked at most every API_CONFIG_RECHECK_SECONDS, so
+    most requests make no configuration queries at all.
+    """
+    global _configs, _version, _checked_at
+
+    configs = _configs
+    if configs is not None and time.monotonic() - _checked_at < _recheck_seconds():
+        return configs
+
+    with _lock:
+        if _configs is not None and time.monotonic() - _checked_at < _recheck_seconds():
+            return _configs
+        try:
+            version = _db_version()
+            if _configs is None or version != _version:
+                from .models import APIConfiguration
+                _configs = {
+                    config.service: config
+                    for config in APIConfiguration.objects.filter(is_active=True)
+                }
+                _version = version
+                logger.info(f"Loaded API configuration for: {', '.join(_configs) or 'no services'}")
+            _checked_at = time.monotonic()
+        except Exception as e:
+            # Database not ready (e.g. before migrate) - don't cache the miss
+            logger.warning(f"Could not load API configuration: {str(e)}")
+            return _configs or {}
+        return _configs
+
+
+def get_api_config(service):
+    """
+    Get the active API configuration for a service from the process-wide cache
+
+    Args:
+        service (str): 'telnyx', 'humblefax' or 'twilio'
+
+    Returns:
+        APIConfiguration: The active configuration or None if not configured.
+        The instance is shared between requests and must not be modified.
+    """
+    return _load_configs().get(service)
+
+
+def invalidate(**kwargs):
+    """
+    Drop this process's cached configuration. Connected to
+    post_save/post_delete of APIConfiguration; other processes pick the
+    change up from the table version within API_CONFIG_RECHECK_SECONDS.
+    QuerySet.update() bypasses signals and auto_now, so callers using it must
+    call this and set updated_at themselves.
+    """
+    global _configs
+    with _lock:
+        _configs = None
+    logger.info("API configuration cache invalidated")
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AppConfig(AppConfig):
     name = 'app'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
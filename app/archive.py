@@ -0,0 +1,185 @@
+"""
+Move old fax and SMS history out of the hot tables into archive segments
+
+Rows older than the horizon are written, oldest first, to append-only JSONL
+segments under ARCHIVE_ROOT/<kind>/<YYYY-MM>/, compressed with zstd when
+the zstandard package is installed and gzip otherwise. A segment is
+written and fsynced before the transaction that indexes its rows in
+ArchivedRecord and deletes them from the hot table, so a crash can leave
+an unindexed segment behind but never loses a row.
+"""
+import io
+import os
+import gzip
+import json
+import uuid
+import logging
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ArchivedRecord, FaxRecord, SMSRecord
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# kind -> (model, provider ID field)
+ARCHIVED_MODELS = {
+    'fax': (FaxRecord, 'fax_id'),
+    'sms': (SMSRecord, 'sid'),
+}
+
+EXTENSIONS = {'zstd': '.jsonl.zst', 'gzip': '.jsonl.gz'}
+
+
+def archive_root():
+    return getattr(settings, 'ARCHIVE_ROOT', os.path.join(settings.BASE_DIR, 'archive'))
+
+
+def archive_codec():
+    """'zstd' or 'gzip', per ARCHIVE_COMPRESSION and whether zstandard is installed"""
+    codec = getattr(settings, 'ARCHIVE_COMPRESSION', 'auto')
+    if codec == 'auto':
+        return 'zstd' if zstandard is not None else 'gzip'
+    if codec == 'zstd' and zstandard is None:
+        raise RuntimeError("ARCHIVE_COMPRESSION is 'zstd' but the zstandard package is not installed")
+    return codec
+
+
+def _write_segment(path, lines, codec):
+    """Write a segment atomically: to a temporary file, fsynced, then renamed"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    data = ''.join(f"{line}\n" for line in lines).encode('utf-8')
+    try:
+        with open(tmp_path, 'wb') as raw:
+            if codec == 'zstd':
+                raw.write(zstandard.ZstdCompressor(level=10).compress(data))
+            else:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as out:
+                    out.write(data)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_segment_lines(path):
+    """Yield the JSON lines of a segment"""
+    if path.endswith(EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {path} needs the zstandard package")
+        with open(path, 'rb') as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            yield from io.TextIOWrapper(reader, encoding='utf-8')
+    else:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            yield from f
+
+
+def _datetime_fields(model):
+    return [field.attname for field in model._meta.concrete_fields if isinstance(field, models.DateTimeField)]
+
+
+def archive_records(kind, cutoff, batch_size=None, dry_run=False):
+    """
+    Archive rows of one kind created before cutoff
+
+    Args:
+        kind (str): 'fax' or 'sms'
+        cutoff (datetime): Rows created before this are archived
+        batch_size (int): Rows per segment and per delete transaction
+        dry_run (bool): Only count the rows that would be archived
+
+    Returns:
+        dict: 'archived' rows and 'segments' written
+    """
+    model, key_field = ARCHIVED_MODELS[kind]
+    batch_size = batch_size or getattr(settings, 'ARCHIVE_BATCH_SIZE', 1000)
+    old_rows = model.objects.filter(created_at__lt=cutoff)
+    if dry_run:
+        return {'archived': old_rows.count(), 'segments': 0}
+
+    codec = archive_codec()
+    fields = [field.attname for field in model._meta.concrete_fields]
+    root = archive_root()
+    stats = {'archived': 0, 'segments': 0}
+
+    while True:
+        rows = list(old_rows.order_by('created_at', 'id').values(*fields)[:batch_size])
+        if not rows:
+            break
+
+        # One segment per month the batch covers
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row['created_at'].strftime('%Y-%m'), []).append(row)
+
+        entries = []
+        for month, month_rows in by_month.items():
+            segment = os.path.join(
+                kind, month,
+                f"{timezone.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}{EXTENSIONS[codec]}"
+            )
+            _write_segment(
+                os.path.join(root, segment),
+                [json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')) for row in month_rows],
+                codec
+            )
+            stats['segments'] += 1
+            entries.extend(
+                ArchivedRecord(kind=kind, key=row[key_field], segment=segment, line=line, created_at=row['created_at'])
+                for line, row in enumerate(month_rows)
+            )
+
+        keys = [entry.key for entry in entries]
+        with transaction.atomic():
+            # A key archived before and reused since points at its latest copy
+            ArchivedRecord.objects.filter(kind=kind, key__in=keys).delete()
+            ArchivedRecord.objects.bulk_create(entries, batch_size=500)
+            model.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        stats['archived'] += len(rows)
+        logger.info(f"Archived {len(rows)} {model.__name__} rows into {len(by_month)} segment(s)")
+
+    return stats
+
+
+def find_archived(kind, key):
+    """
+    Read an archived row back
+
+    Returns:
+        tuple: (row dict with datetimes parsed, ArchivedRecord), or (None, None)
+    """
+    entry = ArchivedRecord.objects.filter(kind=kind, key=key).first()
+    if entry is None:
+        return None, None
+    path = os.path.join(archive_root(), entry.segment)
+    lines = _read_segment_lines(path)
+    try:
+        for line_number, line in enumerate(lines):
+            if line_number == entry.line:
+                row = json.loads(line)
+                break
+        else:
+            logger.error(f"Archived {kind} {key} missing from {entry.segment}")
+            return None, entry
+    except (OSError, RuntimeError, ValueError) as e:
+        logger.error(f"Could not read archived {kind} {key} from {entry.segment}: {str(e)}")
+        return None, entry
+    finally:
+        lines.close()
+
+    model, _ = ARCHIVED_MODELS[kind]
+    for field in _datetime_fields(model):
+        if isinstance(row.get(field), str):
+            row[field] = parse_datetime(row[field])
+    return row, entry
+
@@ -9,7 +9,7 @@ from docxtpl import DocxTemplate
 import io
 from django.conf import settings
 import logging
-from .humblefax_service import HumbleFaxService
+from .fax_providers import FaxRouter
 
 # Configure logging
 logging.basicConfig(
@@ -27,7 +27,7 @@ class BulkFaxGenerator:
     def __init__(self):
         self.temp_dir = tempfile.mkdtemp()
         self.base_dir = settings.BASE_DIR
-        self.humblefax = HumbleFaxService()
+        self.router = FaxRouter()
         logger.info(f"Initialized BulkFaxGenerator with temp_dir: {self.temp_dir}")
         logger.info(f"Base directory: {self.base_dir}")
         
@@ -128,14 +128,10 @@ class BulkFaxGenerator:
             fax_result = None
             if auto_send and record.get('pcp_fax'):
                 try:
-                    # Read the generated document
-                    with open(output_path, 'rb') as f:
-                        doc_content = f.read()
-                    
-                    # Send fax using HumbleFax
-                    fax_result = self.humblefax.send_fax(
+                    # Send fax through the healthiest configured provider
+                    fax_result = self.router.send(
                         to_number=record.get('pcp_fax'),
-                        document_content=doc_content,
+                        document=output_path,
                         filename=output_filename,
                         patient_name=patient_name
                     )
@@ -0,0 +1,173 @@
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .circuit_breaker import PauseBudget, call_with_requeue
+from .models import SMSRecord
+from .record_writer import BufferedRecordWriter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Blocking token bucket allowing `rate` acquisitions per second"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or 1
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def sender_bucket(from_number):
+    """
+    Return the process-wide token bucket for a sender number
+
+    Rates come from settings.TWILIO_SENDER_RATES (messages per second by
+    number), falling back to TWILIO_MESSAGES_PER_SECOND. Concurrent bulk jobs
+    from the same number share one bucket.
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(from_number)
+        if bucket is None:
+            rates = getattr(settings, 'TWILIO_SENDER_RATES', {})
+            rate = rates.get(from_number, getattr(settings, 'TWILIO_MESSAGES_PER_SECOND', 1))
+            bucket = _buckets[from_number] = TokenBucket(rate)
+        return bucket
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class BulkSMSSender:
+    """
+    Send one message to many recipients through a TwilioSMSService
+
+    Sends run on a worker pool, paced by the sender number's token bucket,
+    and results come back in input order. Successful sends are saved as
+    SMSRecord rows through a BufferedRecordWriter. While Twilio's
+    circuit breaker is open, workers wait and retry until the shared pause
+    budget (BULK_CIRCUIT_PAUSE_SECONDS) is used up.
+    """
+
+    def __init__(self, service, workers=None, batch_size=None, max_pause_seconds=None):
+        self.service = service
+        self.workers = workers or getattr(settings, 'BULK_SMS_WORKERS', 8)
+        self.batch_size = batch_size
+        self.pause_budget = PauseBudget(max_pause_seconds)
+        self.bucket = sender_bucket(service.from_number)
+
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._started = None
+        self._finished = None
+        self._sent = 0
+        self._failed = 0
+
+    def _attempt(self, to_number, message):
+        self.bucket.acquire()
+        start = time.monotonic()
+        result = self.service.send_sms(to_number, message, skip_lookup=True)
+        if not result.get('circuit_open'):
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+        return result
+
+    def _send_one(self, to_number, message):
+        return call_with_requeue(lambda: self._attempt(to_number, message), self.pause_budget, f"SMS to {to_number}")
+
+    def send(self, recipients, message, from_number=None):
+        """
+        Send message to every recipient
+
+        Args:
+            recipients (list): (label, phone_number) pairs; the label is stored
+                as the record's to_number
+            message (str): Message content
+            from_number (str): from_number stored on the records
+
+        Yields:
+            tuple: (recipient, result) in input order
+        """
+        from_number = from_number or self.service.from_number
+        writer = BufferedRecordWriter(SMSRecord, batch_size=self.batch_size)
+
+        def collect(recipient, result):
+            if result['success']:
+                self._sent += 1
+                writer.add(SMSRecord(
+                    sid=result['sms_id'],
+                    to_number=recipient[0],
+                    from_number=from_number,
+                    message=message,
+                    status='sent'
+                ))
+            else:
+                self._failed += 1
+                writer.flush_if_due()
+
+        self._started = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [executor.submit(self._send_one, recipient[1], message) for recipient in recipients]
+        consumed = 0
+        try:
+            for recipient, future in zip(recipients, futures):
+                result = future.result()
+                consumed += 1
+                collect(recipient, result)
+                yield recipient, result
+        finally:
+            # If the caller stops early, cancel queued sends but still record
+            # every message that actually went out
+            executor.shutdown(wait=True, cancel_futures=True)
+            for recipient, future in zip(recipients[consumed:], futures[consumed:]):
+                if not future.cancelled() and future.exception() is None:
+                    collect(recipient, future.result())
+            writer.close()
+            self._finished = time.monotonic()
+
+    def stats(self):
+        """
+        Throughput and per-message latency of the last send
+
+        Returns:
+            dict: Counts, messages per second and p50/p95/p99 latency in seconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        elapsed = ((self._finished or time.monotonic()) - self._started) if self._started else 0.0
+        return {
+            'sent': self._sent,
+            'failed': self._failed,
+            'elapsed_seconds': elapsed,
+            'messages_per_second': (self._sent + self._failed) / elapsed if elapsed else 0.0,
+            'p50_seconds': percentile(latencies, 50),
+            'p95_seconds': percentile(latencies, 95),
+            'p99_seconds': percentile(latencies, 99),
+        }
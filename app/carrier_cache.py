@@ -0,0 +1,159 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from .models import CarrierLookup
+
+logger = logging.getLogger(__name__)
+
+# Twilio Lookup line types that can receive SMS
+MOBILE_CARRIER_TYPES = ('mobile', 'voip')
+
+CarrierInfo = namedtuple('CarrierInfo', ['phone_number', 'carrier_type', 'carrier_name', 'is_mobile', 'looked_up_at'])
+
+
+class CarrierCache:
+    """
+    Carrier types for E.164 numbers, stored in the CarrierLookup table
+
+    The table is shared by every process; an in-process LRU in front of it
+    answers repeat numbers without a query. Entries older than the TTL are
+    treated as misses so the number is looked up again.
+    """
+
+    def __init__(self, ttl=None, maxsize=None):
+        self.ttl = timedelta(seconds=ttl or getattr(settings, 'TWILIO_LOOKUP_CACHE_TTL', 90 * 24 * 3600))
+        self.maxsize = maxsize or getattr(settings, 'TWILIO_LOOKUP_CACHE_SIZE', 10000)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'lookups': 0, 'lookup_errors': 0}
+
+    def _fresh(self, info):
+        return timezone.now() - info.looked_up_at < self.ttl
+
+    def _remember(self, info):
+        with self._lock:
+            self._lru[info.phone_number] = info
+            self._lru.move_to_end(info.phone_number)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def count(self, stat, n=1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def get(self, phone_number):
+        """Return the cached CarrierInfo for a number, or None on a miss"""
+        return self.get_many([phone_number]).get(phone_number)
+
+    def get_many(self, phone_numbers):
+        """
+        Look up several numbers with at most one query
+
+        Returns:
+            dict: CarrierInfo by phone number for every fresh cache hit
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for number in dict.fromkeys(phone_numbers):
+                info = self._lru.get(number)
+                if info is not None and self._fresh(info):
+                    self._lru.move_to_end(number)
+                    found[number] = info
+                else:
+                    missing.append(number)
+            self._stats['memory_hits'] += len(found)
+
+        if missing:
+            try:
+                rows = CarrierLookup.objects.filter(
+                    phone_number__in=missing,
+                    looked_up_at__gte=timezone.now() - self.ttl
+                ).values_list('phone_number', 'carrier_type', 'carrier_name', 'is_mobile', 'looked_up_at')
+                for row in rows:
+                    info = CarrierInfo(*row)
+                    self._remember(info)
+                    found[info.phone_number] = info
+            except DatabaseError as e:
+                logger.warning(f"Carrier cache table unavailable: {str(e)}")
+            db_hits = len(found) - (len(dict.fromkeys(phone_numbers)) - len(missing))
+            self.count('db_hits', db_hits)
+            self.count('misses', len(missing) - db_hits)
+        return found
+
+    def set(self, phone_number, carrier_type, carrier_name=None):
+        """Store a successful lookup result and return its CarrierInfo"""
+        return self.set_many([(phone_number, carrier_type, carrier_name)])[0]
+
+    def set_many(self, results):
+        """
+        Store several lookup results in one transaction
+
+        Args:
+            results (list): (phone_number, carrier_type, carrier_name) tuples
+
+        Returns:
+            list: CarrierInfo for each result
+        """
+        now = timezone.now()
+        infos = [
+            CarrierInfo(number, carrier_type or '', carrier_name, (carrier_type or '').lower() in MOBILE_CARRIER_TYPES, now)
+            for number, carrier_type, carrier_name in results
+        ]
+        if not infos:
+            return infos
+        try:
+            with transaction.atomic():
+                by_number = {info.phone_number: info for info in infos}
+                existing = list(CarrierLookup.objects.filter(phone_number__in=list(by_number)))
+                for row in existing:
+                    info = by_number.pop(row.phone_number)
+                    row.carrier_type, row.carrier_name, row.is_mobile, row.looked_up_at = info[1:]
+                CarrierLookup.objects.bulk_update(existing, ['carrier_type', 'carrier_name', 'is_mobile', 'looked_up_at'])
+                # Another process may insert the same number meanwhile; either row is fine
+                CarrierLookup.objects.bulk_create(
+                    [CarrierLookup(**info._asdict()) for info in by_number.values()],
+                    ignore_conflicts=True
+                )
+        except DatabaseError as e:
+            logger.warning(f"Could not store carrier lookups: {str(e)}")
+        for info in infos:
+            self._remember(info)
+        return infos
+
+    def stats(self):
+        """
+        Hit-rate statistics for this process
+
+        Returns:
+            dict: Counters, hit_rate and the number of cached rows
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._lru)
+        total = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['db_hits']) / total if total else 0.0
+        try:
+            stats['table_entries'] = CarrierLookup.objects.count()
+        except DatabaseError:
+            stats['table_entries'] = None
+        stats['ttl_seconds'] = int(self.ttl.total_seconds())
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_carrier_cache():
+    """Return the process-wide carrier cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CarrierCache()
+    return _cache
@@ -0,0 +1,306 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Number of most recent calls the error and slow-call rates are computed over
+    'window_size': 20,
+    # Calls needed in the window before the breaker may trip
+    'min_calls': 5,
+    # Trip when this fraction of calls in the window failed
+    'failure_rate_threshold': 0.5,
+    # Calls slower than this many seconds count as slow
+    'slow_call_seconds': 10.0,
+    # Trip when this fraction of calls in the window were slow
+    'slow_call_rate_threshold': 0.8,
+    # Seconds to fail fast before letting probe requests through
+    'open_seconds': 30.0,
+    # Successful probes needed in half-open state to close again
+    'half_open_probes': 2,
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request while a breaker is open"""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after:.0f}s")
+
+
+def is_failure_response(response):
+    """Server errors and rate limiting count against the provider"""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single provider endpoint
+
+    Closed: requests flow and outcomes are recorded in a rolling window.
+    Open: requests fail immediately with CircuitOpenError for open_seconds.
+    Half-open: a limited number of probe requests are let through; if they
+    all succeed the breaker closes, any failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, **options):
+        config = dict(DEFAULTS, **options)
+        self.name = name
+        self.window_size = config['window_size']
+        self.min_calls = config['min_calls']
+        self.failure_rate_threshold = config['failure_rate_threshold']
+        self.slow_call_seconds = config['slow_call_seconds']
+        self.slow_call_rate_threshold = config['slow_call_rate_threshold']
+        self.open_seconds = config['open_seconds']
+        self.half_open_probes = config['half_open_probes']
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._window = deque(maxlen=self.window_size)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+            logger.info(f"Circuit '{self.name}' half-open, probing")
+
+    def retry_after(self):
+        """Seconds until the breaker lets requests through again"""
+        with self._lock:
+            self._update_state()
+            if self._state == self.OPEN:
+                return max(self.open_seconds - (time.monotonic() - self._opened_at), 0.0)
+            if self._state == self.HALF_OPEN and self._probes_in_flight >= self.half_open_probes:
+                return 1.0
+            return 0.0
+
+    def _acquire(self):
+        """Check whether a call may proceed; returns True for half-open probes"""
+        with self._lock:
+            self._update_state()
+            if self._state == self.CLOSED:
+                return False
+            if self._state == self.HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self._rejected += 1
+            retry_after = self.open_seconds - (time.monotonic() - self._opened_at) if self._state == self.OPEN else 1.0
+        raise CircuitOpenError(self.name, max(retry_after, 0.0))
+
+    def _open(self, reason):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._window.clear()
+        logger.warning(f"Circuit '{self.name}' opened: {reason}")
+
+    def record(self, success, duration, probe=False):
+        """Record the outcome of a call"""
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if probe:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if self._state != self.HALF_OPEN:
+                    return
+                if not success or slow:
+                    self._open('probe request failed' if not success else f"probe took {duration:.1f}s")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._state = self.CLOSED
+                    self._window.clear()
+                    logger.info(f"Circuit '{self.name}' closed")
+                return
+
+            if self._state != self.CLOSED:
+                return
+            self._window.append((success, slow))
+            calls = len(self._window)
+            if calls < self.min_calls:
+                return
+            failure_rate = sum(1 for ok, _ in self._window if not ok) / calls
+            slow_rate = sum(1 for _, was_slow in self._window if was_slow) / calls
+            if failure_rate >= self.failure_rate_threshold:
+                self._open(f"{failure_rate:.0%} of the last {calls} calls failed")
+            elif slow_rate >= self.slow_call_rate_threshold:
+                self._open(f"{slow_rate:.0%} of the last {calls} calls took over {self.slow_call_seconds:.0f}s")
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func through the breaker
+
+        Exceptions and responses with a 5xx or 429 status count as failures.
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+        """
+        probe = self._acquire()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record(False, time.monotonic() - start, probe)
+            raise
+        success = not (hasattr(result, 'status_code') and is_failure_response(result))
+        self.record(success, time.monotonic() - start, probe)
+        return result
+
+    def snapshot(self):
+        """Current state and window statistics"""
+        with self._lock:
+            self._update_state()
+            calls = len(self._window)
+            return {
+                'name': self.name,
+                'state': self._state,
+                'calls': calls,
+                'failure_rate': sum(1 for ok, _ in self._window if not ok) / calls if calls else 0.0,
+                'slow_rate': sum(1 for _, slow in self._window if slow) / calls if calls else 0.0,
+                'rejected': self._rejected,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """
+    Return the process-wide breaker for an endpoint, e.g. 'humblefax:tmpFax'
+
+    Options come from settings.CIRCUIT_BREAKER, with per-provider overrides
+    under the provider name (the part before the colon).
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                config = dict(getattr(settings, 'CIRCUIT_BREAKER', {}))
+                overrides = config.pop('providers', {}).get(name.split(':')[0], {})
+                breaker = CircuitBreaker(name, **dict(config, **overrides))
+                _breakers[name] = breaker
+    return breaker
+
+
+def all_breakers():
+    """Snapshots of every breaker created in this process"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.snapshot() for breaker in breakers]
+
+
+def circuit_open_result(error, message='Provider temporarily unavailable'):
+    """Service result for a request rejected by an open breaker"""
+    return {
+        'success': False,
+        'error': str(error),
+        'message': message,
+        'circuit_open': True,
+        'retry_after': error.retry_after
+    }
+
+
+class PauseBudget:
+    """
+    Seconds a bulk job may spend waiting for open breakers, shared by its workers
+
+    Args:
+        max_pause_seconds (float): Total pause allowed (default BULK_CIRCUIT_PAUSE_SECONDS)
+    """
+
+    def __init__(self, max_pause_seconds=None):
+        if max_pause_seconds is None:
+            max_pause_seconds = getattr(settings, 'BULK_CIRCUIT_PAUSE_SECONDS', 120)
+        self.max_pause_seconds = max_pause_seconds
+        self.paused = 0.0
+        self._lock = threading.Lock()
+
+    def take(self, seconds):
+        """Reserve a pause; False once it would exceed the budget"""
+        with self._lock:
+            if self.paused + seconds > self.max_pause_seconds:
+                return False
+            self.paused += seconds
+            return True
+
+
+def call_with_requeue(call, budget, label='item'):
+    """
+    Call call() until its result no longer reports an open circuit
+
+    Between attempts the caller waits for the result's retry_after (the time
+    until the breaker lets a probe through). Once the pause budget is used
+    up the last result is returned marked deferred, without another attempt.
+
+    Args:
+        call: Callable returning a service result dict
+        budget (PauseBudget): Pause budget shared by the job's items
+        label (str): What is being sent, for the log
+    """
+    while True:
+        result = call()
+        if not (isinstance(result, dict) and result.get('circuit_open')):
+            return result
+        wait = max(result.get('retry_after') or 1.0, 0.5)
+        if not budget.take(wait):
+            logger.warning(f"Provider still unavailable after pausing {budget.paused:.0f}s, deferring {label}")
+            return dict(result, deferred=True, message='Deferred - provider unavailable, not sent')
+        logger.info(f"Circuit open, pausing {label} for {wait:.1f}s")
+        time.sleep(wait)
+
+
+def process_with_requeue(items, handler, max_pause_seconds=None, workers=1, budget=None):
+    """
+    Run handler(item) for each item, pausing while a provider is unavailable
+
+    When a result reports an open circuit the item waits for the breaker's
+    retry_after and is tried again instead of burning a request timeout.
+    Every item draws on one pause budget; once it is used up, items whose
+    provider is still unavailable are returned as deferred.
+
+    Args:
+        workers (int): Items handled concurrently
+        budget (PauseBudget): Budget to share with other work (default: a new one of max_pause_seconds)
+
+    Yields:
+        tuple: (item, result) in input order
+    """
+    items = list(items)
+    budget = budget or PauseBudget(max_pause_seconds)
+
+    def run(item):
+        return call_with_requeue(lambda: handler(item), budget)
+
+    if workers <= 1:
+        for item in items:
+            yield item, run(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(run, item) for item in items]
+        for item, future in zip(items, futures):
+            yield item, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
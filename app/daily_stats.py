@@ -0,0 +1,188 @@
+"""
+Daily rollups of fax and SMS counts for the dashboard
+
+DailyStat holds one count per (kind, day, status, device_type, provider,
+direction). It is adjusted in the same transaction as the rows it counts:
+inserts arrive through post_save and the BufferedRecordWriter
+records_written signal, status changes through the statuses_changed signal
+of apply_status_updates. The dashboard reads only DailyStat, so its cost
+grows with the number of days shown, not with the number of faxes.
+
+Writes that bypass those paths (QuerySet.update of status, raw SQL) are
+repaired by `manage.py backfill_daily_stats`.
+"""
+import logging
+from collections import Counter
+from datetime import datetime, time, timedelta
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import ArchivedRecord, DailyStat, FaxRecord, SMSRecord
+
+logger = logging.getLogger(__name__)
+
+KINDS = {'fax': FaxRecord, 'sms': SMSRecord}
+DIMENSIONS = ('device_type', 'provider', 'direction')
+
+
+def _kind(model):
+    for kind, kind_model in KINDS.items():
+        if model is kind_model:
+            return kind
+    raise ValueError(f"No daily stats for {model.__name__}")
+
+
+def _dimensions(model):
+    names = {field.name for field in model._meta.concrete_fields}
+    return [dimension for dimension in DIMENSIONS if dimension in names]
+
+
+def _day(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def rollup_key(record, status=None):
+    """(day, status, device_type, provider, direction) a record counts under"""
+    return (
+        _day(record.created_at),
+        status or record.status,
+        *((getattr(record, dimension, None) or '') for dimension in DIMENSIONS),
+    )
+
+
+def apply_deltas(kind, deltas, using=None):
+    """
+    Add each delta to its DailyStat row, creating rows as needed
+
+    Args:
+        kind (str): 'fax' or 'sms'
+        deltas (Counter): rollup_key -> change in count
+        using (str): Database alias of the counted rows
+    """
+    using = using or DEFAULT_DB_ALIAS
+    stats = DailyStat.objects.using(using)
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        day, status, device_type, provider, direction = key
+        lookup = {
+            'kind': kind, 'day': day, 'status': status,
+            'device_type': device_type, 'provider': provider, 'direction': direction,
+        }
+        if stats.filter(**lookup).update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                stats.create(count=delta, **lookup)
+        except IntegrityError:
+            # Created concurrently; add to it instead
+            stats.filter(**lookup).update(count=F('count') + delta)
+
+
+def count_inserted(model, records, using=None):
+    """Count newly written records"""
+    apply_deltas(_kind(model), Counter(rollup_key(record) for record in records), using)
+
+
+def count_status_changes(model, changes, using=None):
+    """Move records from their old status to their new one"""
+    deltas = Counter()
+    for record, old_status in changes:
+        deltas[rollup_key(record, old_status)] -= 1
+        deltas[rollup_key(record)] += 1
+    apply_deltas(_kind(model), deltas, using)
+
+
+def default_backfill_start():
+    """
+    First day backfill_daily_stats recomputes by default
+
+    Archived rows are no longer in the hot tables, so days up to the latest
+    archived row keep the counts they had when the rows were archived.
+    """
+    latest = ArchivedRecord.objects.order_by('-created_at').values_list('created_at', flat=True).first()
+    return _day(latest) + timedelta(days=1) if latest else None
+
+
+def backfill(kind, since=None):
+    """
+    Recompute a kind's rollups from its table with one GROUP BY
+
+    Args:
+        kind (str): 'fax' or 'sms'
+        since (date): Only recompute this day and later (default: every day)
+
+    Returns:
+        int: DailyStat rows written
+    """
+    model = KINDS[kind]
+    dimensions = _dimensions(model)
+    records = model.objects.all()
+    stats = DailyStat.objects.filter(kind=kind)
+    if since:
+        start = datetime.combine(since, time.min)
+        if timezone.is_naive(start) and timezone.is_aware(timezone.now()):
+            start = timezone.make_aware(start)
+        records = records.filter(created_at__gte=start)
+        stats = stats.filter(day__gte=since)
+
+    groups = records.annotate(day=TruncDate('created_at')).values('day', 'status', *dimensions).annotate(
+        total=Count('id')
+    ).order_by()
+    rows = [
+        DailyStat(
+            kind=kind, day=group['day'], status=group['status'], count=group['total'],
+            **{dimension: group.get(dimension) or '' for dimension in DIMENSIONS}
+        )
+        for group in groups
+    ]
+    with transaction.atomic():
+        stats.delete()
+        DailyStat.objects.bulk_create(rows, batch_size=500)
+    logger.info(f"Backfilled {len(rows)} {kind} daily stats rows")
+    return len(rows)
+
+
+def summary(days=30, today=None):
+    """
+    Dashboard metrics for the last `days` days, read from DailyStat only
+
+    Returns:
+        dict: Per kind, the total, breakdowns by status and attribute, and a
+        per-day series by status (days without activity included as zeros)
+    """
+    today = today or timezone.localdate()
+    since = today - timedelta(days=days - 1)
+    result = {'since': since.isoformat(), 'until': today.isoformat(), 'days': days}
+    for kind, model in KINDS.items():
+        result[kind] = {
+            'total': 0,
+            'by_status': Counter(),
+            **{f"by_{dimension}": Counter() for dimension in _dimensions(model)},
+            'daily': {since + timedelta(days=offset): Counter() for offset in range(days)},
+        }
+
+    rows = DailyStat.objects.filter(kind__in=list(KINDS), day__gte=since, day__lte=today).values_list(
+        'kind', 'day', 'status', *DIMENSIONS, 'count'
+    )
+    for kind, day, status, device_type, provider, direction, count in rows:
+        totals = result[kind]
+        totals['total'] += count
+        totals['by_status'][status] += count
+        totals['daily'][day][status] += count
+        for dimension, value in zip(DIMENSIONS, (device_type, provider, direction)):
+            if f"by_{dimension}" in totals:
+                totals[f"by_{dimension}"][value or 'unknown'] += count
+
+    for kind in KINDS:
+        totals = result[kind]
+        for name in list(totals):
+            if name.startswith('by_'):
+                totals[name] = {key: value for key, value in totals[name].items() if value}
+        totals['daily'] = [
+            {'day': day.isoformat(), 'total': sum(by_status.values()),
+             'by_status': {status: value for status, value in by_status.items() if value}}
+            for day, by_status in totals['daily'].items()
+        ]
+    return result
@@ -0,0 +1,26 @@
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Apply SQLITE_PRAGMAS to each new SQLite connection
+
+    Connected to connection_created. journal_mode=WAL is stored in the
+    database file, the other pragmas last for the connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+            if name == 'journal_mode':
+                mode = cursor.fetchone()[0]
+                # In-memory databases (e.g. the test database) cannot use WAL
+                if str(mode).lower() != str(value).lower():
+                    logger.debug(f"SQLite journal_mode is {mode}, not {value}")
@@ -0,0 +1,283 @@
+"""
+Keep the exact bytes of every faxed document for resends
+
+Documents are stored once per SHA-256 under DOCUMENT_STORE_ROOT/<hash[:2]>/,
+compressed with zstd when the zstandard package is installed and gzip
+otherwise, and indexed by DocumentBlob. FaxRecord.document points at the
+blob that was sent, so a resend or a retry sends those bytes again instead
+of regenerating the document from its template.
+
+Documents are hashed, compressed and read back in chunks, so a large
+document is never held in memory whole.
+
+The store is bounded by DOCUMENT_STORE_MAX_BYTES of compressed data: when a
+new document pushes it over, the least recently sent or resent documents
+are evicted and the faxes that pointed at them lose their document. Since
+the documents hold PHI, any not sent or resent for DOCUMENT_STORE_MAX_AGE
+seconds are evicted too, on the next store or by `manage.py evict_documents`.
+"""
+import os
+import gzip
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Sum
+from django.utils import timezone
+from .media_stage import hash_document, hash_lock
+from .models import DocumentBlob
+from .multipart_upload import document_name, guess_content_type, open_document
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+
+CHUNK_SIZE = 1024 * 1024
+
+# A document read back stays in memory up to this size, then spills to a temporary file
+SPOOL_MAX_BYTES = 1024 * 1024
+
+# What a missing, truncated or corrupt blob raises while it is decompressed
+READ_ERRORS = (OSError, RuntimeError, EOFError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# One eviction pass at a time per process
+_evict_lock = threading.Lock()
+
+
+def document_store_root():
+    return getattr(settings, 'DOCUMENT_STORE_ROOT', os.path.join(settings.BASE_DIR, 'documents'))
+
+
+def document_store_codec():
+    """'zstd' or 'gzip', per DOCUMENT_STORE_COMPRESSION and whether zstandard is installed"""
+    codec = getattr(settings, 'DOCUMENT_STORE_COMPRESSION', 'auto')
+    if codec == 'auto':
+        return 'zstd' if zstandard is not None else 'gzip'
+    if codec == 'zstd' and zstandard is None:
+        raise RuntimeError("DOCUMENT_STORE_COMPRESSION is 'zstd' but the zstandard package is not installed")
+    return codec
+
+
+def _compressor(out, codec):
+    """Writable that compresses into the open file out and finishes the stream on close, leaving out open"""
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).stream_writer(out, closefd=False)
+    return gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6)
+
+
+def _decompressor(path):
+    """Readable of the original bytes of a stored blob"""
+    if path.endswith(EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {path} needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return gzip.open(path, 'rb')
+
+
+class DocumentStore:
+    """
+    Content-addressed, size-bounded store of faxed documents
+
+    Args:
+        root (str): Directory of the blobs (default DOCUMENT_STORE_ROOT)
+        max_bytes (int): Compressed bytes kept before evicting (default DOCUMENT_STORE_MAX_BYTES)
+        max_age (int): Seconds an unused document is kept (default DOCUMENT_STORE_MAX_AGE; 0 keeps them)
+    """
+
+    def __init__(self, root=None, max_bytes=None, max_age=None):
+        self.root = root or document_store_root()
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(
+            settings, 'DOCUMENT_STORE_MAX_BYTES', 2 * 1024 ** 3
+        )
+        self.max_age = max_age if max_age is not None else getattr(settings, 'DOCUMENT_STORE_MAX_AGE', 30 * 86400)
+
+    def _path(self, blob):
+        return os.path.join(self.root, blob.path)
+
+    def put(self, document, filename=None):
+        """
+        Store a document unless the same bytes are already stored
+
+        Args:
+            document: Bytes, a file path or a file-like object
+            filename (str): Name to resend it under; defaults to the document's own name
+
+        Returns:
+            DocumentBlob: The stored document, marked as just used
+        """
+        filename = filename or document_name(document)
+        content_hash, size = hash_document(document)
+
+        with hash_lock(content_hash):
+            blob = DocumentBlob.objects.filter(content_hash=content_hash).first()
+            if blob and os.path.exists(self._path(blob)):
+                blob.last_used_at = timezone.now()
+                DocumentBlob.objects.filter(pk=blob.pk).update(last_used_at=blob.last_used_at)
+                return blob
+
+            codec = document_store_codec()
+            relative_path = os.path.join(content_hash[:2], f"{content_hash}{EXTENSIONS[codec]}")
+            path = os.path.join(self.root, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            file_obj, owns_file = open_document(document)
+            start = file_obj.tell() if hasattr(file_obj, 'tell') else 0
+            try:
+                with open(tmp_path, 'wb') as out:
+                    with _compressor(out, codec) as writer:
+                        for chunk in iter(lambda: file_obj.read(CHUNK_SIZE), b''):
+                            writer.write(chunk)
+                stored_size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if owns_file:
+                    file_obj.close()
+                else:
+                    file_obj.seek(start)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            values = {
+                'filename': filename,
+                'content_type': guess_content_type(filename),
+                'size': size,
+                'stored_size': stored_size,
+                'path': relative_path,
+                'last_used_at': timezone.now(),
+            }
+            try:
+                blob, _ = DocumentBlob.objects.update_or_create(content_hash=content_hash, defaults=values)
+            except IntegrityError:
+                # Another process stored the same bytes first
+                blob = DocumentBlob.objects.get(content_hash=content_hash)
+
+        logger.info(f"Stored {filename} ({size} bytes, {stored_size} compressed) as document {content_hash[:12]}")
+        self.evict(keep=[blob.pk])
+        return blob
+
+    def read(self, blob):
+        """
+        A reader over a stored document, marking it as used
+
+        The document is decompressed in chunks into a temporary file (kept in
+        memory while small) and checked against its hash before it is handed
+        out. One reader must not be shared between threads; pass each its own,
+        or a file path.
+
+        Returns:
+            file: Seekable binary file at the start of the document, for the
+            caller to close; None if the blob's file is gone or damaged
+        """
+        path = self._path(blob)
+        reader = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        digest = hashlib.sha256()
+        try:
+            with _decompressor(path) as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    reader.write(chunk)
+        except READ_ERRORS as e:
+            reader.close()
+            logger.error(f"Could not read document {blob.content_hash[:12]} from {path}: {str(e)}")
+            return None
+        if digest.hexdigest() != blob.content_hash:
+            reader.close()
+            logger.error(f"Document {blob.content_hash[:12]} at {path} does not match its hash")
+            return None
+        reader.seek(0)
+        DocumentBlob.objects.filter(pk=blob.pk).update(last_used_at=timezone.now())
+        return reader
+
+    def stored_bytes(self):
+        return DocumentBlob.objects.aggregate(total=Sum('stored_size'))['total'] or 0
+
+    def _delete(self, blob):
+        """Remove a blob's file and row; False if the file could not be removed"""
+        try:
+            os.remove(self._path(blob))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not evict document {blob.content_hash[:12]}: {str(e)}")
+            return False
+        try:
+            os.rmdir(os.path.dirname(self._path(blob)))
+        except OSError:
+            pass  # Still holds other documents
+        # FaxRecord.document is set to NULL for the faxes that used it
+        blob.delete()
+        return True
+
+    def evict_expired(self, keep=()):
+        """
+        Delete documents not used for max_age seconds
+
+        Args:
+            keep (list): DocumentBlob IDs never to evict
+
+        Returns:
+            int: Documents evicted
+        """
+        if not self.max_age:
+            return 0
+        cutoff = timezone.now() - timedelta(seconds=self.max_age)
+        evicted = 0
+        skipped = []
+        while True:
+            batch = list(
+                DocumentBlob.objects.filter(last_used_at__lt=cutoff).exclude(pk__in=[*keep, *skipped]).order_by('id')[:100]
+            )
+            if not batch:
+                break
+            for blob in batch:
+                if self._delete(blob):
+                    evicted += 1
+                else:
+                    skipped.append(blob.pk)
+        if evicted:
+            logger.info(f"Evicted {evicted} documents unused for over {self.max_age} seconds from the document store")
+        return evicted
+
+    def evict(self, keep=()):
+        """
+        Delete expired documents, then least recently used ones until the store fits in max_bytes
+
+        Args:
+            keep (list): DocumentBlob IDs never to evict, e.g. the one just stored
+
+        Returns:
+            int: Documents evicted
+        """
+        with _evict_lock:
+            evicted = self.evict_expired(keep)
+            excess = self.stored_bytes() - self.max_bytes
+            if excess <= 0:
+                return evicted
+            evicted_for_size = 0
+            skipped = []
+            while excess > 0:
+                # Deleted in small batches rather than while a cursor over the table is open
+                batch = list(
+                    DocumentBlob.objects.exclude(pk__in=[*keep, *skipped]).order_by('last_used_at', 'id')[:100]
+                )
+                if not batch:
+                    break
+                for blob in batch:
+                    if excess <= 0:
+                        break
+                    if not self._delete(blob):
+                        skipped.append(blob.pk)
+                        continue
+                    excess -= blob.stored_size
+                    evicted_for_size += 1
+            if evicted_for_size:
+                logger.info(f"Evicted {evicted_for_size} least recently used documents from the document store")
+            return evicted + evicted_for_size
@@ -0,0 +1,253 @@
+"""
+Stream fax and SMS history as CSV or XLSX
+
+Rows are read with QuerySet.iterator(chunk_size=EXPORT_CHUNK_SIZE) and
+encoded as they arrive, so an export starts downloading with the first
+chunk and holds only one chunk in memory however many rows it covers.
+
+XLSX files are written with the standard library: the worksheets are
+deflated straight into a zip that is written to a non-seekable buffer
+(so each entry's sizes follow its data) and the buffer is drained after
+every chunk. Worksheets roll over at Excel's row limit; the workbook part
+listing them is written last, once their number is known.
+"""
+import io
+import re
+import csv
+import zipfile
+from datetime import date, datetime, time, timedelta
+from xml.sax.saxutils import escape
+from django.conf import settings
+from django.utils import timezone
+from .models import FaxRecord, SMSRecord
+
+# kind -> (model, exported columns)
+EXPORTS = {
+    'fax': (FaxRecord, (
+        'fax_id', 'direction', 'status', 'provider', 'to_number', 'from_number', 'patient_name',
+        'device_type', 'subject', 'num_pages', 'created_at', 'status_updated_at',
+    )),
+    'sms': (SMSRecord, (
+        'sid', 'status', 'to_number', 'from_number', 'message', 'created_at', 'status_updated_at',
+    )),
+}
+
+FORMATS = ('csv', 'xlsx')
+
+# Rows per worksheet, after the header row
+XLSX_MAX_ROWS = 1048576 - 1
+
+# Characters XML 1.0 does not allow, even escaped
+INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+class ExportError(ValueError):
+    """Invalid export filters"""
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"{name} must be a date like 2024-01-31")
+
+
+def _start_of(day):
+    start = datetime.combine(day, time.min)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def export_queryset(kind, params):
+    """
+    Rows of one kind matching the request filters, newest first
+
+    Args:
+        kind (str): 'fax' or 'sms'
+        params (QueryDict): 'since' and 'until' (inclusive dates), 'status'
+            (comma separated), and for faxes 'device' and 'direction'
+
+    Returns:
+        QuerySet: values_list of the exported columns
+    """
+    model, columns = EXPORTS[kind]
+    rows = model.objects.all()
+    if params.get('since'):
+        rows = rows.filter(created_at__gte=_start_of(_parse_date(params['since'], 'since')))
+    if params.get('until'):
+        rows = rows.filter(created_at__lt=_start_of(_parse_date(params['until'], 'until') + timedelta(days=1)))
+    statuses = [status for status in params.get('status', '').split(',') if status]
+    if statuses:
+        rows = rows.filter(status__in=statuses)
+    if kind == 'fax':
+        if params.get('device'):
+            rows = rows.filter(device_type=params['device'])
+        if params.get('direction'):
+            rows = rows.filter(direction=params['direction'])
+    return rows.order_by('-created_at', '-id').values_list(*columns)
+
+
+def _local(value):
+    return timezone.localtime(value) if timezone.is_aware(value) else value
+
+
+def _chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def stream_csv(rows, columns):
+    """Yield CSV text, one chunk of rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    chunk_size = _chunk_size()
+    for count, row in enumerate(rows.iterator(chunk_size=chunk_size), 1):
+        writer.writerow([
+            _local(value).isoformat(sep=' ', timespec='seconds') if isinstance(value, datetime) else value
+            for value in row
+        ])
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ZipBuffer:
+    """Write-only, non-seekable sink for ZipFile, drained as the zip is written"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _cell(value):
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        serial = (_local(value).replace(tzinfo=None) - EXCEL_EPOCH) / timedelta(days=1)
+        return f'<c s="1"><v>{serial:.8f}</v></c>'
+    text = escape(INVALID_XML_RE.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(values):
+    return f"<row>{''.join(_cell(value) for value in values)}</row>"
+
+
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews><sheetData>'
+)
+SHEET_END = '</sheetData></worksheet>'
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _workbook_parts(sheet_names):
+    sheets = ''.join(
+        f'<sheet name="{escape(name)}" sheetId="{index}" r:id="rId{index}"/>'
+        for index, name in enumerate(sheet_names, 1)
+    )
+    sheet_rels = ''.join(
+        f'<Relationship Id="rId{index}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{index}.xml"/>'
+        for index in range(1, len(sheet_names) + 1)
+    )
+    sheet_types = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{index}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for index in range(1, len(sheet_names) + 1)
+    )
+    xml = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    return {
+        'xl/workbook.xml': (
+            f'{xml}<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets>{sheets}</sheets></workbook>'
+        ),
+        'xl/_rels/workbook.xml.rels': (
+            f'{xml}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{sheet_rels}'
+            f'<Relationship Id="rId{len(sheet_names) + 1}" '
+            f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+            f'</Relationships>'
+        ),
+        'xl/styles.xml': STYLES,
+        '_rels/.rels': (
+            f'{xml}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            f'Target="xl/workbook.xml"/></Relationships>'
+        ),
+        '[Content_Types].xml': (
+            f'{xml}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            f'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            f'<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            f'<Override PartName="/xl/styles.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{sheet_types}</Types>'
+        ),
+    }
+
+
+def stream_xlsx(rows, columns, title='Export'):
+    """Yield the bytes of an XLSX workbook, one chunk of rows at a time"""
+    buffer = _ZipBuffer()
+    chunk_size = _chunk_size()
+    header = _row(columns).encode('utf-8')
+    sheet_names = []
+    rows = rows.iterator(chunk_size=chunk_size)
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as workbook:
+        pending = next(rows, None)
+        while pending is not None or not sheet_names:
+            sheet_names.append(title if not sheet_names else f"{title} {len(sheet_names) + 1}")
+            with workbook.open(f"xl/worksheets/sheet{len(sheet_names)}.xml", 'w') as sheet:
+                sheet.write(SHEET_START.encode('utf-8'))
+                sheet.write(header)
+                lines = []
+                written = 0
+                while pending is not None and written < XLSX_MAX_ROWS:
+                    lines.append(_row(pending))
+                    written += 1
+                    pending = next(rows, None)
+                    if len(lines) == chunk_size:
+                        sheet.write(''.join(lines).encode('utf-8'))
+                        lines = []
+                        yield buffer.drain()
+                sheet.write(''.join(lines).encode('utf-8'))
+                sheet.write(SHEET_END.encode('utf-8'))
+            yield buffer.drain()
+        for name, xml in _workbook_parts(sheet_names).items():
+            workbook.writestr(name, xml)
+    yield buffer.drain()
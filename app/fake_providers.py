@@ -0,0 +1,549 @@
+"""
+Local stand-in for the HumbleFax, Telnyx and Twilio APIs.
+
+Implements the endpoints the provider clients in this app call, with
+configurable latency, injected errors and rate limiting, and record/replay
+of sanitized real responses. Run it with `python manage.py fake_providers`
+and point the *_BASE_URL settings at it.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+import itertools
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ('humblefax', 'telnyx', 'twilio', 'lookups')
+
+DEFAULT_UPSTREAMS = {
+    'humblefax': 'https://api.humblefax.com',
+    'telnyx': 'https://api.telnyx.com',
+    'twilio': 'https://api.twilio.com',
+    'lookups': 'https://lookups.twilio.com',
+}
+
+# (method, path pattern, provider, route name)
+ROUTES = [
+    ('POST', r'^/tmpFax$', 'humblefax', 'create_tmp_fax'),
+    ('POST', r'^/attachment/(?P<id>[^/]+)$', 'humblefax', 'upload_attachment'),
+    ('POST', r'^/tmpFax/(?P<id>[^/]+)/send$', 'humblefax', 'send_tmp_fax'),
+    ('GET', r'^/sentFaxes$', 'humblefax', 'list_sent_faxes'),
+    ('GET', r'^/sentFax/(?P<id>[^/]+)$', 'humblefax', 'get_sent_fax'),
+    ('GET', r'^/incomingFaxes$', 'humblefax', 'list_incoming_faxes'),
+    ('GET', r'^/account$', 'humblefax', 'get_humblefax_account'),
+    ('POST', r'^/v2/faxes$', 'telnyx', 'create_telnyx_fax'),
+    ('GET', r'^/v2/faxes$', 'telnyx', 'list_telnyx_faxes'),
+    ('GET', r'^/v2/faxes/(?P<id>[^/]+)$', 'telnyx', 'get_telnyx_fax'),
+    ('POST', r'^/v2/media$', 'telnyx', 'upload_telnyx_media'),
+    ('POST', r'^/2010-04-01/Accounts/(?P<sid>[^/]+)/Messages\.json$', 'twilio', 'create_message'),
+    ('GET', r'^/2010-04-01/Accounts/(?P<sid>[^/]+)\.json$', 'twilio', 'get_twilio_account'),
+    ('GET', r'^/v2/PhoneNumbers/(?P<number>[^/]+)$', 'lookups', 'lookup_phone_number'),
+]
+ROUTES = [(method, re.compile(pattern), provider, name) for method, pattern, provider, name in ROUTES]
+
+# Keys whose values are removed from recorded responses
+SENSITIVE_KEYS = {
+    'toname', 'fromname', 'name', 'caller_name', 'friendly_name', 'message', 'body',
+    'email', 'companyinfo', 'auth_token', 'api_key', 'secret', 'uri', 'media_url',
+}
+# Keys holding provider IDs, rewritten on replay so records stay unique
+ID_KEYS = {'id', 'sid', 'sentfaxid', 'tmpfaxid', 'incomingfaxid'}
+
+PHONE_RE = re.compile(r'\+?\d[\d\-\s().]{6,}\d')
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class LatencyModel:
+    """
+    Random response delay
+
+    Spec format (all values in milliseconds):
+        fixed:50, uniform:20:200, normal:100:30, lognormal:100:0.5, exp:100
+    For lognormal the first value is the median and the second the sigma of
+    the underlying normal distribution.
+    """
+
+    def __init__(self, kind='fixed', params=(0,)):
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, spec):
+        kind, *values = spec.split(':')
+        kind = kind.lower()
+        params = tuple(float(v) for v in values)
+        expected = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exp': 1}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        return cls(kind, params)
+
+    def sample(self, rng):
+        """Return a delay in seconds"""
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            ms = rng.gauss(*self.params)
+        elif self.kind == 'lognormal':
+            median, sigma = self.params
+            ms = median * rng.lognormvariate(0, sigma)
+        else:
+            ms = rng.expovariate(1 / self.params[0]) if self.params[0] else 0
+        return max(ms, 0) / 1000.0
+
+    def __str__(self):
+        return ':'.join([self.kind] + [f"{p:g}" for p in self.params])
+
+
+def sanitize(value, key=None):
+    """Strip credentials, names and phone numbers from a response body"""
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v) for v in value]
+    if key and key.lower() in SENSITIVE_KEYS and isinstance(value, str):
+        return 'REDACTED'
+    if isinstance(value, str):
+        return PHONE_RE.sub('+15550000000', value)
+    return value
+
+
+class ReplayStore:
+    """Recorded responses, served round-robin per route"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._responses = {}
+        self._cycles = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        if path:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses.setdefault(entry['route'], []).append(entry)
+            self._cycles = {route: itertools.cycle(entries) for route, entries in self._responses.items()}
+            logger.info(f"Loaded {sum(len(v) for v in self._responses.values())} recorded responses from {path}")
+
+    def get(self, route):
+        with self._lock:
+            cycle = self._cycles.get(route)
+            if cycle is None:
+                return None
+            entry = next(cycle)
+            n = next(self._counter)
+        return entry['status'], self._fresh_ids(entry['body'], n), entry.get('headers', {})
+
+    def _fresh_ids(self, value, n):
+        if isinstance(value, dict):
+            return {
+                k: (f"{v}-r{n}" if k.lower() in ID_KEYS and isinstance(v, (str, int)) else self._fresh_ids(v, n))
+                for k, v in value.items()
+            }
+        if isinstance(value, list):
+            return [self._fresh_ids(v, n) for v in value]
+        return value
+
+
+class FakeProviderState:
+    """In-memory provider state shared by all request threads"""
+
+    def __init__(self, delivery_seconds=5.0, failure_rate=0.0, rng=None):
+        self.delivery_seconds = delivery_seconds
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.tmp_faxes = {}
+        self.sent_faxes = {}
+        self.telnyx_faxes = {}
+        self.telnyx_media = {}
+        self.messages = {}
+        self.counters = {}
+        self._ids = itertools.count(100000)
+
+    def next_id(self):
+        return next(self._ids)
+
+    def count(self, route):
+        with self.lock:
+            self.counters[route] = self.counters.get(route, 0) + 1
+
+    def delivery_status(self, created, done='delivered', failed='failed', in_progress='sending', outcome=None):
+        if time.time() - created < self.delivery_seconds:
+            return in_progress
+        return failed if outcome == 'failed' else done
+
+    def outcome(self):
+        return 'failed' if self.rng.random() < self.failure_rate else 'delivered'
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=None, error_rate=0.0, rate_limit_rate=0.0, retry_after=1,
+                 replay_path=None, record_path=None, upstreams=None, seed=None,
+                 delivery_seconds=5.0, failure_rate=0.0):
+        super().__init__(address, FakeProviderHandler)
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.latency = latency or {}
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.replay = ReplayStore(replay_path)
+        self.record_path = record_path
+        self.record_lock = threading.Lock()
+        self.upstreams = dict(DEFAULT_UPSTREAMS, **(upstreams or {}))
+        self.upstream_session = requests.Session() if record_path else None
+        self.state = FakeProviderState(delivery_seconds, failure_rate, random.Random(seed))
+
+    def latency_for(self, provider):
+        return self.latency.get(provider) or self.latency.get('default')
+
+    def random(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def sample_latency(self, provider):
+        model = self.latency_for(provider)
+        if not model:
+            return 0
+        with self.rng_lock:
+            return model.sample(self.rng)
+
+    def record(self, route, method, status, body, headers):
+        entry = {
+            'route': route,
+            'method': method,
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() in ('content-type', 'retry-after')},
+            'body': sanitize(body),
+            'recorded_at': _now_iso(),
+        }
+        with self.record_lock:
+            with open(self.record_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeProviders/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _read_body(self, keep_all=False):
+        # Read in blocks so large attachments are never held in memory
+        remaining = int(self.headers.get('Content-Length') or 0)
+        chunks = [] if keep_all or remaining <= 1024 * 1024 else None
+        received = 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            received += len(chunk)
+            remaining -= len(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+        return (b''.join(chunks) if chunks is not None else b''), received
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            if name.lower() not in ('content-type', 'content-length'):
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _dispatch(self, method):
+        server = self.server
+        parts = urlsplit(self.path)
+        raw_body, body_size = self._read_body(keep_all=bool(server.record_path))
+
+        for route_method, pattern, provider, name in ROUTES:
+            match = pattern.match(parts.path)
+            if route_method == method and match:
+                break
+        else:
+            self._send_json(404, {'errors': [{'detail': f"No fake route for {method} {parts.path}"}]})
+            return
+
+        server.state.count(name)
+        delay = server.sample_latency(provider)
+        if delay:
+            time.sleep(delay)
+
+        roll = server.random()
+        if roll < server.rate_limit_rate:
+            self._send_json(429, {'errors': [{'code': '429', 'detail': 'Too many requests'}]},
+                            {'Retry-After': str(server.retry_after)})
+            return
+        if roll < server.rate_limit_rate + server.error_rate:
+            self._send_json(503, {'errors': [{'code': '503', 'detail': 'Injected provider error'}]})
+            return
+
+        if server.record_path:
+            self._proxy(method, provider, name, parts, raw_body)
+            return
+
+        replayed = server.replay.get(name)
+        if replayed:
+            status, body, headers = replayed
+            self._send_json(status, body, headers)
+            return
+
+        request = {
+            'params': match.groupdict(),
+            'query': {k: v[-1] for k, v in parse_qs(parts.query).items()},
+            'body': raw_body,
+            'body_size': body_size,
+        }
+        status, body = getattr(self, f"_handle_{name}")(request)
+        self._send_json(status, body)
+
+    def _proxy(self, method, provider, name, parts, raw_body):
+        """Forward to the real provider and record the sanitized response"""
+        server = self.server
+        url = f"{server.upstreams[provider].rstrip('/')}{parts.path}"
+        if parts.query:
+            url = f"{url}?{parts.query}"
+        headers = {k: v for k, v in self.headers.items() if k.lower() in ('authorization', 'content-type', 'accept')}
+        try:
+            response = server.upstream_session.request(method, url, headers=headers, data=raw_body, timeout=60)
+        except requests.RequestException as e:
+            self._send_json(502, {'errors': [{'detail': f"Upstream request failed: {str(e)}"}]})
+            return
+        try:
+            body = response.json()
+        except ValueError:
+            body = {'raw': response.text}
+        server.record(name, method, response.status_code, body, response.headers)
+        self._send_json(response.status_code, body, {k: v for k, v in response.headers.items() if k.lower() == 'retry-after'})
+
+    def _json_body(self, request):
+        try:
+            return json.loads(request['body'] or b'{}')
+        except ValueError:
+            return {}
+
+    # HumbleFax
+
+    def _handle_create_tmp_fax(self, request):
+        state = self.server.state
+        payload = self._json_body(request)
+        tmp_fax_id = state.next_id()
+        with state.lock:
+            state.tmp_faxes[str(tmp_fax_id)] = {'payload': payload, 'attachments': 0, 'bytes': 0}
+        return 200, {'result': 'success', 'data': {'tmpFax': {'id': tmp_fax_id}}}
+
+    def _handle_upload_attachment(self, request):
+        state = self.server.state
+        with state.lock:
+            tmp_fax = state.tmp_faxes.get(request['params']['id'])
+            if tmp_fax is None:
+                return 404, {'result': 'error', 'message': 'tmpFax not found'}
+            tmp_fax['attachments'] += 1
+            tmp_fax['bytes'] += request['body_size']
+        return 200, {'result': 'success', 'data': {'attachment': {'size': request['body_size']}}}
+
+    def _handle_send_tmp_fax(self, request):
+        state = self.server.state
+        with state.lock:
+            tmp_fax = state.tmp_faxes.pop(request['params']['id'], None)
+            if tmp_fax is None:
+                return 404, {'result': 'error', 'message': 'tmpFax not found'}
+            sent_fax_id = state.next_id()
+            payload = tmp_fax['payload']
+            state.sent_faxes[str(sent_fax_id)] = {
+                'id': sent_fax_id,
+                'toNumber': (payload.get('recipients') or [''])[0],
+                'fromNumber': payload.get('fromNumber', ''),
+                'subject': payload.get('subject', ''),
+                'numPages': max(tmp_fax['attachments'], 1),
+                'createdAt': _now_iso(),
+                'created': time.time(),
+                'outcome': state.outcome(),
+            }
+        return 200, {'result': 'success', 'data': {'sentFax': {'id': sent_fax_id}}}
+
+    def _humblefax_status(self, fax):
+        return self.server.state.delivery_status(fax['created'], 'success', 'failure', 'in progress', fax['outcome'])
+
+    def _public_sent_fax(self, fax):
+        data = {k: v for k, v in fax.items() if k not in ('created', 'outcome')}
+        data['status'] = self._humblefax_status(fax)
+        return data
+
+    def _handle_list_sent_faxes(self, request):
+        state = self.server.state
+        limit = int(request['query'].get('limit', 50))
+        offset = int(request['query'].get('offset', 0))
+        with state.lock:
+            ids = sorted(state.sent_faxes, key=int, reverse=True)[offset:offset + limit]
+        return 200, {'result': 'success', 'data': {'sentFaxIds': [int(i) for i in ids]}}
+
+    def _handle_get_sent_fax(self, request):
+        state = self.server.state
+        with state.lock:
+            fax = state.sent_faxes.get(request['params']['id'])
+        if fax is None:
+            return 404, {'result': 'error', 'message': 'sentFax not found'}
+        return 200, {'result': 'success', 'data': {'sentFax': self._public_sent_fax(fax)}}
+
+    def _handle_list_incoming_faxes(self, request):
+        return 200, {'result': 'success', 'data': {'incomingFaxIds': []}}
+
+    def _handle_get_humblefax_account(self, request):
+        return 200, {'result': 'success', 'data': {'account': {'name': 'Fake HumbleFax account', 'credits': 1000000}}}
+
+    # Telnyx
+
+    def _public_telnyx_fax(self, fax):
+        state = self.server.state
+        data = {k: v for k, v in fax.items() if k not in ('created', 'outcome')}
+        data['status'] = state.delivery_status(fax['created'], 'delivered', 'failed', 'sending', fax['outcome'])
+        return data
+
+    def _handle_create_telnyx_fax(self, request):
+        state = self.server.state
+        payload = self._json_body(request)
+        if not payload.get('to') or not (payload.get('media_url') or payload.get('media_name')):
+            return 422, {'errors': [{'code': '10015', 'detail': 'to and media_url or media_name are required'}]}
+        fax = {
+            'record_type': 'fax',
+            'id': str(uuid.uuid4()),
+            'connection_id': payload.get('connection_id'),
+            'direction': 'outbound',
+            'to': payload.get('to'),
+            'from': payload.get('from'),
+            'media_url': payload.get('media_url'),
+            'media_name': payload.get('media_name'),
+            'created_at': _now_iso(),
+            'created': time.time(),
+            'outcome': state.outcome(),
+        }
+        with state.lock:
+            state.telnyx_faxes[fax['id']] = fax
+        data = self._public_telnyx_fax(fax)
+        data['status'] = 'queued'
+        return 202, {'data': data}
+
+    def _handle_list_telnyx_faxes(self, request):
+        state = self.server.state
+        size = int(request['query'].get('page[size]', 20))
+        number = int(request['query'].get('page[number]', 1))
+        with state.lock:
+            faxes = sorted(state.telnyx_faxes.values(), key=lambda f: f['created'], reverse=True)
+        page = faxes[(number - 1) * size:number * size]
+        return 200, {
+            'data': [self._public_telnyx_fax(f) for f in page],
+            'meta': {'page_number': number, 'page_size': size, 'total_results': len(faxes),
+                     'total_pages': max((len(faxes) + size - 1) // size, 1)},
+        }
+
+    def _handle_get_telnyx_fax(self, request):
+        state = self.server.state
+        with state.lock:
+            fax = state.telnyx_faxes.get(request['params']['id'])
+        if fax is None:
+            return 404, {'errors': [{'code': '10005', 'detail': 'Resource not found'}]}
+        return 200, {'data': self._public_telnyx_fax(fax)}
+
+    def _handle_upload_telnyx_media(self, request):
+        state = self.server.state
+        # Only the small text fields ahead of the file part are parsed
+        head = request['body'][:4096].decode('utf-8', 'replace')
+        fields = dict(re.findall(r'name="([^"]+)"\r\n\r\n([^\r]*)\r\n', head))
+        media_name = fields.get('media_name') or uuid.uuid4().hex
+        ttl = int(fields.get('ttl') or 48 * 3600)
+        media = {
+            'record_type': 'media_item',
+            'media_name': media_name,
+            'content_type': 'application/pdf',
+            'created_at': _now_iso(),
+            'expires_at': datetime.fromtimestamp(time.time() + ttl, timezone.utc).isoformat().replace('+00:00', 'Z'),
+        }
+        with state.lock:
+            state.telnyx_media[media_name] = dict(media, size=request['body_size'])
+        return 201, {'data': media}
+
+    # Twilio
+
+    def _handle_create_message(self, request):
+        state = self.server.state
+        form = {k: v[-1] for k, v in parse_qs(request['body'].decode('utf-8')).items()}
+        if not form.get('To') or not form.get('Body'):
+            return 400, {'code': 21604, 'message': "A 'To' phone number and 'Body' are required.", 'status': 400}
+        sid = f"SM{uuid.uuid4().hex}"
+        message = {
+            'sid': sid,
+            'account_sid': request['params']['sid'],
+            'to': form.get('To'),
+            'from': form.get('From'),
+            'body': form.get('Body'),
+            'status': 'queued',
+            'num_segments': str(len(form.get('Body', '')) // 160 + 1),
+            'date_created': _now_iso(),
+        }
+        with state.lock:
+            state.messages[sid] = message
+        return 201, message
+
+    def _handle_get_twilio_account(self, request):
+        return 200, {'sid': request['params']['sid'], 'friendly_name': 'Fake Twilio account', 'status': 'active'}
+
+    def _handle_lookup_phone_number(self, request):
+        number = re.sub(r'\D', '', request['params']['number'])
+        if len(number) < 10:
+            return 404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404}
+        # Deterministic carrier type so repeated runs see the same numbers
+        carrier_type = {'0': 'landline', '9': 'voip'}.get(number[-1], 'mobile')
+        return 200, {
+            'phone_number': f"+{number}",
+            'country_code': 'US',
+            'valid': True,
+            'carrier': {'type': carrier_type, 'name': 'Fake Carrier', 'mobile_country_code': '310', 'mobile_network_code': '000'},
+        }
+
+
+def parse_latency_options(specs):
+    """
+    Parse latency options of the form "[provider=]spec"
+
+    Returns:
+        dict: {provider or 'default': LatencyModel}
+    """
+    latency = {}
+    for spec in specs or []:
+        provider, _, model = spec.rpartition('=')
+        provider = provider or 'default'
+        if provider != 'default' and provider not in PROVIDERS:
+            raise ValueError(f"Unknown provider in latency spec: {provider}")
+        latency[provider] = LatencyModel.parse(model)
+    return latency
@@ -0,0 +1,460 @@
+"""
+Fax providers behind one interface, and a router that spreads sends over them
+
+Each FaxProvider wraps a provider client and returns the usual result
+dicts. FaxRouter keeps exponentially weighted latency and error-rate
+statistics per provider, shared by every router in the process, and picks
+a provider for each send at random, weighted towards the faster and
+healthier one, among the providers that accept the document's content
+type (Telnyx faxes only PDFs). Each provider has its own in-flight limit,
+so a bulk job keeps both busy and gets their combined throughput. Providers
+whose circuit breaker is open are skipped, and a send that a provider
+refused without accepting the fax fails over to the next one.
+
+Every document the router sends is kept in the DocumentStore and its
+DocumentBlob returned as 'document_id', so the FaxRecord can point at the
+exact bytes and a resend sends them again.
+"""
+import re
+import time
+import random
+import logging
+import threading
+from django.conf import settings
+from .circuit_breaker import CircuitBreaker, get_breaker, process_with_requeue
+from .document_store import DocumentStore
+from .humblefax_service import HumbleFaxService
+from .media_stage import MediaStage
+from .multipart_upload import CONTENT_TYPES, document_name, guess_content_type
+from .telnyx_fax_service import TelnyxFaxService
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Providers the router may use, if configured
+    'providers': ['telnyx', 'humblefax'],
+    # Weight of the newest sample in the moving averages
+    'alpha': 0.2,
+    # An error rate of 1.0 makes a provider look this many times slower
+    'error_penalty': 4.0,
+    # Seconds assumed for a provider with no samples yet
+    'initial_latency': 2.0,
+    # Concurrent sends per provider; Telnyx defaults to TELNYX_MAX_IN_FLIGHT
+    'max_in_flight': {'humblefax': 4},
+}
+
+# Telnyx fax IDs are UUIDs; HumbleFax IDs are numeric
+TELNYX_ID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+
+
+def routing_config():
+    return dict(DEFAULTS, **getattr(settings, 'FAX_ROUTING', {}))
+
+
+def guess_provider(fax_id):
+    """Provider that issued a fax ID, for records saved before FaxRecord.provider existed"""
+    return 'telnyx' if TELNYX_ID_RE.match(fax_id or '') else 'humblefax'
+
+
+def document_content_type(document, filename=None):
+    """Content type of a document from its filename, or from its bytes when it has none"""
+    content_type = guess_content_type(filename or document_name(document))
+    if content_type == 'application/octet-stream' and isinstance(document, bytes) and document.startswith(b'%PDF-'):
+        return 'application/pdf'
+    return content_type
+
+
+class FaxProvider:
+    """
+    A fax provider as used by the views and the router
+
+    send_fax and resend return the usual result dicts ('success', 'fax_id',
+    'error', 'message', ...). A failed result has 'retryable' set when the
+    provider certainly did not accept the fax, so another provider may send
+    it without risking a duplicate.
+    """
+
+    name = None
+    # Whether the provider can fax a document it fetches from a URL
+    accepts_media_url = False
+    # Content types of the documents the provider can fax
+    accepted_content_types = frozenset({'application/pdf'})
+    # Breakers guarding the send path; the provider is skipped while any is open
+    send_endpoints = ()
+
+    def __init__(self, max_in_flight=None):
+        self.max_in_flight = max_in_flight or routing_config()['max_in_flight'].get(self.name, 4)
+
+    @property
+    def from_number(self):
+        raise NotImplementedError
+
+    def is_configured(self):
+        raise NotImplementedError
+
+    def is_available(self):
+        return all(get_breaker(name).state != CircuitBreaker.OPEN for name in self.send_endpoints)
+
+    def retry_after(self):
+        """Seconds until every send endpoint accepts requests again"""
+        return max([get_breaker(name).retry_after() for name in self.send_endpoints] or [0.0])
+
+    def send_fax(self, to_number, document=None, filename=None, media_url=None, patient_name=None):
+        """
+        Send a fax
+
+        Args:
+            to_number (str): Recipient fax number
+            document: Bytes or a file path; share bytes rather than an open file between threads
+            filename (str): Document filename
+            media_url (str): Public URL of the document, for providers that accept one
+            patient_name (str): Patient name for the fax subject
+        """
+        raise NotImplementedError
+
+    def resend(self, fax):
+        """Send a FaxRecord's document to its recipient again"""
+        raise NotImplementedError
+
+
+class HumbleFaxProvider(FaxProvider):
+    name = 'humblefax'
+    accepted_content_types = frozenset(CONTENT_TYPES.values())
+    send_endpoints = ('humblefax:tmpFax', 'humblefax:attachment')
+
+    def __init__(self, service=None, max_in_flight=None):
+        super().__init__(max_in_flight)
+        self.service = service or HumbleFaxService()
+
+    @property
+    def from_number(self):
+        return self.service.from_number
+
+    def is_configured(self):
+        return bool(self.service.access_key and self.service.secret_key)
+
+    def send_fax(self, to_number, document=None, filename=None, media_url=None, patient_name=None):
+        if document is None:
+            return {
+                'success': False,
+                'error': 'HumbleFax needs the document itself, not a URL',
+                'message': 'Failed to send fax',
+                'retryable': True
+            }
+        return self.service.send_fax(to_number, document, filename, patient_name)
+
+    def resend(self, fax):
+        result = self.service.resend_fax(fax.fax_id)
+        if result.get('success'):
+            result['fax_id'] = result.get('new_fax_id')
+        return result
+
+
+class TelnyxProvider(FaxProvider):
+    name = 'telnyx'
+    accepts_media_url = True
+    # Telnyx only faxes PDFs; Word documents must be converted first
+    accepted_content_types = frozenset({'application/pdf'})
+    send_endpoints = ('telnyx:faxes',)
+
+    def __init__(self, service=None, base_url=None, max_in_flight=None):
+        self.service = service or TelnyxFaxService()
+        self.stage = MediaStage(base_url=base_url, telnyx=self.service)
+        super().__init__(max_in_flight or getattr(settings, 'TELNYX_MAX_IN_FLIGHT', 16))
+        # The last document staged, so a bulk job hashes and uploads it once
+        self._staged_lock = threading.Lock()
+        self._staged_document = None
+        self._staged = None
+
+    @property
+    def from_number(self):
+        return self.service.from_number
+
+    def is_configured(self):
+        return bool(self.service.api_key)
+
+    def _stage(self, document, filename):
+        with self._staged_lock:
+            if self._staged_document is document:
+                return self._staged
+        # MediaStage uploads each distinct document once even when called concurrently
+        staged = self.stage.stage(document, filename)
+        if staged['success']:
+            with self._staged_lock:
+                self._staged_document, self._staged = document, staged
+        return staged
+
+    def send_fax(self, to_number, document=None, filename=None, media_url=None, patient_name=None):
+        media_kwargs, recorded = {'media_url': media_url}, {'media_url': media_url, 'media_name': None}
+        if document is not None:
+            staged = self._stage(document, filename)
+            if not staged['success']:
+                return dict(staged, retryable=True)
+            media = staged['media']
+            media_kwargs = self.stage.fax_kwargs(media)
+            recorded = {'media_url': self.stage.media_url(media), 'media_name': media.media_name}
+        return dict(self.service.send_fax(to_number, **media_kwargs), **recorded)
+
+    def resend(self, fax):
+        # Reuse the staged document while it is still stored
+        media_kwargs, recorded = {'media_url': fax.media_url}, {'media_url': fax.media_url, 'media_name': None}
+        if fax.media_name:
+            media = self.stage.find(fax.media_name)
+            if media:
+                media_kwargs = self.stage.fax_kwargs(media)
+                recorded = {'media_url': self.stage.media_url(media), 'media_name': media.media_name}
+            elif not fax.media_url:
+                return {
+                    'success': False,
+                    'error': 'The uploaded document has expired; send it again',
+                    'message': 'Failed to resend fax'
+                }
+        if not media_kwargs.get('media_url') and not media_kwargs.get('media_name'):
+            return {'success': False, 'error': 'No document to resend', 'message': 'Failed to resend fax'}
+        return dict(self.service.send_fax(fax.to_number, **media_kwargs), **recorded)
+
+
+def build_provider(name, base_url=None):
+    if name == 'telnyx':
+        return TelnyxProvider(base_url=base_url)
+    if name == 'humblefax':
+        return HumbleFaxProvider()
+    raise ValueError(f"Unknown fax provider: {name}")
+
+
+class ProviderHealth:
+    """Moving averages of send latency and error rate for one provider"""
+
+    def __init__(self, name, alpha):
+        self.name = name
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.sends = 0
+        self.failures = 0
+        self.in_flight = 0
+
+    def record(self, success, seconds=None):
+        """Record a send; seconds is None for sends rejected without a request"""
+        if seconds is not None:
+            self.latency = seconds if self.latency is None else self.alpha * seconds + (1 - self.alpha) * self.latency
+        self.error_rate = self.alpha * (0.0 if success else 1.0) + (1 - self.alpha) * self.error_rate
+        self.sends += 1
+        if not success:
+            self.failures += 1
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def _get_health(name):
+    # Callers hold _health_lock
+    health = _health.get(name)
+    if health is None:
+        health = _health[name] = ProviderHealth(name, routing_config()['alpha'])
+    return health
+
+
+class FaxRouter:
+    """
+    Pick a provider for each send from live latency and error statistics
+
+    Args:
+        names (list): Providers to route between (default FAX_ROUTING['providers']);
+            unconfigured ones are left out
+        base_url (str): Public root URL of this app, for locally staged media
+        providers (list): FaxProvider instances to use instead of building them from names
+        store (DocumentStore): Where sent documents are kept for resends
+    """
+
+    def __init__(self, names=None, base_url=None, providers=None, rng=None, store=None):
+        config = routing_config()
+        if providers is None:
+            providers = [build_provider(name, base_url) for name in (names or config['providers'])]
+        self.providers = [provider for provider in providers if provider.is_configured()]
+        self.error_penalty = config['error_penalty']
+        self.initial_latency = config['initial_latency']
+        self.rng = rng or random.Random()
+        self.store = store or DocumentStore()
+        # The last document kept, so a bulk job hashes and stores it once
+        self._kept_lock = threading.Lock()
+        self._kept_document = None
+        self._kept = None
+
+    def provider(self, name):
+        return next((provider for provider in self.providers if provider.name == name), None)
+
+    def _expected_seconds(self, health):
+        latency = health.latency if health.latency is not None else self.initial_latency
+        return max(latency, 0.001) * (1 + self.error_penalty * health.error_rate)
+
+    def _capable(self, document, content_type):
+        if document is None:
+            return [provider for provider in self.providers if provider.accepts_media_url]
+        return [provider for provider in self.providers if content_type in provider.accepted_content_types]
+
+    def _reserve(self, candidates):
+        """Pick a provider, preferring ones with free in-flight slots, and take a slot"""
+        with _health_lock:
+            entries = [(provider, _get_health(provider.name)) for provider in candidates]
+            free = [(provider, health) for provider, health in entries if health.in_flight < provider.max_in_flight]
+            entries = free or entries
+            weights = [1 / self._expected_seconds(health) for _, health in entries]
+            provider, health = self.rng.choices(entries, weights)[0]
+            health.in_flight += 1
+        return provider, health
+
+    def _keep(self, document, filename):
+        """DocumentBlob holding the document, or None if it could not be stored"""
+        with self._kept_lock:
+            if self._kept_document is document:
+                return self._kept
+        try:
+            blob = self.store.put(document, filename)
+        except Exception as e:
+            # Not fatal: the fax is still sent, it just cannot be resent from the store
+            logger.warning(f"Could not store {filename or 'document'} for resends: {str(e)}")
+            return None
+        with self._kept_lock:
+            self._kept_document, self._kept = document, blob
+        return blob
+
+    def send(self, to_number, document=None, filename=None, media_url=None, patient_name=None):
+        """
+        Send a fax through the best available provider, failing over if it refuses
+
+        Returns:
+            dict: The provider's result, plus 'provider', 'from_number' and
+            'document_id' (the stored DocumentBlob, when a document was sent)
+        """
+        content_type = document_content_type(document, filename) if document is not None else None
+        capable = self._capable(document, content_type)
+        if not capable:
+            if not self.providers:
+                error = 'No fax provider is configured'
+            elif document is None:
+                error = 'No configured fax provider can send from a URL; upload the document instead'
+            else:
+                error = f"No configured fax provider can send {content_type} documents"
+            return {'success': False, 'error': error, 'message': 'Failed to send fax'}
+
+        blob = self._keep(document, filename) if document is not None else None
+        document_id = blob.pk if blob else None
+
+        tried = set()
+        result = None
+        while True:
+            candidates = [provider for provider in capable if provider.name not in tried and provider.is_available()]
+            if not candidates:
+                break
+            provider, health = self._reserve(candidates)
+            tried.add(provider.name)
+            start = time.monotonic()
+            try:
+                result = provider.send_fax(to_number, document=document, filename=filename,
+                                           media_url=media_url, patient_name=patient_name)
+            except Exception as e:
+                logger.error(f"Error sending fax to {to_number} via {provider.name}: {str(e)}")
+                result = {'success': False, 'error': f"Error sending fax: {str(e)}", 'message': 'Error sending fax'}
+            with _health_lock:
+                health.in_flight -= 1
+                health.record(result['success'], None if result.get('circuit_open') else time.monotonic() - start)
+
+            result = dict(result, provider=provider.name, from_number=provider.from_number, document_id=document_id)
+            if result['success'] or not (result.get('retryable') or result.get('circuit_open')):
+                return result
+            logger.warning(f"{provider.name} did not take the fax to {to_number} ({result.get('error')}), failing over")
+
+        if result is None:
+            # Every capable provider's breaker is open
+            retry_after = min(provider.retry_after() for provider in capable)
+            return {
+                'success': False,
+                'error': 'All fax providers are temporarily unavailable',
+                'message': 'All fax providers are temporarily unavailable',
+                'circuit_open': True,
+                'retry_after': retry_after
+            }
+        return result
+
+    def send_many(self, jobs, max_pause_seconds=None):
+        """
+        Send many faxes concurrently across providers
+
+        Up to the sum of the providers' in-flight limits are sent at once.
+        While every provider is unavailable, workers wait and retry until the
+        shared pause budget (BULK_CIRCUIT_PAUSE_SECONDS) is used up; the rest
+        are deferred.
+
+        Args:
+            jobs (list): Keyword arguments for send(), one dict per fax
+
+        Yields:
+            tuple: (job, result) in input order
+        """
+        workers = max(sum(provider.max_in_flight for provider in self.providers), 1)
+        yield from process_with_requeue(
+            jobs, lambda job: self.send(**job), max_pause_seconds=max_pause_seconds, workers=workers
+        )
+
+    def stored_document(self, fax):
+        """
+        The document a FaxRecord sent, from the document store
+
+        Returns:
+            tuple: (reader, filename) with a file the caller closes, or
+            (None, None) if not stored or evicted
+        """
+        blob = fax.document if fax.document_id else None
+        reader = self.store.read(blob) if blob else None
+        if reader is None:
+            return None, None
+        return reader, blob.filename or None
+
+    def resend(self, fax):
+        """
+        Resend a FaxRecord
+
+        A fax whose document is in the store is sent again from those bytes,
+        routed like a new send. Otherwise it goes through the provider that
+        carried it, which reuses its staged media (Telnyx) or resends by fax
+        ID (HumbleFax, without the original attachment).
+
+        Returns:
+            dict: The provider's result, plus 'provider' and 'from_number'
+        """
+        reader, filename = self.stored_document(fax)
+        if reader is not None:
+            with reader:
+                return self.send(fax.to_number, document=reader, filename=filename, patient_name=fax.patient_name)
+
+        name = fax.provider or guess_provider(fax.fax_id)
+        provider = self.provider(name)
+        if provider is None:
+            return {'success': False, 'error': f"{name} is not configured", 'message': 'Failed to resend fax'}
+        try:
+            result = provider.resend(fax)
+        except Exception as e:
+            logger.error(f"Error resending fax {fax.fax_id} via {name}: {str(e)}")
+            result = {'success': False, 'error': f"Error resending fax: {str(e)}", 'message': 'Error resending fax'}
+        return dict(result, provider=name, from_number=provider.from_number)
+
+    def stats(self):
+        """Health statistics and current routing share per provider"""
+        with _health_lock:
+            entries = [(provider, _get_health(provider.name)) for provider in self.providers]
+            available = [(provider, health) for provider, health in entries if provider.is_available()]
+            total_weight = sum(1 / self._expected_seconds(health) for _, health in available)
+            return [{
+                'provider': provider.name,
+                'available': provider.is_available(),
+                'latency_ms': round(health.latency * 1000, 1) if health.latency is not None else None,
+                'error_rate': round(health.error_rate, 3),
+                'sends': health.sends,
+                'failures': health.failures,
+                'in_flight': health.in_flight,
+                'max_in_flight': provider.max_in_flight,
+                'share': round((1 / self._expected_seconds(health)) / total_weight, 3)
+                if total_weight and provider.is_available() else 0.0,
+            } for provider, health in entries]
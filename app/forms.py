@@ -233,7 +233,7 @@ class TelnyxConfigForm(forms.ModelForm):
     """Form for Telnyx API configuration"""
     class Meta:
         model = APIConfiguration
-        fields = ['api_key', 'from_number']
+        fields = ['api_key', 'from_number', 'connection_id']
         widgets = {
             'api_key': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -242,6 +242,10 @@ class TelnyxConfigForm(forms.ModelForm):
             'from_number': forms.TextInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'Enter your Telnyx phone number (e.g., +1234567890)'
+            }),
+            'connection_id': forms.TextInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'Enter your Telnyx fax application (connection) ID'
             })
         }
 
@@ -295,11 +299,20 @@ class SendFaxForm(forms.Form):
         })
     )
     media_url = forms.URLField(
+        required=False,
         widget=forms.URLInput(attrs={
             'class': 'form-control',
             'placeholder': 'Enter media URL (PDF, image, etc.)'
         })
     )
+    document = forms.FileField(
+        required=False,
+        widget=forms.FileInput(attrs={
+            'class': 'form-control',
+            'accept': '.pdf,.tif,.tiff'
+        }),
+        help_text='Or upload the document; it is staged once and reused for every recipient'
+    )
     subject = forms.CharField(
         max_length=200,
         required=False,
@@ -309,6 +322,12 @@ class SendFaxForm(forms.Form):
         })
     )
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('media_url') and not cleaned_data.get('document'):
+            raise forms.ValidationError('Enter a media URL or upload a document.')
+        return cleaned_data
+
 class SendSMSForm(forms.Form):
     """Form for sending SMS"""
     phone_number = forms.CharField(
@@ -336,11 +355,20 @@ class BulkFaxForm(forms.Form):
         })
     )
     media_url = forms.URLField(
+        required=False,
         widget=forms.URLInput(attrs={
             'class': 'form-control',
             'placeholder': 'Enter media URL (PDF, image, etc.)'
         })
     )
+    document = forms.FileField(
+        required=False,
+        widget=forms.FileInput(attrs={
+            'class': 'form-control',
+            'accept': '.pdf,.tif,.tiff'
+        }),
+        help_text='Or upload the document; it is staged once and reused for every recipient'
+    )
     subject = forms.CharField(
         max_length=200,
         required=False,
@@ -350,6 +378,12 @@ class BulkFaxForm(forms.Form):
         })
     )
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('media_url') and not cleaned_data.get('document'):
+            raise forms.ValidationError('Enter a media URL or upload a document.')
+        return cleaned_data
+
 class BulkSMSForm(forms.Form):
     """Form for bulk SMS operations"""
     phone_numbers = forms.CharField(
@@ -0,0 +1,84 @@
+"""
+Compress JSON API responses with brotli or gzip
+
+brotli is used when the brotli package is installed and the client accepts
+it, gzip otherwise. Compressed responses carry a weak ETag, as with Django's
+GZipMiddleware, since the bytes differ per encoding while the content does
+not; If-None-Match compares ETags weakly, so 304s still match.
+"""
+import gzip
+from functools import wraps
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are not worth the CPU or the header
+MIN_SIZE = 200
+
+
+def accepted_encodings(request):
+    """Content codings the client accepts, i.e. listed without q=0"""
+    accepted = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_encoding(request):
+    accepted = accepted_encodings(request)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def _weaken_etag(response):
+    if not response['ETag'].startswith('W/'):
+        response['ETag'] = f"W/{response['ETag']}"
+
+
+def compress_response(view):
+    """Decorator compressing a view's response body for clients that accept it"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        # Vary even when not compressed, so caches keep one copy per coding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.status_code == 304:
+            # Same validator as the compressed 200 it stands for
+            if choose_encoding(request) and response.has_header('ETag'):
+                _weaken_etag(response)
+            return response
+        if (response.streaming or response.status_code != 200 or response.has_header('Content-Encoding')
+                or len(response.content) < MIN_SIZE):
+            return response
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            body = brotli.compress(response.content, quality=5)
+        else:
+            body = gzip.compress(response.content, compresslevel=6, mtime=0)
+        if len(body) >= len(response.content):
+            return response
+        response.content = body
+        response['Content-Length'] = str(len(body))
+        response['Content-Encoding'] = encoding
+        if response.has_header('ETag'):
+            _weaken_etag(response)
+        return response
+    return wrapper
@@ -1,8 +1,11 @@
 import requests
 import base64
-import io
 import logging
 from django.conf import settings
+from .api_config_cache import get_api_config
+from .circuit_breaker import CircuitOpenError, circuit_open_result, get_breaker
+from .phone_numbers import digits_only
+from .multipart_upload import MultipartFileStream, document_name, guess_content_type
 
 logger = logging.getLogger(__name__)
 
@@ -14,26 +17,19 @@ class HumbleFaxService:
             self.secret_key = secret_key
             self.from_number = from_number or '+1234567890'
         else:
-            # Try to get from database first, then fall back to settings
-            try:
-                from .models import APIConfiguration
-                config = APIConfiguration.objects.filter(service='humblefax', is_active=True).first()
-                if config:
-                    self.access_key = config.api_key
-                    self.secret_key = config.secret_key
-                    self.from_number = config.from_number or '+1234567890'
-                else:
-                    # Fall back to settings
-                    self.access_key = getattr(settings, 'HUMBLEFAX_ACCESS_KEY', '')
-                    self.secret_key = getattr(settings, 'HUMBLEFAX_SECRET_KEY', '')
-                    self.from_number = getattr(settings, 'HUMBLEFAX_FROM_NUMBER', '+1234567890')
-            except:
-                # Fall back to settings if database access fails
+            # Try the cached database configuration first, then fall back to settings
+            config = get_api_config('humblefax')
+            if config:
+                self.access_key = config.api_key
+                self.secret_key = config.secret_key
+                self.from_number = config.from_number or '+1234567890'
+            else:
+                # Fall back to settings
                 self.access_key = getattr(settings, 'HUMBLEFAX_ACCESS_KEY', '')
                 self.secret_key = getattr(settings, 'HUMBLEFAX_SECRET_KEY', '')
                 self.from_number = getattr(settings, 'HUMBLEFAX_FROM_NUMBER', '+1234567890')
         
-        self.base_url = "https://api.humblefax.com"
+        self.base_url = getattr(settings, 'HUMBLEFAX_BASE_URL', "https://api.humblefax.com").rstrip('/')
         
     def _get_auth_headers(self):
         """
@@ -57,6 +53,15 @@ class HumbleFaxService:
         logger.info(f"Generated Authorization header: Basic {auth_b64[:20]}...")
         return headers
     
+    def _request(self, method, endpoint, url, **kwargs):
+        """
+        Make an API request through the circuit breaker for the endpoint
+        
+        Raises:
+            CircuitOpenError: If the endpoint's breaker is open
+        """
+        return get_breaker(f"humblefax:{endpoint}").call(requests.request, method, url, **kwargs)
+    
     def get_fax_history(self, limit=50, offset=0, direction=None):
         """
         Get fax history (both sent and received faxes)
@@ -82,9 +87,10 @@ class HumbleFaxService:
             # Get sent faxes if direction is outbound or None
             if direction in [None, 'outbound']:
                 try:
-                    logger.info("Getting sent faxes from: https://api.humblefax.com/sentFaxes")
+                    logger.info(f"Getting sent faxes from: {self.base_url}/sentFaxes")
                     
-                    response = requests.get(
+                    response = self._request(
+                        'GET', 'sentFaxes',
                         f"{self.base_url}/sentFaxes",
                         headers=headers,
                         params=params,
@@ -145,9 +151,10 @@ class HumbleFaxService:
             # Get incoming faxes if direction is inbound or None
             if direction in [None, 'inbound']:
                 try:
-                    logger.info("Getting incoming faxes from: https://api.humblefax.com/incomingFaxes")
+                    logger.info(f"Getting incoming faxes from: {self.base_url}/incomingFaxes")
                     
-                    response = requests.get(
+                    response = self._request(
+                        'GET', 'incomingFaxes',
                         f"{self.base_url}/incomingFaxes",
                         headers=headers,
                         params=params,
@@ -255,7 +262,8 @@ class HumbleFaxService:
                 try:
                     logger.info(f"Getting fax details from: {self.base_url}{endpoint}")
                     
-                    response = requests.get(
+                    response = self._request(
+                        'GET', 'faxDetail',
                         f"{self.base_url}{endpoint}",
                         headers=headers,
                         timeout=30
@@ -320,6 +328,50 @@ class HumbleFaxService:
             logger.error(f"Error getting fax detail for {fax_id}: {str(e)}")
             return None
     
+    def get_sent_fax_page(self, limit=100, offset=0):
+        """
+        Get one page of the sent fax list without fetching per-fax details
+
+        Args:
+            limit (int): Page size
+            offset (int): Offset for pagination
+
+        Returns:
+            dict: 'ids' on the page and 'faxes' (id, status, updated_at) when the
+                  API returned full records, else None; None if the request failed
+        """
+        try:
+            response = self._request(
+                'GET', 'sentFaxes',
+                f"{self.base_url}/sentFaxes",
+                headers=self._get_auth_headers(),
+                params={"limit": limit, "offset": offset},
+                timeout=30
+            )
+            if response.status_code != 200:
+                logger.warning(f"Sent faxes page returned {response.status_code}: {response.text}")
+                return None
+
+            data = response.json().get('data', {})
+            if 'sentFaxes' in data:
+                faxes = [
+                    {
+                        'id': str(fax.get('id') or fax.get('sentFaxId')),
+                        'status': fax.get('status'),
+                        'updated_at': fax.get('updatedAt') or fax.get('updated_at') or fax.get('modified'),
+                    }
+                    for fax in data['sentFaxes']
+                ]
+                return {'ids': [fax['id'] for fax in faxes], 'faxes': faxes}
+            return {'ids': [str(fax_id) for fax_id in data.get('sentFaxIds', [])], 'faxes': None}
+
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return None
+        except Exception as e:
+            logger.error(f"Error getting sent faxes page: {str(e)}")
+            return None
+
     def resend_fax(self, fax_id):
         """
         Resend a fax using the original fax ID
@@ -344,9 +396,9 @@ class HumbleFaxService:
             # Create a new temporary fax with the same details
             headers = self._get_auth_headers()
             
-            # Clean fax numbers - remove +, hyphens, spaces, and parentheses
-            clean_from_number = original_fax.get('from', self.from_number).replace('+', '').replace('-', '').replace(' ', '').replace('(', '').replace(')', '')
-            clean_to_number = original_fax.get('to', '').replace('+', '').replace(' ', '').replace('(', '').replace(')', '')
+            # Clean fax numbers - digits only
+            clean_from_number = digits_only(original_fax.get('from') or self.from_number)
+            clean_to_number = digits_only(original_fax.get('to'))
             
             logger.info(f"Resend - Original from_number: {original_fax.get('from', self.from_number)}, cleaned: {clean_from_number}")
             logger.info(f"Resend - Original to_number: {original_fax.get('to', '')}, cleaned: {clean_to_number}")
@@ -366,7 +418,8 @@ class HumbleFaxService:
             
             logger.info(f"Creating resend fax for original ID: {fax_id}")
             
-            response = requests.post(
+            response = self._request(
+                'POST', 'tmpFax',
                 f"{self.base_url}/tmpFax",
                 json=payload,
                 headers=headers,
@@ -379,7 +432,8 @@ class HumbleFaxService:
                 
                 if tmp_fax_id:
                     # Send the temporary fax
-                    send_response = requests.post(
+                    send_response = self._request(
+                        'POST', 'tmpFax/send',
                         f"{self.base_url}/tmpFax/{tmp_fax_id}/send",
                         headers=headers,
                         timeout=30
@@ -414,6 +468,9 @@ class HumbleFaxService:
                     'message': 'Failed to create resend fax'
                 }
                 
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return circuit_open_result(e, 'HumbleFax is temporarily unavailable')
         except Exception as e:
             logger.error(f"Error resending fax {fax_id}: {str(e)}")
             return {
@@ -422,18 +479,26 @@ class HumbleFaxService:
                 'message': 'Error resending fax'
             }
     
-    def send_fax(self, to_number, document_content, filename, patient_name=None):
+    def send_fax(self, to_number, document_content, filename=None, patient_name=None):
         """
         Send a fax using HumbleFax API following the correct 3-step process:
         1. Create temporary fax
         2. Upload attachment
         3. Send the fax
+        
+        Args:
+            to_number (str): Recipient fax number
+            document_content: Document as a file path, an open binary file or bytes.
+                Paths and files are streamed to the API in chunks.
+            filename (str): Attachment filename, defaults to the file's own name
+            patient_name (str): Patient name for the fax subject
         """
+        filename = filename or document_name(document_content)
+        
         logger.info(f"=== HUMBLEFAX SEND_FAX CALLED ===")
         logger.info(f"To number: {to_number}")
         logger.info(f"Filename: {filename}")
         logger.info(f"Patient name: {patient_name}")
-        logger.info(f"Document content size: {len(document_content)} bytes")
         
         try:
             # Step 1: Create Temporary Fax
@@ -441,7 +506,8 @@ class HumbleFaxService:
             tmp_fax_result = self._create_tmp_fax(to_number, patient_name)
             
             if not tmp_fax_result['success']:
-                return tmp_fax_result
+                # Nothing was sent yet, so another provider can safely take the fax
+                return dict(tmp_fax_result, retryable=True)
             
             tmp_fax_id = tmp_fax_result['tmp_fax_id']
             logger.info(f"Temporary fax created with ID: {tmp_fax_id}")
@@ -451,7 +517,7 @@ class HumbleFaxService:
             upload_result = self._upload_attachment(tmp_fax_id, document_content, filename)
             
             if not upload_result['success']:
-                return upload_result
+                return dict(upload_result, retryable=True)
             
             logger.info("Attachment uploaded successfully")
             
@@ -486,9 +552,9 @@ class HumbleFaxService:
         try:
             headers = self._get_auth_headers()
             
-            # Clean fax numbers - remove +, hyphens, spaces, and parentheses
-            clean_from_number = self.from_number.replace('+', '').replace('-', '').replace(' ', '').replace('(', '').replace(')', '')
-            clean_to_number = to_number.replace('+', '').replace('-', '').replace(' ', '').replace('(', '').replace(')', '')
+            # Clean fax numbers - digits only
+            clean_from_number = digits_only(self.from_number)
+            clean_to_number = digits_only(to_number)
             
             logger.info(f"Original from_number: {self.from_number}, cleaned: {clean_from_number}")
             logger.info(f"Original to_number: {to_number}, cleaned: {clean_to_number}")
@@ -509,7 +575,8 @@ class HumbleFaxService:
             
             logger.info(f"Creating temporary fax with payload: {payload}")
             
-            response = requests.post(
+            response = self._request(
+                'POST', 'tmpFax',
                 f"{self.base_url}/tmpFax",
                 json=payload,
                 headers=headers,
@@ -540,6 +607,9 @@ class HumbleFaxService:
                     'message': 'Failed to create temporary fax'
                 }
                 
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return circuit_open_result(e, 'HumbleFax is temporarily unavailable')
         except Exception as e:
             logger.error(f"Error creating temporary fax: {str(e)}")
             return {
@@ -551,6 +621,9 @@ class HumbleFaxService:
     def _upload_attachment(self, tmp_fax_id, document_content, filename):
         """
         Step 2: Upload attachment to the temporary fax
+        
+        The multipart body is streamed from the file in small blocks, so memory
+        use per upload does not grow with the attachment size.
         """
         try:
             # For file upload, we need to use multipart/form-data
@@ -558,23 +631,21 @@ class HumbleFaxService:
             auth_bytes = auth_string.encode('ascii')
             auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
             
-            headers = {
-                "Authorization": f"Basic {auth_b64}"
-            }
-            
-            # Create file-like object from document content
-            files = {
-                filename: ('document.docx', io.BytesIO(document_content), 'application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-            }
-            
-            logger.info(f"Uploading attachment to tmpFax ID: {tmp_fax_id}")
-            
-            response = requests.post(
-                f"{self.base_url}/attachment/{tmp_fax_id}",
-                headers=headers,
-                files=files,
-                timeout=60  # Longer timeout for file upload
-            )
+            with MultipartFileStream(filename, document_content, filename) as body:
+                headers = {
+                    "Authorization": f"Basic {auth_b64}",
+                    "Content-Type": body.content_type
+                }
+                
+                logger.info(f"Uploading attachment to tmpFax ID: {tmp_fax_id} ({body.file_size} bytes, {guess_content_type(filename)})")
+                
+                response = self._request(
+                    'POST', 'attachment',
+                    f"{self.base_url}/attachment/{tmp_fax_id}",
+                    headers=headers,
+                    data=body,
+                    timeout=60  # Longer timeout for file upload
+                )
             
             logger.info(f"Upload attachment response status: {response.status_code}")
             logger.debug(f"Upload attachment response: {response.text}")
@@ -591,6 +662,9 @@ class HumbleFaxService:
                     'message': 'Failed to upload attachment'
                 }
                 
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return circuit_open_result(e, 'HumbleFax is temporarily unavailable')
         except Exception as e:
             logger.error(f"Error uploading attachment: {str(e)}")
             return {
@@ -608,7 +682,8 @@ class HumbleFaxService:
             
             logger.info(f"Sending temporary fax with ID: {tmp_fax_id}")
             
-            response = requests.post(
+            response = self._request(
+                'POST', 'tmpFax/send',
                 f"{self.base_url}/tmpFax/{tmp_fax_id}/send",
                 headers=headers,
                 timeout=30
@@ -632,6 +707,9 @@ class HumbleFaxService:
                     'message': 'Failed to send fax'
                 }
                 
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return circuit_open_result(e, 'HumbleFax is temporarily unavailable')
         except Exception as e:
             logger.error(f"Error sending temporary fax: {str(e)}")
             return {
@@ -662,7 +740,8 @@ class HumbleFaxService:
             for endpoint in test_endpoints:
                 try:
                     logger.info(f"Testing endpoint: {endpoint}")
-                    response = requests.get(
+                    response = self._request(
+                        'GET', 'connectionTest',
                         f"{self.base_url}{endpoint}",
                         headers=headers,
                         timeout=10
@@ -727,7 +806,8 @@ class HumbleFaxService:
             
             for endpoint in possible_endpoints:
                 try:
-                    response = requests.get(
+                    response = self._request(
+                        'GET', 'faxStatus',
                         f"{self.base_url}{endpoint}",
                         headers=headers,
                         timeout=30
@@ -780,7 +860,8 @@ class HumbleFaxService:
             
             for endpoint in possible_endpoints:
                 try:
-                    response = requests.get(
+                    response = self._request(
+                        'GET', 'faxList',
                         f"{self.base_url}{endpoint}",
                         headers=headers,
                         params=params,
@@ -825,7 +906,8 @@ class HumbleFaxService:
             
             for endpoint in possible_endpoints:
                 try:
-                    response = requests.get(
+                    response = self._request(
+                        'GET', 'account',
                         f"{self.base_url}{endpoint}",
                         headers=headers,
                         timeout=30
@@ -872,7 +954,8 @@ class HumbleFaxService:
             
             for endpoint in possible_endpoints:
                 try:
-                    response = requests.delete(
+                    response = self._request(
+                        'DELETE', 'cancelFax',
                         f"{self.base_url}{endpoint}",
                         headers=headers,
                         timeout=30
@@ -0,0 +1,33 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app.archive import ARCHIVED_MODELS, archive_codec, archive_records, archive_root
+
+
+class Command(BaseCommand):
+    help = 'Move FaxRecord/SMSRecord rows older than the archive horizon into compressed archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'ARCHIVE_AFTER_DAYS', 365),
+            help='Archive rows created more than this many days ago'
+        )
+        parser.add_argument('--kind', choices=['fax', 'sms', 'all'], default='all')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per segment and per delete transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        kinds = list(ARCHIVED_MODELS) if options['kind'] == 'all' else [options['kind']]
+        if not options['dry_run']:
+            self.stdout.write(f"Archiving rows created before {cutoff:%Y-%m-%d %H:%M} to {archive_root()} ({archive_codec()})")
+
+        for kind in kinds:
+            stats = archive_records(kind, cutoff, batch_size=options['batch_size'], dry_run=options['dry_run'])
+            if options['dry_run']:
+                self.stdout.write(f"{kind}: {stats['archived']} rows would be archived")
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{kind}: archived {stats['archived']} rows into {stats['segments']} segments"
+                ))
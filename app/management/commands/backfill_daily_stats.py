@@ -0,0 +1,29 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from app.daily_stats import KINDS, backfill, default_backfill_start
+
+
+class Command(BaseCommand):
+    help = 'Recompute the dashboard daily stats from FaxRecord and SMSRecord'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['fax', 'sms', 'all'], default='all')
+        parser.add_argument(
+            '--since', help='Recompute from this day (YYYY-MM-DD); defaults to the day after the latest archived row'
+        )
+        parser.add_argument('--all-days', action='store_true', help='Recompute every day, including archived ones')
+
+    def handle(self, *args, **options):
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid --since date: {options['since']}")
+        else:
+            since = None if options['all_days'] else default_backfill_start()
+
+        kinds = list(KINDS) if options['kind'] == 'all' else [options['kind']]
+        self.stdout.write(f"Recomputing daily stats {'from ' + since.isoformat() if since else 'for every day'}")
+        for kind in kinds:
+            rows = backfill(kind, since=since)
+            self.stdout.write(self.style.SUCCESS(f"{kind}: {rows} daily stats rows"))
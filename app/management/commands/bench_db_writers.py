@@ -0,0 +1,150 @@
+import os
+import copy
+import time
+import random
+import shutil
+import tempfile
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test.utils import override_settings
+from app.models import FaxRecord
+from app.record_writer import BufferedRecordWriter
+from app.status_updates import StatusUpdate, apply_status_updates
+
+# What this app ran with before the database profile: SQLite's defaults and
+# the 5 second busy timeout Python's sqlite3 module sets
+SQLITE_DEFAULTS = {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000, 'mmap_size': 0}
+
+# The alias the benchmark writes through; the default connection is never opened
+BENCH_ALIAS = 'bench_db_writers'
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent bulk-job writers (batched FaxRecord inserts plus status updates) '
+        'against a scratch database and report throughput and lock errors'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Concurrent writer threads')
+        parser.add_argument('--rows', type=int, default=5000, help='FaxRecord rows each writer inserts')
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows per bulk_create batch')
+        parser.add_argument('--updates', type=int, default=50, help='Status updates each writer applies per batch')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        # The bench alias starts as a copy of the default database's settings
+        # and is pointed at a scratch database before it ever connects
+        bench_settings = copy.deepcopy(connections.settings[DEFAULT_DB_ALIAS])
+        scratch_dir = None
+        if bench_settings['ENGINE'] == 'django.db.backends.sqlite3':
+            # A file, since WAL and busy handling do not apply to in-memory databases
+            scratch_dir = tempfile.mkdtemp(prefix='bench_db_writers-')
+            bench_settings['TEST'] = dict(bench_settings.get('TEST') or {}, NAME=os.path.join(scratch_dir, 'bench.sqlite3'))
+        connections.settings[BENCH_ALIAS] = bench_settings
+        bench = connections[BENCH_ALIAS]
+        if bench.vendor == 'sqlite':
+            profiles = [
+                ('SQLite defaults', SQLITE_DEFAULTS, 'DEFERRED'),
+                ('SQLite profile', settings.SQLITE_PRAGMAS, bench.settings_dict['OPTIONS'].get('transaction_mode')),
+            ]
+        else:
+            profiles = [(f"{bench.vendor} profile", None, None)]
+
+        old_name = bench.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        try:
+            results = [self.run_profile(label, pragmas, transaction_mode, options)
+                       for label, pragmas, transaction_mode in profiles]
+        finally:
+            bench.creation.destroy_test_db(old_name, verbosity=0)
+            del connections[BENCH_ALIAS]
+            del connections.settings[BENCH_ALIAS]
+            if scratch_dir:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Summary'))
+        for result in results:
+            self.stdout.write(
+                f"{result['label']:<18} {result['rows_per_second']:9,.0f} rows/s  "
+                f"{result['written']:7d} written  {result['failed']:6d} lost  {result['lock_errors']:4d} lock errors"
+            )
+
+    def run_profile(self, label, pragmas, transaction_mode, options):
+        bench = connections[BENCH_ALIAS]
+        FaxRecord.objects.using(BENCH_ALIAS).all().delete()
+        bench.close()
+
+        overrides = {}
+        if pragmas is not None:
+            overrides['SQLITE_PRAGMAS'] = pragmas
+        options_dict = bench.settings_dict['OPTIONS']
+        previous_mode = options_dict.get('transaction_mode')
+        if transaction_mode and 'transaction_mode' in options_dict:
+            options_dict['transaction_mode'] = transaction_mode
+
+        stats = {'written': 0, 'failed': 0, 'lock_errors': 0}
+        stats_lock = threading.Lock()
+        start_barrier = threading.Barrier(options['writers'])
+
+        def writer(index):
+            rng = random.Random(options['seed'] + index)
+            lock_errors = 0
+            keys = []
+            start_barrier.wait()
+            try:
+                with BufferedRecordWriter(FaxRecord, batch_size=options['batch_size'], flush_seconds=3600,
+                                          using=BENCH_ALIAS) as rows:
+                    for i in range(options['rows']):
+                        key = f"w{index}-{i}"
+                        try:
+                            rows.add(FaxRecord(fax_id=key, to_number='+18175550100', from_number='+18177800212', status='pending'))
+                        except OperationalError:
+                            # The batch stays buffered and is retried on the next flush
+                            lock_errors += 1
+                        keys.append(key)
+                        if (i + 1) % options['batch_size'] == 0 and options['updates']:
+                            # A batch was just written: apply webhook-style status updates to some of it
+                            sample = rng.sample(keys, min(options['updates'], len(keys)))
+                            try:
+                                apply_status_updates(FaxRecord, 'fax_id', [StatusUpdate(key, 'sent', None) for key in sample],
+                                                     using=BENCH_ALIAS)
+                            except OperationalError:
+                                lock_errors += 1
+            except OperationalError:
+                lock_errors += 1
+            finally:
+                connections[BENCH_ALIAS].close()
+            with stats_lock:
+                stats['lock_errors'] += lock_errors
+
+        threads = [threading.Thread(target=writer, args=(index,)) for index in range(options['writers'])]
+        with override_settings(**overrides):
+            # Open the main connection first so the profile's journal mode is
+            # set while no other connection holds the file
+            journal_mode = '-'
+            if bench.vendor == 'sqlite':
+                with bench.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    journal_mode = cursor.fetchone()[0]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            stats['written'] = FaxRecord.objects.using(BENCH_ALIAS).count()
+            bench.close()
+        options_dict['transaction_mode'] = previous_mode
+        if previous_mode is None:
+            options_dict.pop('transaction_mode', None)
+
+        stats['failed'] = options['writers'] * options['rows'] - stats['written']
+        result = dict(stats, label=label, seconds=elapsed, rows_per_second=stats['written'] / elapsed)
+        self.stdout.write(
+            f"{label}: {stats['written']} rows in {elapsed:.2f} s with {options['writers']} writers "
+            f"(journal_mode={journal_mode}, transaction_mode={transaction_mode or 'DEFERRED'}), "
+            f"{stats['failed']} rows lost, {stats['lock_errors']} lock errors"
+        )
+        return result
@@ -0,0 +1,59 @@
+import re
+import time
+import random
+from django.core.management.base import BaseCommand
+from app import phone_numbers
+
+FORMATS = ['({a}) {b}-{c}', '{a}-{b}-{c}', '+1 {a} {b} {c}', '1{a}{b}{c}', '{a}.{b}.{c}', '{a}{b}{c}']
+
+
+def legacy_to_e164(value):
+    """The per-call regex normalization the services used before"""
+    digits = re.sub(r'\D', '', str(value))
+    if len(digits) < 10:
+        return None
+    return f"+1{digits}" if len(digits) == 10 else f"+{digits}"
+
+
+class Command(BaseCommand):
+    help = 'Benchmark phone number normalization on a generated list of numbers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='Numbers to normalize')
+        parser.add_argument('--unique', type=int, default=20000, help='Distinct numbers among them')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        distinct = [
+            rng.choice(FORMATS).format(a=rng.randint(200, 999), b=rng.randint(200, 999), c=f"{rng.randint(0, 9999):04d}")
+            for _ in range(options['unique'])
+        ]
+        numbers = [rng.choice(distinct) for _ in range(options['count'])]
+
+        def timed(label, func):
+            start = time.perf_counter()
+            result = func()
+            self.stdout.write(f"{label:<34} {(time.perf_counter() - start) * 1000:9.1f} ms")
+            return result
+
+        self.stdout.write(f"Normalizing {len(numbers)} numbers ({len(distinct)} distinct)")
+        expected = timed('re.sub per call', lambda: [legacy_to_e164(n) for n in numbers])
+
+        phone_numbers._digits.cache_clear()
+        phone_numbers._e164.cache_clear()
+        cold = timed('to_e164_many (cold cache)', lambda: phone_numbers.to_e164_many(numbers))
+        warm = timed('to_e164_many (warm cache)', lambda: phone_numbers.to_e164_many(numbers))
+
+        try:
+            import pandas as pd
+        except ImportError:
+            pd = None
+        if pd is not None:
+            series = pd.Series(numbers)
+            vectorized = timed('to_e164_many (pandas Series)', lambda: phone_numbers.to_e164_many(series))
+            assert vectorized.tolist() == expected
+
+        assert cold == expected and warm == expected
+        info = phone_numbers.cache_info()['e164']
+        self.stdout.write(f"E.164 cache: {info['hits']} hits, {info['misses']} misses, {info['currsize']} entries")
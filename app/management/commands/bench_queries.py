@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import random
+import tempfile
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from app.models import FaxRecord, SMSRecord
+from app.status_poller import FaxStatusPoller, IN_FLIGHT_STATUSES
+
+# The query indexes (migration 0008), dropped from the fully migrated scratch
+# schema for the "before" run and built again for the "after" run
+BENCH_INDEXES = [(FaxRecord, 'app_fax_created_idx'), (SMSRecord, 'app_sms_created_idx')]
+
+FAX_STATUSES = [('delivered', 88), ('failed', 6), ('sent', 3), ('pending', 2), ('cancelled', 1)]
+SMS_STATUSES = [('delivered', 90), ('failed', 5), ('sent', 4), ('pending', 1)]
+
+
+def bench_indexes():
+    """The (model, Index) pairs of BENCH_INDEXES, as the models declare them"""
+    return [(model, next(index for index in model._meta.indexes if index.name == name))
+            for model, name in BENCH_INDEXES]
+
+
+def view_queries(sample_fax_ids, sample_sids, now):
+    """
+    The queries the views and status workers issue, by label
+
+    Each is a callable returning the queryset, so it is built against the
+    schema in place when it runs.
+    """
+    poller = FaxStatusPoller()
+    return [
+        ('fax_list (first 100)', lambda: FaxRecord.objects.all()[:100]),
+        ('fax_detail / fax_resend', lambda: FaxRecord.objects.filter(fax_id=sample_fax_ids[0])[:1]),
+        ('status poller: due faxes', lambda: FaxRecord.objects.filter(
+            status__in=IN_FLIGHT_STATUSES,
+            direction='outbound',
+            created_at__gte=now - poller.max_age,
+        ).values_list('fax_id', 'created_at', 'provider')),
+        ('apply_status_updates (100 faxes)', lambda: FaxRecord.objects.filter(fax_id__in=sample_fax_ids)),
+        ('apply_status_updates (100 sms)', lambda: SMSRecord.objects.filter(sid__in=sample_sids)),
+        ('sms history (first 100)', lambda: SMSRecord.objects.all()[:100]),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Seed a scratch SQLite database and time the view queries with and without the query indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='FaxRecord rows to seed')
+        parser.add_argument('--sms-rows', type=int, default=200000, help='SMSRecord rows to seed')
+        parser.add_argument('--days', type=int, default=365, help='Spread created_at over this many days')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query; the best is reported')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('bench_queries seeds a scratch SQLite database; the default database is not SQLite')
+
+        # A throwaway database next to the system temp files, never the real one
+        scratch = os.path.join(tempfile.gettempdir(), 'bench_queries.sqlite3')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = scratch
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        try:
+            results = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run_benchmark(self, options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+
+        # The scratch database is migrated to the latest schema, so rows are
+        # seeded through the current models with only the benched indexes missing
+        with connection.schema_editor() as editor:
+            for model, index in bench_indexes():
+                editor.remove_index(model, index)
+        fax_ids = self.seed(FaxRecord, 'fax_id', options['rows'], options['days'], rng, now)
+        sids = self.seed(SMSRecord, 'sid', options['sms_rows'], options['days'], rng, now)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        queries = view_queries(rng.sample(fax_ids, min(100, len(fax_ids))), rng.sample(sids, min(100, len(sids))), now)
+        results = {'rows': options['rows'], 'sms_rows': options['sms_rows'], 'before': {}, 'after': {}}
+
+        index_names = ', '.join(index.name for _, index in bench_indexes())
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Before (without {index_names})"))
+        results['before'] = self.measure(queries, options['repeat'])
+
+        start = time.perf_counter()
+        with connection.schema_editor() as editor:
+            for model, index in bench_indexes():
+                editor.add_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        results['index_build_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        self.stdout.write(f"Built indexes in {results['index_build_ms']} ms")
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"After (with {index_names})"))
+        results['after'] = self.measure(queries, options['repeat'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Summary'))
+        for label, _ in queries:
+            before, after = results['before'][label]['ms'], results['after'][label]['ms']
+            speedup = before / after if after else float('inf')
+            self.stdout.write(f"{label:<36} {before:10.2f} ms -> {after:8.2f} ms  ({speedup:,.1f}x)")
+        return results
+
+    def seed(self, model, key_field, count, days, rng, now, batch_size=5000):
+        """Insert count rows with a realistic status mix and ages; returns their keys"""
+        statuses = FAX_STATUSES if model is FaxRecord else SMS_STATUSES
+        status_choices = [status for status, _ in statuses]
+        status_weights = [weight for _, weight in statuses]
+        span = days * 86400
+        keys = []
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            batch = []
+            for i in range(offset, min(offset + batch_size, count)):
+                key = f"bench-{i:08d}"
+                created_at = now - timedelta(seconds=rng.random() * span)
+                status = rng.choices(status_choices, status_weights)[0]
+                fields = {
+                    key_field: key,
+                    'to_number': f"+1{rng.randint(2002000000, 9999999999)}",
+                    'from_number': '+18177800212',
+                    'status': status,
+                    'created_at': created_at,
+                }
+                if model is FaxRecord:
+                    fields.update(
+                        direction='outbound' if rng.random() < 0.95 else 'inbound',
+                        provider=rng.choice(('telnyx', 'humblefax')),
+                        num_pages=rng.randint(1, 6),
+                    )
+                else:
+                    fields['message'] = 'Your order has shipped'
+                batch.append(model(**fields))
+                keys.append(key)
+            model.objects.bulk_create(batch)
+        self.stdout.write(f"Seeded {count} {model.__name__} rows in {time.perf_counter() - start:.1f} s")
+        return keys
+
+    def measure(self, queries, repeat):
+        results = {}
+        for label, build in queries:
+            plan = build().explain()
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(build())
+                elapsed = (time.perf_counter() - start) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            results[label] = {'ms': round(best, 2), 'plan': plan}
+            self.stdout.write(f"{label:<36} {best:10.2f} ms")
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+        return results
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from app.document_store import DocumentStore
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete stored fax documents unused for DOCUMENT_STORE_MAX_AGE seconds, then the least '
+        'recently used ones while the store is over DOCUMENT_STORE_MAX_BYTES'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None, help='Seconds an unused document is kept')
+
+    def handle(self, *args, **options):
+        store = DocumentStore(max_age=options['max_age'])
+        evicted = store.evict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Evicted {evicted} documents; {store.stored_bytes()} compressed bytes remain in {store.root}"
+        ))
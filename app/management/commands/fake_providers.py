@@ -0,0 +1,74 @@
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from app.fake_providers import FakeProviderServer, PROVIDERS, parse_latency_options
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake HumbleFax/Telnyx/Twilio server for benchmarks and load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument(
+            '--latency', action='append', default=[],
+            help='Response delay as [provider=]fixed:MS | uniform:MIN:MAX | normal:MEAN:SD | '
+                 f'lognormal:MEDIAN:SIGMA | exp:MEAN. Providers: {", ".join(PROVIDERS)}. Repeatable.'
+        )
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+        parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429 responses')
+        parser.add_argument('--delivery-seconds', type=float, default=5.0, help='Seconds before a fax reaches a final status')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of faxes that end up failed')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+        parser.add_argument('--record', metavar='FILE', help='Proxy to the real providers and append sanitized responses to FILE')
+        parser.add_argument('--replay', metavar='FILE', help='Serve responses recorded with --record')
+        parser.add_argument('--upstream', action='append', default=[], help='Override a real provider URL as provider=URL (record mode)')
+
+    def handle(self, *args, **options):
+        if options['record'] and options['replay']:
+            raise CommandError('--record and --replay cannot be used together')
+
+        try:
+            latency = parse_latency_options(options['latency'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        upstreams = {}
+        for item in options['upstream']:
+            provider, _, url = item.partition('=')
+            if provider not in PROVIDERS or not url:
+                raise CommandError(f"Invalid --upstream value: {item}")
+            upstreams[provider] = url
+
+        logging.getLogger('app.fake_providers').setLevel(logging.DEBUG if options['verbosity'] > 1 else logging.INFO)
+
+        server = FakeProviderServer(
+            (options['host'], options['port']),
+            latency=latency,
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            retry_after=options['retry_after'],
+            replay_path=options['replay'],
+            record_path=options['record'],
+            upstreams=upstreams,
+            seed=options['seed'],
+            delivery_seconds=options['delivery_seconds'],
+            failure_rate=options['failure_rate'],
+        )
+
+        base_url = f"http://{options['host']}:{server.server_address[1]}"
+        self.stdout.write(self.style.SUCCESS(f"Fake providers listening on {base_url}"))
+        for provider, model in sorted(latency.items()):
+            self.stdout.write(f"  latency {provider}: {model}")
+        self.stdout.write("Point the clients at it with:")
+        for setting in ('HUMBLEFAX_BASE_URL', 'TELNYX_BASE_URL', 'TWILIO_BASE_URL', 'TWILIO_LOOKUP_BASE_URL'):
+            self.stdout.write(f"  export {setting}={base_url}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            counts = ', '.join(f"{k}={v}" for k, v in sorted(server.state.counters.items()))
+            self.stdout.write(f"Requests served: {counts or 'none'}")
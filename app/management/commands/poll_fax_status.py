@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from app.status_poller import FaxStatusPoller
+
+
+class Command(BaseCommand):
+    help = 'Poll providers for the status of faxes that are still pending or sent'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single polling cycle and exit')
+        parser.add_argument('--tick', type=float, default=5.0, help='Seconds between polling cycles')
+        parser.add_argument('--workers', type=int, default=None, help='Concurrent provider requests')
+
+    def handle(self, *args, **options):
+        poller_options = {}
+        if options['workers']:
+            poller_options['workers'] = options['workers']
+        poller = FaxStatusPoller(**poller_options)
+
+        if options['once']:
+            result = poller.poll_once()
+            self.stdout.write(f"Polled {result['due']} faxes, {result['updated']} updated")
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"Polling fax status every {options['tick']:.0f}s (Ctrl+C to stop)"))
+        try:
+            while True:
+                started = time.monotonic()
+                result = poller.poll_once()
+                if result['due']:
+                    self.stdout.write(f"Polled {result['due']} faxes, {result['updated']} updated")
+                time.sleep(max(options['tick'] - (time.monotonic() - started), 0))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
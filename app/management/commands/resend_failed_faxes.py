@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from app.fax_providers import FaxRouter
+from app.models import FaxRecord
+from app.record_writer import BufferedRecordWriter
+
+
+class Command(BaseCommand):
+    help = (
+        'Resend failed outbound faxes from the exact documents kept in the document store. '
+        'Local fax media needs FAX_MEDIA_BASE_URL set, since there is no request to take it from'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Only faxes created in the last this many hours')
+        parser.add_argument('--limit', type=int, default=500, help='Most faxes to resend in one run')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the faxes that would be resent')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        # A fax counts as retried once a later fax sent the same document to the same number
+        retried = FaxRecord.objects.filter(
+            document_id=OuterRef('document_id'), to_number=OuterRef('to_number'), created_at__gt=OuterRef('created_at')
+        )
+        failed = list(
+            FaxRecord.objects.filter(
+                status='failed', direction='outbound', document__isnull=False, created_at__gte=since
+            ).exclude(Exists(retried)).select_related('document').order_by('created_at')[:options['limit']]
+        )
+        if options['dry_run']:
+            for fax in failed:
+                self.stdout.write(f"{fax.fax_id} to {fax.to_number} ({fax.document.filename})")
+            self.stdout.write(f"{len(failed)} failed faxes would be resent")
+            return
+
+        router = FaxRouter()
+        if not router.providers:
+            self.stderr.write(self.style.ERROR('No fax provider is configured'))
+            return
+
+        with tempfile.TemporaryDirectory(prefix='resend_failed_faxes-') as scratch:
+            # Faxes of one document share it, read from the store once into a
+            # file whose path every concurrent send opens on its own
+            documents = {}
+            faxes, jobs = [], []
+            for fax in failed:
+                if fax.document_id not in documents:
+                    documents[fax.document_id] = self.extract(router, fax, scratch)
+                path, filename = documents[fax.document_id]
+                if path is None:
+                    self.stdout.write(self.style.WARNING(f"{fax.fax_id}: document no longer readable, skipped"))
+                    continue
+                faxes.append(fax)
+                jobs.append({'to_number': fax.to_number, 'document': path, 'filename': filename,
+                             'patient_name': fax.patient_name})
+            sent = self.resend(router, faxes, jobs)
+
+        self.stdout.write(self.style.SUCCESS(f"Resent {sent} of {len(jobs)} failed faxes"))
+
+    def extract(self, router, fax, scratch):
+        """Copy a fax's stored document into scratch; returns (path, filename), or (None, None)"""
+        reader, filename = router.stored_document(fax)
+        if reader is None:
+            return None, None
+        # Keeps the extension, which the router reads the content type from
+        path = os.path.join(scratch, f"{fax.document_id}{os.path.splitext(filename or '')[1]}")
+        with reader, open(path, 'wb') as out:
+            shutil.copyfileobj(reader, out)
+        return path, filename
+
+    def resend(self, router, faxes, jobs):
+        """Send the jobs and record the faxes that went out; returns how many did"""
+        sent = 0
+        with BufferedRecordWriter(FaxRecord) as writer:
+            for fax, (_, result) in zip(faxes, router.send_many(jobs)):
+                if result['success']:
+                    sent += 1
+                    writer.add(FaxRecord(
+                        fax_id=result['fax_id'],
+                        to_number=fax.to_number,
+                        from_number=result['from_number'] or fax.from_number,
+                        status='sent',
+                        provider=result['provider'],
+                        media_url=result.get('media_url'),
+                        media_name=result.get('media_name'),
+                        document_id=result.get('document_id'),
+                        subject=f"Resent: {fax.subject or ''}",
+                        num_pages=fax.num_pages,
+                        patient_name=fax.patient_name,
+                        device_type=fax.device_type
+                    ))
+                else:
+                    self.stdout.write(self.style.WARNING(
+                        f"{fax.fax_id}: {result.get('message') if result.get('deferred') else result.get('error', 'Unknown error')}"
+                    ))
+                writer.flush_if_due()
+        return sent
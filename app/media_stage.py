@@ -0,0 +1,255 @@
+"""
+Stage fax documents once and reuse the reference for every recipient
+
+Telnyx faxes a document from a media_url it can fetch or a media_name
+previously uploaded to its media storage. A document is staged by the
+SHA-256 of its bytes: the first send uploads it (to Telnyx media storage,
+or to a local directory served by this app) and records a MediaUpload;
+every later recipient, bulk batch and resend of the same bytes reuses that
+reference until it is close to expiring.
+
+Local media is served by the fax_media view at HMAC-signed URLs that expire
+after FAX_MEDIA_URL_TTL, so only the provider holding a fresh URL can fetch
+the document.
+"""
+import os
+import hmac
+import time
+import hashlib
+import logging
+import threading
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import IntegrityError
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import MediaUpload
+from .multipart_upload import guess_content_type, open_document, document_name
+from .telnyx_fax_service import TelnyxFaxService
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('telnyx', 'local')
+
+# Telnyx deletes uploaded media after 48 hours unless another ttl is given
+DEFAULT_TTL = 48 * 3600
+
+# A fixed pool of locks striped by hash, rather than one lock per document ever seen
+HASH_LOCK_STRIPES = 64
+_hash_locks = [threading.Lock() for _ in range(HASH_LOCK_STRIPES)]
+
+
+def hash_lock(content_hash):
+    """
+    The lock serialising work on one SHA-256 hex digest in this process
+
+    Different hashes may share a stripe and so wait on each other briefly;
+    the lock is not reentrant, so never take a second one while holding it.
+    """
+    return _hash_locks[int(content_hash[:8], 16) % HASH_LOCK_STRIPES]
+
+
+def hash_document(document, chunk_size=1024 * 1024):
+    """
+    SHA-256 of a document given as bytes, a file path or a file-like object
+
+    File objects are rewound afterwards so the same object can be uploaded.
+    """
+    file_obj, owns_file = open_document(document)
+    start = file_obj.tell() if hasattr(file_obj, 'tell') else 0
+    digest = hashlib.sha256()
+    try:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+            digest.update(chunk)
+        size = file_obj.tell() - start
+    finally:
+        if owns_file:
+            file_obj.close()
+        else:
+            file_obj.seek(start)
+    return digest.hexdigest(), size
+
+
+def local_media_root():
+    return getattr(settings, 'FAX_MEDIA_ROOT', os.path.join(settings.BASE_DIR, 'fax_media'))
+
+
+def _signing_key():
+    return (getattr(settings, 'FAX_MEDIA_SIGNING_KEY', '') or settings.SECRET_KEY).encode('utf-8')
+
+
+def media_signature(media_name, expires):
+    """HMAC-SHA256 over the media name and expiry time, truncated to 128 bits"""
+    message = f"{media_name}:{int(expires)}".encode('utf-8')
+    return hmac.new(_signing_key(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def signed_media_query(media_name, ttl=None):
+    """Query string that authorizes fetching local media for ttl seconds"""
+    ttl = ttl if ttl is not None else getattr(settings, 'FAX_MEDIA_URL_TTL', 24 * 3600)
+    expires = int(time.time() + ttl)
+    return f"expires={expires}&signature={media_signature(media_name, expires)}"
+
+
+def verify_media_signature(media_name, expires, signature):
+    """True if the signature matches and the URL has not expired"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time() or not signature:
+        return False
+    return hmac.compare_digest(media_signature(media_name, expires), signature)
+
+
+class MediaStage:
+    """
+    Upload a document once per content hash and hand out fax arguments for it
+
+    Args:
+        backend (str): 'telnyx' or 'local' (default FAX_MEDIA_BACKEND)
+        base_url (str): Public root URL of this app, for local media; FAX_MEDIA_BASE_URL wins when set
+        telnyx (TelnyxFaxService): Client used for Telnyx uploads
+    """
+
+    def __init__(self, backend=None, base_url=None, telnyx=None):
+        self.backend = backend or getattr(settings, 'FAX_MEDIA_BACKEND', 'telnyx')
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown fax media backend: {self.backend}")
+        self.base_url = (getattr(settings, 'FAX_MEDIA_BASE_URL', '') or base_url or '').rstrip('/')
+        self.ttl = getattr(settings, 'FAX_MEDIA_TTL', DEFAULT_TTL)
+        # Re-upload media this close to expiry so a queued fax can still fetch it
+        self.reuse_margin = timedelta(seconds=getattr(settings, 'FAX_MEDIA_REUSE_MARGIN', 600))
+        self._telnyx = telnyx
+
+    @property
+    def telnyx(self):
+        if self._telnyx is None:
+            self._telnyx = TelnyxFaxService()
+        return self._telnyx
+
+    def is_usable(self, media):
+        return media.expires_at is None or media.expires_at > timezone.now() + self.reuse_margin
+
+    def stage(self, document, filename=None):
+        """
+        Upload a document unless the same bytes are already staged
+
+        Args:
+            document: Bytes, a file path or a file-like object (e.g. an UploadedFile)
+            filename (str): Name to upload under; defaults to the document's own name
+
+        Returns:
+            dict: Result with 'media' (MediaUpload) and 'reused' on success
+        """
+        filename = filename or document_name(document)
+        try:
+            content_hash, size = hash_document(document)
+        except (OSError, TypeError) as e:
+            return {'success': False, 'error': f"Could not read document: {str(e)}", 'message': 'Failed to stage document'}
+
+        # One upload per hash even when several threads stage the same document
+        with hash_lock(content_hash):
+            media = MediaUpload.objects.filter(content_hash=content_hash, backend=self.backend).first()
+            if media and self.is_usable(media):
+                return {'success': True, 'media': media, 'reused': True}
+
+            if self.backend == 'telnyx':
+                result = self._upload_telnyx(document, filename, content_hash)
+            else:
+                result = self._store_local(document, filename, content_hash)
+            if not result['success']:
+                return result
+
+            values = {
+                'media_name': result['media_name'],
+                'filename': filename,
+                'content_type': guess_content_type(filename),
+                'size': size,
+                'uploaded_at': timezone.now(),
+                'expires_at': result['expires_at'],
+            }
+            try:
+                media, _ = MediaUpload.objects.update_or_create(
+                    content_hash=content_hash, backend=self.backend, defaults=values
+                )
+            except IntegrityError:
+                # Another process staged the same bytes first; use its upload
+                media = MediaUpload.objects.get(content_hash=content_hash, backend=self.backend)
+
+        logger.info(f"Staged {filename} ({size} bytes) as {self.backend} media {media.media_name}")
+        return {'success': True, 'media': media, 'reused': False}
+
+    def _upload_telnyx(self, document, filename, content_hash):
+        extension = os.path.splitext(filename)[1].lower()
+        # Names are unique per upload so a re-upload near expiry never clashes with the old one
+        media_name = f"{content_hash[:32]}-{int(timezone.now().timestamp())}{extension}"
+        result = self.telnyx.upload_media(document, filename, media_name, ttl=self.ttl)
+        if not result['success']:
+            return result
+        expires_at = None
+        if result.get('expires_at'):
+            try:
+                expires_at = parse_datetime(result['expires_at'])
+            except ValueError:
+                pass
+        if expires_at is None:
+            expires_at = timezone.now() + timedelta(seconds=self.ttl)
+        elif timezone.is_naive(expires_at):
+            expires_at = timezone.make_aware(expires_at, dt_timezone.utc)
+        return {'success': True, 'media_name': result['media_name'], 'expires_at': expires_at}
+
+    def _store_local(self, document, filename, content_hash):
+        media_name = f"{content_hash}{os.path.splitext(filename)[1].lower()}"
+        root = local_media_root()
+        path = os.path.join(root, media_name)
+        try:
+            if not os.path.exists(path):
+                os.makedirs(root, exist_ok=True)
+                file_obj, owns_file = open_document(document)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                try:
+                    with open(tmp_path, 'wb') as out:
+                        for chunk in iter(lambda: file_obj.read(1024 * 1024), b''):
+                            out.write(chunk)
+                    os.replace(tmp_path, path)
+                finally:
+                    if owns_file:
+                        file_obj.close()
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        except OSError as e:
+            logger.error(f"Error storing fax media {media_name}: {str(e)}")
+            return {'success': False, 'error': f"Error storing document: {str(e)}", 'message': 'Failed to stage document'}
+        return {'success': True, 'media_name': media_name, 'expires_at': None}
+
+    def fax_kwargs(self, media):
+        """Arguments for TelnyxFaxService.send_fax/send_bulk that refer to staged media"""
+        if media.backend == 'telnyx':
+            return {'media_name': media.media_name}
+        return {'media_url': f"{self.media_url(media)}?{signed_media_query(media.media_name)}"}
+
+    def media_url(self, media):
+        """
+        Unsigned URL of locally staged media, as recorded on FaxRecord (None for Telnyx media)
+
+        Fetching it needs the signed query string fax_kwargs adds.
+        """
+        if media.backend != 'local':
+            return None
+        return f"{self.base_url}{reverse('fax_media', args=[media.media_name])}"
+
+    def find(self, media_name):
+        """
+        The staged media with this name, if it can still be faxed
+
+        Returns:
+            MediaUpload: The media, or None if unknown or about to expire
+        """
+        if not media_name:
+            return None
+        media = MediaUpload.objects.filter(media_name=media_name).first()
+        if media and self.is_usable(media):
+            return media
+        return None
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_faxrecord_device_type_faxrecord_patient_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faxrecord',
+            name='status_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='smsrecord',
+            name='status_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_faxrecord_status_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarrierLookup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=20, unique=True)),
+                ('carrier_type', models.CharField(blank=True, max_length=30)),
+                ('carrier_name', models.CharField(blank=True, max_length=200, null=True)),
+                ('is_mobile', models.BooleanField(default=False)),
+                ('looked_up_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_carrierlookup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiconfiguration',
+            name='connection_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_apiconfiguration_connection_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faxrecord',
+            name='media_name',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.CreateModel(
+            name='MediaUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('backend', models.CharField(choices=[('telnyx', 'Telnyx media storage'), ('local', 'Local')], max_length=20)),
+                ('media_name', models.CharField(max_length=200, unique=True)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('uploaded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'backend')},
+            },
+        ),
+    ]
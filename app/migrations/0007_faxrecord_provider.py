@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:06
+
+import re
+
+from django.db import migrations, models
+
+# Telnyx fax IDs are UUIDs; HumbleFax IDs are numeric
+TELNYX_ID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+
+
+def backfill_provider(apps, schema_editor):
+    FaxRecord = apps.get_model('app', 'FaxRecord')
+    records = FaxRecord.objects.using(schema_editor.connection.alias)
+    telnyx_ids = []
+    humblefax_ids = []
+    for pk, fax_id in records.filter(provider__isnull=True).values_list('pk', 'fax_id').iterator():
+        (telnyx_ids if TELNYX_ID_RE.match(fax_id or '') else humblefax_ids).append(pk)
+    for provider, pks in (('telnyx', telnyx_ids), ('humblefax', humblefax_ids)):
+        for start in range(0, len(pks), 500):
+            records.filter(pk__in=pks[start:start + 500]).update(provider=provider)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_mediaupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faxrecord',
+            name='provider',
+            field=models.CharField(blank=True, choices=[('humblefax', 'HumbleFax'), ('telnyx', 'Telnyx')], max_length=20, null=True),
+        ),
+        migrations.RunPython(backfill_provider, migrations.RunPython.noop),
+    ]
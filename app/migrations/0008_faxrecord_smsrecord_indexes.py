@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_faxrecord_provider'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='faxrecord',
+            index=models.Index(fields=['created_at', 'id'], name='app_fax_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smsrecord',
+            index=models.Index(fields=['created_at', 'id'], name='app_sms_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def install_fts(apps, schema_editor):
+    from app.record_search import install_fts
+    install_fts(schema_editor.connection)
+
+
+def uninstall_fts(apps, schema_editor):
+    from app.record_search import uninstall_fts
+    uninstall_fts(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_faxrecord_smsrecord_indexes'),
+    ]
+
+    operations = [
+        # SQLite only; other backends search with icontains filters
+        migrations.RunPython(install_fts, uninstall_fts),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_record_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('fax', 'Fax'), ('sms', 'SMS')], max_length=10)),
+                ('key', models.CharField(max_length=100)),
+                ('segment', models.CharField(max_length=255)),
+                ('line', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('kind', 'key')},
+            },
+        ),
+    ]
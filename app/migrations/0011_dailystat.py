@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_archivedrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('fax', 'Fax'), ('sms', 'SMS')], max_length=10)),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('device_type', models.CharField(blank=True, default='', max_length=100)),
+                ('provider', models.CharField(blank=True, default='', max_length=20)),
+                ('direction', models.CharField(blank=True, default='', max_length=10)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('kind', 'day', 'status', 'device_type', 'provider', 'direction')},
+            },
+        ),
+    ]
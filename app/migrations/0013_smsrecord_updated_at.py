@@ -0,0 +1,28 @@
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Last known change: the latest status update, else creation
+    SMSRecord = apps.get_model('app', 'SMSRecord')
+    SMSRecord.objects.using(schema_editor.connection.alias).update(updated_at=Coalesce('status_updated_at', 'created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_documentblob'),
+    ]
+
+    operations = [
+        # Rebuilds the table on SQLite, dropping its search triggers; the
+        # post_migrate hook in app/signals.py puts them back
+        migrations.AddField(
+            model_name='smsrecord',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
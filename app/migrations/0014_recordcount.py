@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_smsrecord_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('counted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
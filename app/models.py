@@ -10,22 +10,36 @@ class FaxRecord(models.Model):
         ('failed', 'Failed'),
         ('cancelled', 'Cancelled'),
     ]
+    PROVIDER_CHOICES = [
+        ('humblefax', 'HumbleFax'),
+        ('telnyx', 'Telnyx'),
+    ]
     
     fax_id = models.CharField(max_length=100, unique=True)
     to_number = models.CharField(max_length=20)
     from_number = models.CharField(max_length=20)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     media_url = models.URLField(blank=True, null=True)
+    media_name = models.CharField(max_length=200, blank=True, null=True)  # Staged document, see MediaUpload
     subject = models.CharField(max_length=200, blank=True, null=True)
     num_pages = models.IntegerField(default=1)
     direction = models.CharField(max_length=10, default='outbound')
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES, blank=True, null=True)
     patient_name = models.CharField(max_length=200, blank=True, null=True)
     device_type = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    status_updated_at = models.DateTimeField(blank=True, null=True)
+    # The exact bytes that were faxed, kept for resends until evicted from the store
+    document = models.ForeignKey('DocumentBlob', blank=True, null=True, on_delete=models.SET_NULL, related_name='faxes')
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # fax_list (newest first) and FaxStatusPoller.due_faxes, whose
+            # polling window is narrower than its in-flight status filter
+            models.Index(fields=['created_at', 'id'], name='app_fax_created_idx'),
+        ]
     
     def __str__(self):
         return f"Fax {self.fax_id} to {self.to_number}"
@@ -45,9 +59,14 @@ class SMSRecord(models.Model):
     message = models.TextField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    status_updated_at = models.DateTimeField(blank=True, null=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='app_sms_created_idx'),
+        ]
     
     def __str__(self):
         return f"SMS {self.sid} to {self.to_number}"
@@ -66,6 +85,7 @@ class APIConfiguration(models.Model):
     account_sid = models.CharField(max_length=255, blank=True, null=True)
     auth_token = models.CharField(max_length=255, blank=True, null=True)
     from_number = models.CharField(max_length=20, blank=True, null=True)
+    connection_id = models.CharField(max_length=100, blank=True, null=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
@@ -75,3 +95,110 @@ class APIConfiguration(models.Model):
     
     def __str__(self):
         return f"{self.service} Configuration"
+
+class CarrierLookup(models.Model):
+    """Cached Twilio Lookup carrier type for a phone number"""
+    phone_number = models.CharField(max_length=20, unique=True)  # E.164
+    carrier_type = models.CharField(max_length=30, blank=True)
+    carrier_name = models.CharField(max_length=200, blank=True, null=True)
+    is_mobile = models.BooleanField(default=False)
+    looked_up_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.phone_number} ({self.carrier_type or 'unknown'})"
+
+class MediaUpload(models.Model):
+    """A fax document staged once with Telnyx media storage or locally, keyed by content hash"""
+    BACKEND_CHOICES = [
+        ('telnyx', 'Telnyx media storage'),
+        ('local', 'Local'),
+    ]
+    
+    content_hash = models.CharField(max_length=64)  # SHA-256 of the document bytes
+    backend = models.CharField(max_length=20, choices=BACKEND_CHOICES)
+    media_name = models.CharField(max_length=200, unique=True)
+    filename = models.CharField(max_length=255, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveIntegerField(default=0)
+    uploaded_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(blank=True, null=True)  # None: kept until removed
+    
+    class Meta:
+        unique_together = ['content_hash', 'backend']
+    
+    def __str__(self):
+        return f"{self.backend} media {self.media_name}"
+
+class DocumentBlob(models.Model):
+    """A faxed document kept compressed in the document store, keyed by content hash, see app/document_store.py"""
+    content_hash = models.CharField(max_length=64, unique=True)  # SHA-256 of the document bytes
+    filename = models.CharField(max_length=255, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveIntegerField(default=0)  # Uncompressed
+    stored_size = models.PositiveIntegerField(default=0)  # On disk
+    path = models.CharField(max_length=255)  # Relative to DOCUMENT_STORE_ROOT
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)  # Eviction is least recently used first
+    
+    def __str__(self):
+        return f"Document {self.content_hash[:12]} ({self.filename})"
+
+class ArchivedRecord(models.Model):
+    """Where an archived FaxRecord or SMSRecord row was written, see app/archive.py"""
+    KIND_CHOICES = [
+        ('fax', 'Fax'),
+        ('sms', 'SMS'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    key = models.CharField(max_length=100)  # fax_id or sid
+    segment = models.CharField(max_length=255)  # Segment file, relative to ARCHIVE_ROOT
+    line = models.PositiveIntegerField()  # Line of the row within the segment
+    created_at = models.DateTimeField()  # Of the archived row
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['kind', 'key']
+    
+    def __str__(self):
+        return f"Archived {self.kind} {self.key}"
+
+class DailyStat(models.Model):
+    """
+    Count of FaxRecord or SMSRecord rows created on a day, by status and attributes
+
+    Maintained as rows are written and statuses change (see app/daily_stats.py);
+    archiving rows does not reduce it.
+    """
+    KIND_CHOICES = [
+        ('fax', 'Fax'),
+        ('sms', 'SMS'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    device_type = models.CharField(max_length=100, blank=True, default='')
+    provider = models.CharField(max_length=20, blank=True, default='')
+    direction = models.CharField(max_length=10, blank=True, default='')
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['kind', 'day', 'status', 'device_type', 'provider', 'direction']
+    
+    def __str__(self):
+        return f"{self.kind} {self.day} {self.status}: {self.count}"
+
+class RecordCount(models.Model):
+    """
+    Row count of a table, optionally for one direction, shared by every process
+
+    Adjusted in the same transaction as the rows it counts and recounted
+    when older than FAX_COUNT_MAX_AGE, see app/record_counts.py.
+    """
+    key = models.CharField(max_length=100, unique=True)  # e.g. faxrecord:all, faxrecord:inbound
+    count = models.IntegerField(default=0)
+    counted_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.key}: {self.count}"
@@ -0,0 +1,149 @@
+import io
+import os
+import uuid
+import mimetypes
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks read from the attachment while the request body is sent
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.doc': 'application/msword',
+    '.pdf': 'application/pdf',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+}
+
+
+def guess_content_type(filename):
+    """Return the MIME type for an attachment based on its file extension"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    return CONTENT_TYPES.get(extension) or mimetypes.guess_type(filename or '')[0] or 'application/octet-stream'
+
+
+def open_document(document):
+    """
+    Open a document given as bytes, a file path or a file-like object
+
+    Returns:
+        tuple: (file object, True if the caller is responsible for closing it)
+    """
+    if isinstance(document, (bytes, bytearray, memoryview)):
+        return io.BytesIO(document), True
+    if isinstance(document, (str, os.PathLike)):
+        return open(document, 'rb'), True
+    if hasattr(document, 'read'):
+        return document, False
+    raise TypeError(f"Unsupported document type: {type(document).__name__}")
+
+
+def document_name(document, default='document'):
+    """Best-effort filename for a document given as a path or file object"""
+    if isinstance(document, (str, os.PathLike)):
+        return os.path.basename(os.fspath(document))
+    name = getattr(document, 'name', None)
+    if isinstance(name, str) and name:
+        return os.path.basename(name)
+    return default
+
+
+def remaining_size(file_obj):
+    """Number of bytes left to read from a file object"""
+    try:
+        return os.fstat(file_obj.fileno()).st_size - file_obj.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        position = file_obj.tell()
+        end = file_obj.seek(0, io.SEEK_END)
+        file_obj.seek(position)
+        return end - position
+
+
+class MultipartFileStream:
+    """
+    A multipart/form-data request body holding a single file part, optionally
+    preceded by plain text fields.
+
+    The body is exposed as a file-like object with a known length, so
+    requests sends it with a Content-Length header and reads it in small
+    blocks instead of building the whole payload in memory.
+
+    A file object passed in is read from its current position and left
+    there again on close, so a retry or a failover to another provider
+    sends the whole document again; rewind() restarts the body itself.
+    """
+
+    def __init__(self, field_name, document, filename, content_type=None, fields=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+        self._file, self._owns_file = open_document(document)
+        if hasattr(self._file, 'seekable') and not self._file.seekable():
+            raise TypeError("Documents must be seekable so a retried upload can send them again")
+        self._start = self._file.tell()
+        file_size = remaining_size(self._file)
+
+        safe_field = field_name.replace('"', '%22')
+        safe_filename = filename.replace('"', '%22')
+        text_parts = []
+        for name, value in (fields or {}).items():
+            safe_name = name.replace('"', '%22')
+            text_parts.append(
+                f"--{self.boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{safe_name}\"\r\n"
+                "\r\n"
+                f"{value}\r\n"
+            )
+        head = ''.join(text_parts).encode('utf-8') + (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"{safe_field}\"; filename=\"{safe_filename}\"\r\n"
+            f"Content-Type: {content_type or guess_content_type(filename)}\r\n"
+            "\r\n"
+        ).encode('utf-8')
+        tail = f"\r\n--{self.boundary}--\r\n".encode('ascii')
+
+        self._parts = [io.BytesIO(head), self._file, io.BytesIO(tail)]
+        self._current = 0
+        self.file_size = file_size
+        self.len = len(head) + file_size + len(tail)
+
+    def __len__(self):
+        return self.len
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            # Only used by callers that want the whole body at once
+            return b''.join(iter(lambda: self.read(CHUNK_SIZE), b''))
+        chunks = []
+        while size > 0 and self._current < len(self._parts):
+            chunk = self._parts[self._current].read(size)
+            if not chunk:
+                self._current += 1
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def rewind(self):
+        """Start the body over, e.g. before sending it again"""
+        for part in self._parts:
+            part.seek(0)
+        self._file.seek(self._start)
+        self._current = 0
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+        elif not getattr(self._file, 'closed', False):
+            self._file.seek(self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
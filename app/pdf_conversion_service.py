@@ -0,0 +1,355 @@
+import os
+import re
+import time
+import queue
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Matches page objects but not the /Pages tree nodes
+PAGE_OBJECT_RE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+
+
+def count_pdf_pages(pdf_path):
+    """
+    Count the pages of a PDF file
+
+    Uses pypdf when it is installed, otherwise counts page objects directly,
+    which is reliable for the uncompressed object layout LibreOffice writes.
+    """
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(pdf_path).pages)
+    except ImportError:
+        pass
+    except Exception as e:
+        logger.warning(f"pypdf could not read {pdf_path}: {str(e)}")
+
+    with open(pdf_path, 'rb') as f:
+        return max(len(PAGE_OBJECT_RE.findall(f.read())), 1)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _Worker:
+    """A LibreOffice worker slot with its own persistent user profile"""
+
+    def __init__(self, index, root_dir):
+        self.index = index
+        self.profile_dir = os.path.join(root_dir, f"profile-{index}")
+        self.output_dir = os.path.join(root_dir, f"output-{index}")
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.warm = False
+
+    @property
+    def profile_url(self):
+        return Path(self.profile_dir).as_uri()
+
+
+class PDFConversionService:
+    """
+    Convert rendered .docx orders to PDF with headless LibreOffice.
+
+    Each worker owns a LibreOffice user profile that is created once when the
+    pool starts, so conversions skip the expensive first-start profile setup,
+    and separate profiles let workers run side by side. Each conversion is
+    still its own soffice process, so the process start-up itself (around a
+    second) is paid per document; keeping long-lived listeners instead would
+    need the uno bindings, which this project does not depend on.
+
+    Results are cached on disk by the SHA-256 of the source document. The
+    cache holds patient orders, so it is bounded: files unused for
+    PDF_CONVERSION_CACHE_MAX_AGE seconds are deleted, and the least recently
+    used ones beyond PDF_CONVERSION_CACHE_MAX_BYTES. Sent documents are kept
+    by the document store, not here.
+    """
+
+    def __init__(self, workers=None, cache_dir=None, soffice_path=None, timeout=None,
+                 cache_max_bytes=None, cache_max_age=None):
+        self.workers = workers or getattr(settings, 'PDF_CONVERSION_WORKERS', 2)
+        self.cache_dir = cache_dir or getattr(settings, 'PDF_CONVERSION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fax_pdf_cache'))
+        self.soffice_path = soffice_path or getattr(settings, 'LIBREOFFICE_PATH', None) or shutil.which('soffice') or shutil.which('libreoffice')
+        self.timeout = timeout or getattr(settings, 'PDF_CONVERSION_TIMEOUT', 120)
+        self.cache_max_bytes = cache_max_bytes if cache_max_bytes is not None else getattr(
+            settings, 'PDF_CONVERSION_CACHE_MAX_BYTES', 256 * 1024 * 1024
+        )
+        self.cache_max_age = cache_max_age if cache_max_age is not None else getattr(
+            settings, 'PDF_CONVERSION_CACHE_MAX_AGE', 3600
+        )
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'conversions': 0, 'cache_hits': 0, 'failures': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+        self._evict_lock = threading.Lock()
+
+    def is_available(self):
+        """Check whether a LibreOffice binary was found"""
+        return bool(self.soffice_path)
+
+    def _get_pool(self):
+        """Create the worker slots and warm their profiles on first use"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    root_dir = tempfile.mkdtemp(prefix='fax_soffice_')
+                    pool = queue.Queue()
+                    workers = [_Worker(i, root_dir) for i in range(self.workers)]
+                    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+                        list(executor.map(self._warm_up, workers))
+                    for worker in workers:
+                        pool.put(worker)
+                    self._pool = pool
+                    logger.info(f"Started {len(workers)} LibreOffice workers in {root_dir}")
+        return self._pool
+
+    def _warm_up(self, worker):
+        """Initialize the worker's user profile so later conversions start fast"""
+        start = time.monotonic()
+        try:
+            subprocess.run(
+                [self.soffice_path, f"-env:UserInstallation={worker.profile_url}", '--headless', '--terminate_after_init'],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=self.timeout,
+                check=False
+            )
+            worker.warm = True
+            logger.info(f"LibreOffice worker {worker.index} warmed up in {time.monotonic() - start:.2f}s")
+        except Exception as e:
+            logger.warning(f"Could not warm up LibreOffice worker {worker.index}: {str(e)}")
+
+    def evict_cache(self):
+        """
+        Delete cached PDFs that are too old, then the least recently used
+        ones until the cache fits in cache_max_bytes
+
+        Returns:
+            int: Files deleted
+        """
+        with self._evict_lock:
+            try:
+                entries = [
+                    (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                    for entry in os.scandir(self.cache_dir)
+                    if entry.is_file() and entry.name.endswith('.pdf')
+                ]
+            except OSError as e:
+                logger.warning(f"Could not scan PDF cache {self.cache_dir}: {str(e)}")
+                return 0
+            entries.sort()
+            oldest_allowed = time.time() - self.cache_max_age
+            total = sum(size for _, size, _ in entries)
+            deleted = 0
+            for mtime, size, path in entries:
+                if mtime >= oldest_allowed and total <= self.cache_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not evict cached PDF {path}: {str(e)}")
+                    continue
+                total -= size
+                deleted += 1
+            if deleted:
+                logger.info(f"Evicted {deleted} cached PDFs from {self.cache_dir}")
+            return deleted
+
+    def _record(self, seconds=None, cache_hit=False, failed=False):
+        with self._stats_lock:
+            if cache_hit:
+                self._stats['cache_hits'] += 1
+            elif failed:
+                self._stats['failures'] += 1
+            else:
+                self._stats['conversions'] += 1
+                self._stats['total_seconds'] += seconds
+                self._stats['max_seconds'] = max(self._stats['max_seconds'], seconds)
+
+    def stats(self):
+        """
+        Conversion latency statistics for this process
+
+        Returns:
+            dict: Counters plus average and maximum conversion time in seconds
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['avg_seconds'] = stats['total_seconds'] / stats['conversions'] if stats['conversions'] else 0.0
+        return stats
+
+    def convert(self, docx_path):
+        """
+        Convert a document to PDF
+
+        Args:
+            docx_path (str): Path of the .docx file
+
+        Returns:
+            dict: Conversion result with pdf_path and num_pages on success
+        """
+        try:
+            content_hash = file_sha256(docx_path)
+            cached_path = os.path.join(self.cache_dir, f"{content_hash}.pdf")
+
+            if os.path.exists(cached_path):
+                # The modification time is the last use, for eviction
+                os.utime(cached_path)
+                self._record(cache_hit=True)
+                logger.info(f"PDF cache hit for {os.path.basename(docx_path)}")
+                return {
+                    'success': True,
+                    'pdf_path': cached_path,
+                    'num_pages': count_pdf_pages(cached_path),
+                    'cached': True,
+                    'content_hash': content_hash
+                }
+
+            if not self.is_available():
+                return {
+                    'success': False,
+                    'error': 'LibreOffice (soffice) was not found',
+                    'message': 'PDF conversion is not available'
+                }
+
+            pool = self._get_pool()
+            worker = pool.get()
+            start = time.monotonic()
+            try:
+                # Convert a copy named after the hash so concurrent documents
+                # with the same filename never collide in the output directory
+                source_path = os.path.join(worker.output_dir, f"{content_hash}.docx")
+                shutil.copyfile(docx_path, source_path)
+                result = subprocess.run(
+                    [
+                        self.soffice_path,
+                        f"-env:UserInstallation={worker.profile_url}",
+                        '--headless', '--norestore',
+                        '--convert-to', 'pdf',
+                        '--outdir', worker.output_dir,
+                        source_path
+                    ],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    timeout=self.timeout
+                )
+                output_path = os.path.join(worker.output_dir, f"{content_hash}.pdf")
+                os.remove(source_path)
+
+                if result.returncode != 0 or not os.path.exists(output_path):
+                    self._record(failed=True)
+                    error = result.stderr.decode('utf-8', 'replace').strip() or f"exit code {result.returncode}"
+                    logger.error(f"LibreOffice failed to convert {docx_path}: {error}")
+                    return {
+                        'success': False,
+                        'error': f"Conversion failed: {error}",
+                        'message': 'Failed to convert document to PDF'
+                    }
+
+                os.replace(output_path, cached_path)
+            finally:
+                pool.put(worker)
+
+            seconds = time.monotonic() - start
+            self._record(seconds=seconds)
+            num_pages = count_pdf_pages(cached_path)
+            self.evict_cache()
+            logger.info(f"Converted {os.path.basename(docx_path)} to PDF ({num_pages} pages) in {seconds:.2f}s")
+
+            return {
+                'success': True,
+                'pdf_path': cached_path,
+                'num_pages': num_pages,
+                'cached': False,
+                'content_hash': content_hash,
+                'seconds': seconds
+            }
+
+        except Exception as e:
+            self._record(failed=True)
+            logger.error(f"Error converting {docx_path} to PDF: {str(e)}")
+            return {
+                'success': False,
+                'error': f"Error converting document: {str(e)}",
+                'message': 'Failed to convert document to PDF'
+            }
+
+    def convert_many(self, docx_paths):
+        """
+        Convert several documents in parallel, one per worker
+
+        Returns:
+            list: Conversion results in the same order as docx_paths
+        """
+        if not docx_paths:
+            return []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self.convert, docx_paths))
+
+    def prepare_for_fax(self, docx_path, filename):
+        """
+        Return the file to upload for a rendered order
+
+        Falls back to the original .docx when conversion is disabled or fails.
+
+        Returns:
+            tuple: (path, filename, num_pages)
+        """
+        return self.prepare_many_for_fax([(docx_path, filename)])[0]
+
+    def prepare_many_for_fax(self, documents):
+        """
+        Convert rendered orders in parallel and pick the file to upload for each
+
+        Args:
+            documents (list): (docx_path, filename) tuples
+
+        Returns:
+            list: (path, filename, num_pages) tuples in input order
+        """
+        if not getattr(settings, 'FAX_CONVERT_TO_PDF', True):
+            return [(path, filename, 1) for path, filename in documents]
+
+        prepared = []
+        results = self.convert_many([path for path, _ in documents])
+        for (docx_path, filename), result in zip(documents, results):
+            if result['success']:
+                pdf_filename = f"{os.path.splitext(filename)[0]}.pdf"
+                prepared.append((result['pdf_path'], pdf_filename, result['num_pages']))
+            else:
+                logger.warning(f"Sending {filename} as .docx: {result.get('error')}")
+                prepared.append((docx_path, filename, 1))
+        return prepared
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_conversion_service():
+    """Return the process-wide conversion service so its workers stay warm"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = PDFConversionService()
+    return _service
@@ -0,0 +1,107 @@
+"""
+Phone and fax number normalization shared by every send path
+
+Numbers arrive typed by hand, pasted from spreadsheets (sometimes as floats
+like 5551234567.0) or read back from provider APIs. They are stripped with
+a precompiled str.translate table and the results memoized, since bulk jobs
+see the same numbers over and over.
+"""
+import re
+import string
+from functools import lru_cache
+
+DEFAULT_COUNTRY_CODE = '1'
+
+# E.164 numbers have at most 15 digits; national numbers at least 10
+MIN_DIGITS = 10
+MAX_DIGITS = 15
+
+# Deletes every ASCII character except 0-9 in a single translate() pass
+_NON_DIGITS = str.maketrans('', '', ''.join(chr(c) for c in range(128) if chr(c) not in string.digits))
+
+_SEPARATORS_RE = re.compile(r'[,;\r\n]+')
+
+
+def _as_text(value):
+    """Text form of a number, undoing the float spreadsheets turn numbers into"""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:  # NaN from an empty spreadsheet cell
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+@lru_cache(maxsize=65536)
+def _digits(text):
+    digits = text.translate(_NON_DIGITS)
+    if not digits.isascii():
+        # Non-ASCII characters survive the table; keep only 0-9
+        digits = ''.join(c for c in digits if '0' <= c <= '9')
+    return digits
+
+
+@lru_cache(maxsize=65536)
+def _e164(text):
+    digits = _digits(text)
+    if len(digits) < MIN_DIGITS or len(digits) > MAX_DIGITS:
+        return None
+    if len(digits) == MIN_DIGITS:
+        return f"+{DEFAULT_COUNTRY_CODE}{digits}"
+    return f"+{digits}"
+
+
+def digits_only(value):
+    """
+    Strip everything but digits, e.g. '+1 (555) 123-4567' -> '15551234567'
+
+    This is the format HumbleFax expects for fromNumber and recipients.
+    """
+    return _digits(_as_text(value))
+
+
+def to_e164(value):
+    """
+    Normalize a number to E.164, e.g. '(555) 123-4567' -> '+15551234567'
+
+    Ten-digit numbers get the default country code.
+
+    Returns:
+        str: The E.164 number, or None if it is not a valid length
+    """
+    return _e164(_as_text(value))
+
+
+def split_numbers(text):
+    """Split a comma, semicolon or newline separated list of numbers"""
+    return [number.strip() for number in _SEPARATORS_RE.split(text or '') if number.strip()]
+
+
+def to_e164_many(values):
+    """
+    Normalize a list or pandas Series of numbers to E.164
+
+    A Series is factorized so each distinct value is normalized once, and is
+    returned as a Series with None for invalid numbers; anything else
+    returns a list.
+    """
+    if hasattr(values, 'dtype') and hasattr(values, 'index'):
+        return _to_e164_series(values)
+    return [_e164(_as_text(value)) for value in values]
+
+
+def _to_e164_series(series):
+    import numpy as np
+    import pandas as pd
+
+    # Normalize each distinct value once, then gather; missing values get code -1
+    codes, uniques = pd.factorize(series)
+    normalized = np.array([to_e164(value) for value in uniques] + [None], dtype=object)
+    return pd.Series(normalized[codes], index=series.index, dtype=object)
+
+
+def cache_info():
+    """lru_cache statistics for the digit and E.164 caches"""
+    return {'digits': _digits.cache_info()._asdict(), 'e164': _e164.cache_info()._asdict()}
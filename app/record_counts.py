@@ -0,0 +1,79 @@
+"""
+FaxRecord totals for fax_list without a COUNT(*) per page view
+
+The totals live in RecordCount rows, so every process and server reads the
+same numbers. Saves, deletes and BufferedRecordWriter batches adjust them
+through signals, in the same transaction as the rows they count. A total
+older than FAX_COUNT_MAX_AGE is recounted, which repairs writes that bypass
+the signals (QuerySet.update, raw SQL).
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import FaxRecord, RecordCount
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ('outbound', 'inbound')
+
+
+def _key(direction=None):
+    return f"faxrecord:{direction or 'all'}"
+
+
+def _max_age():
+    return timedelta(seconds=getattr(settings, 'FAX_COUNT_MAX_AGE', 300))
+
+
+def fax_count(direction=None):
+    """
+    Number of FaxRecord rows, optionally for one direction
+
+    The COUNT(*) runs only when the stored total is missing or older than
+    FAX_COUNT_MAX_AGE; saves and deletes keep it current in between.
+    """
+    key = _key(direction)
+    stored = RecordCount.objects.filter(key=key).values_list('count', 'counted_at').first()
+    if stored and stored[1] > timezone.now() - _max_age():
+        return stored[0]
+    return recount(direction)
+
+
+def recount(direction=None):
+    """Count the table and store the total; returns it"""
+    key = _key(direction)
+    queryset = FaxRecord.objects.all()
+    if direction:
+        queryset = queryset.filter(direction=direction)
+    with transaction.atomic():
+        count = queryset.count()
+        values = {'count': count, 'counted_at': timezone.now()}
+        try:
+            with transaction.atomic():
+                RecordCount.objects.update_or_create(key=key, defaults=values)
+        except IntegrityError:
+            # Created concurrently; overwrite it with this count
+            RecordCount.objects.filter(key=key).update(**values)
+    return count
+
+
+def adjust_fax_counts(directions, delta=1, using=None):
+    """
+    Add delta to the stored totals for each direction given and to the total
+
+    Args:
+        directions (iterable): Direction of each row added or removed
+        delta (int): +1 for inserts, -1 for deletes
+        using (str): Database alias of the rows
+    """
+    by_key = {}
+    for direction in directions:
+        by_key[_key()] = by_key.get(_key(), 0) + delta
+        if direction in DIRECTIONS:
+            by_key[_key(direction)] = by_key.get(_key(direction), 0) + delta
+    for key, change in by_key.items():
+        # A total not stored yet is counted on its first read
+        RecordCount.objects.using(using or DEFAULT_DB_ALIAS).filter(key=key).update(count=F('count') + change)
@@ -0,0 +1,255 @@
+"""
+Full-text search over fax and SMS history
+
+On SQLite the searchable columns are indexed in external-content FTS5
+tables (app_faxrecord_fts, app_smsrecord_fts) that triggers keep in step
+with every insert, update and delete, including bulk_create and
+QuerySet.update. A search is an FTS5 MATCH of prefix terms read newest
+first, so it touches only the rows it returns. Other backends, or SQLite
+builds without FTS5, fall back to icontains filters.
+"""
+import re
+import logging
+from django.db import connection
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce, Replace
+from .models import FaxRecord, SMSRecord
+
+logger = logging.getLogger(__name__)
+
+# Indexed table -> (FTS table, indexed columns)
+FTS_TABLES = {
+    'app_faxrecord': ('app_faxrecord_fts', ('patient_name', 'subject', 'to_number', 'device_type')),
+    'app_smsrecord': ('app_smsrecord_fts', ('message', 'to_number')),
+}
+
+FAX_RESULT_COLUMNS = ('fax_id', 'to_number', 'patient_name', 'device_type', 'subject', 'status', 'created_at')
+SMS_RESULT_COLUMNS = ('sid', 'to_number', 'message', 'status', 'created_at')
+
+PHONE_PUNCTUATION = ' ().-+'
+PHONE_QUERY_RE = re.compile(r'^[\d\s().+-]+$')
+TOKEN_RE = re.compile(r'\w+')
+
+_ready = {}
+
+
+def fts5_supported(conn=connection):
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        # Loadable or built-in without the compile option reported
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+            cursor.execute("DROP TABLE temp.fts5_probe")
+            return True
+        except Exception:
+            return False
+
+
+def _indexed_value(prefix, column):
+    """
+    SQL for the value indexed for a column
+
+    Numbers are stored as typed, e.g. "(817) 555-1234"; they are indexed as
+    digits only so a search for any formatting of the number finds them.
+    """
+    value = f"{prefix}{column}"
+    if column == 'to_number':
+        value = f"coalesce({value}, '')"
+        for char in PHONE_PUNCTUATION:
+            value = f"replace({value}, '{char}', '')"
+    return value
+
+
+def _normalized_number(field='to_number'):
+    """The ORM counterpart of _indexed_value for a phone number column"""
+    value = Coalesce(field, Value(''))
+    for char in PHONE_PUNCTUATION:
+        value = Replace(value, Value(char), Value(''))
+    return value
+
+
+def _trigger_sql(table, fts_table, columns):
+    column_list = ', '.join(columns)
+    new_values = ', '.join(_indexed_value('new.', column) for column in columns)
+    old_values = ', '.join(_indexed_value('old.', column) for column in columns)
+    delete_old = (
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});"
+    )
+    insert_new = f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {table} "
+        f"BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+def install_fts(conn=connection):
+    """
+    Create the FTS5 tables and their triggers where missing
+
+    Safe to run repeatedly. A new FTS table is filled from its content
+    table (not with FTS5 'rebuild', which would index numbers as typed).
+    Triggers are recreated on their own when a migration has rebuilt
+    the content table (SQLite drops a table's triggers with it) without
+    reindexing, since the rows and their ids are unchanged.
+
+    Returns:
+        bool: True if FTS5 search is installed
+    """
+    if not fts5_supported(conn):
+        logger.info("SQLite FTS5 is not available; record search uses icontains filters")
+        return False
+    with conn.cursor() as cursor:
+        for table, (fts_table, columns) in FTS_TABLES.items():
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [table])
+            if cursor.fetchone() is None:
+                continue
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [fts_table])
+            created = cursor.fetchone() is None
+            if created:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {fts_table} USING fts5({', '.join(columns)}, "
+                    f"content='{table}', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                )
+            for sql in _trigger_sql(table, fts_table, columns):
+                cursor.execute(sql)
+            if created:
+                cursor.execute(
+                    f"INSERT INTO {fts_table}(rowid, {', '.join(columns)}) "
+                    f"SELECT id, {', '.join(_indexed_value('', column) for column in columns)} FROM {table}"
+                )
+                logger.info(f"Built full-text index {fts_table}")
+    _ready.clear()
+    return True
+
+
+def uninstall_fts(conn=connection):
+    """Drop the FTS5 tables and triggers"""
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for fts_table, _ in FTS_TABLES.values():
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+    _ready.clear()
+
+
+def _fts_ready(fts_table):
+    if fts_table not in _ready:
+        ready = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [fts_table])
+                ready = cursor.fetchone() is not None
+        _ready[fts_table] = ready
+    return _ready[fts_table]
+
+
+def query_terms(text):
+    """
+    Split a search into terms; a query that is only a phone number, or the
+    start of one ("817 555", "(817) 5"), is one term of its digits
+
+    Returns:
+        tuple: (terms, is_phone)
+    """
+    text = (text or '').strip()
+    if PHONE_QUERY_RE.match(text):
+        digits = re.sub(r'\D', '', text)
+        if len(digits) >= 7 or (len(digits) >= 3 and not text.isdigit()):
+            return [digits], True
+    return TOKEN_RE.findall(text), False
+
+
+def number_variants(term, is_phone=False):
+    """
+    The forms a digit term may be stored in
+
+    Stored numbers may or may not carry the country code, so digit terms
+    also match with a leading 1, and a phone query typed with the country
+    code also matches without it.
+    """
+    if not term.isdigit():
+        return [term]
+    if not term.startswith('1'):
+        return [term, f"1{term}"]
+    if is_phone and len(term) > 1:
+        return [term, term[1:]]
+    return [term]
+
+
+def fts_match(terms, is_phone=False):
+    """FTS5 MATCH expression requiring every term as a prefix, in any of its number_variants"""
+    parts = []
+    for term in terms:
+        variants = number_variants(term.replace('"', ''), is_phone)
+        if len(variants) > 1:
+            parts.append('(' + ' OR '.join(f'"{variant}"*' for variant in variants) + ')')
+        else:
+            parts.append(f'"{variants[0]}"*')
+    expression = ' AND '.join(parts)
+    return f"to_number : ({expression})" if is_phone else expression
+
+
+def _search(model, table, text, columns, limit):
+    terms, is_phone = query_terms(text)
+    if not terms:
+        return []
+    fts_table, fts_columns = FTS_TABLES[table]
+
+    if _fts_ready(fts_table):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH %s ORDER BY rowid DESC LIMIT %s",
+                [fts_match(terms, is_phone), limit]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return []
+        queryset = model.objects.filter(id__in=ids)
+    else:
+        # Numbers are compared as digits, as the FTS index stores them
+        queryset = model.objects.annotate(indexed_to_number=_normalized_number())
+        fields = ('to_number',) if is_phone else fts_columns
+        for term in terms:
+            match_any = Q()
+            for field in fields:
+                if field == 'to_number':
+                    for variant in number_variants(term, is_phone):
+                        match_any |= Q(indexed_to_number__contains=variant)
+                else:
+                    match_any |= Q(**{f"{field}__icontains": term})
+            queryset = queryset.filter(match_any)
+
+    # Newest first, the order the FTS rowids were read in
+    return list(queryset.order_by('-id').values(*columns)[:limit])
+
+
+def search_faxes(text, limit=50):
+    """
+    Faxes whose patient name, subject, number or device type match every word
+
+    Words match as prefixes ("jo smi" finds "John Smith"); a query that is
+    only a phone number matches fax numbers starting with it.
+
+    Returns:
+        list: Dicts of FAX_RESULT_COLUMNS, newest first
+    """
+    return _search(FaxRecord, 'app_faxrecord', text, FAX_RESULT_COLUMNS, limit)
+
+
+def search_sms(text, limit=50):
+    """
+    SMS messages whose text or number match every word, as in search_faxes
+
+    Returns:
+        list: Dicts of SMS_RESULT_COLUMNS, newest first
+    """
+    return _search(SMSRecord, 'app_smsrecord', text, SMS_RESULT_COLUMNS, limit)
@@ -0,0 +1,156 @@
+import time
+import atexit
+import logging
+import threading
+import weakref
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+# Sent with sender=model, instances=[...] and using=<database alias> after a
+# batch is bulk-created, inside the transaction that created it. bulk_create sends no post_save, so
+# anything that tracks new rows listens here too; rows saved one by one after
+# an IntegrityError send post_save.
+records_written = Signal()
+
+
+class BufferedRecordWriter:
+    """
+    Collect model instances during a bulk job and save them in batches
+
+    Rows are written with bulk_create inside one transaction whenever
+    batch_size rows are buffered or flush_seconds have passed since the last
+    flush (checked as rows are added). Use it as a context manager so the
+    remaining rows are flushed when the job ends, including on errors; any
+    writer still open at interpreter shutdown is flushed too.
+
+    If a batch hits an IntegrityError (e.g. a duplicate fax_id) it is retried
+    row by row so one bad row does not lose the rest. On any other error the
+    rows stay buffered for the next flush; rows still unsaved when the writer
+    closes are logged one by one before they are dropped.
+    """
+
+    def __init__(self, model, batch_size=None, flush_seconds=None, using=None):
+        self.model = model
+        self.using = using or DEFAULT_DB_ALIAS
+        self.batch_size = batch_size or getattr(settings, 'RECORD_WRITER_BATCH_SIZE', 200)
+        self.flush_seconds = flush_seconds if flush_seconds is not None else getattr(settings, 'RECORD_WRITER_FLUSH_SECONDS', 5.0)
+        self.written = 0
+        self.failed = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        _open_writers.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def add(self, instance):
+        """Buffer an unsaved instance, flushing if the batch is full or due"""
+        with self._lock:
+            self._buffer.append(instance)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush when the batch is full or flush_seconds have passed"""
+        if len(self._buffer) >= self.batch_size or (
+                self._buffer and time.monotonic() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered rows
+
+        Returns:
+            int: Number of rows written
+        """
+        with self._lock:
+            records, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        if not records:
+            return 0
+
+        start = time.monotonic()
+        rejected = None
+        try:
+            with transaction.atomic(using=self.using):
+                try:
+                    with transaction.atomic(using=self.using):
+                        self.model.objects.using(self.using).bulk_create(records, batch_size=self.batch_size)
+                except IntegrityError as e:
+                    rejected = e
+                else:
+                    # In the batch's transaction, so the rows and what receivers derive
+                    # from them commit together; a receiver's error is not the batch's
+                    # and propagates instead of sending the rows one by one
+                    records_written.send(sender=self.model, instances=records, using=self.using)
+        except Exception as e:
+            # Nothing was committed (e.g. "database is locked"), so the rows go
+            # back in front of anything added meanwhile for the next flush
+            with self._lock:
+                self._buffer[:0] = records
+            logger.warning(f"Batch of {len(records)} {self.model.__name__} rows failed ({str(e)}), kept for the next flush")
+            raise
+        if rejected is None:
+            written = len(records)
+        else:
+            logger.warning(f"Batch of {len(records)} {self.model.__name__} rows failed ({str(rejected)}), saving one by one")
+            written = self._save_individually(records)
+
+        self.written += written
+        self.failed += len(records) - written
+        logger.debug(f"Wrote {written} {self.model.__name__} rows in {(time.monotonic() - start) * 1000:.1f}ms")
+        return written
+
+    def _save_individually(self, records):
+        written = 0
+        with transaction.atomic(using=self.using):
+            for record in records:
+                try:
+                    with transaction.atomic(using=self.using):
+                        record.save(force_insert=True, using=self.using)
+                    written += 1
+                except IntegrityError as e:
+                    logger.error(f"Could not save {self.model.__name__} {_describe(record)}: {str(e)}")
+        return written
+
+    def close(self):
+        """Flush the remaining rows and stop tracking this writer"""
+        try:
+            self.flush()
+        except Exception:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+            for record in records:
+                logger.error(f"Dropping unsaved {self.model.__name__} {_describe(record)}")
+            self.failed += len(records)
+            raise
+        finally:
+            _open_writers.discard(self)
+
+
+def _describe(record):
+    """Name a row by its provider id so a dropped one can be found again"""
+    for field in ('fax_id', 'sid'):
+        value = getattr(record, field, None)
+        if value:
+            return f"{field}={value}"
+    return str(record)
+
+
+_open_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_writers():
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception as e:
+            logger.error(f"Error flushing {writer.model.__name__} rows at shutdown: {str(e)}")
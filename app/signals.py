@@ -0,0 +1,72 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .models import APIConfiguration, FaxRecord, SMSRecord
+from .record_writer import records_written
+from .status_updates import statuses_changed
+from . import api_config_cache, daily_stats, db_profile, record_counts, record_search
+
+
+connection_created.connect(db_profile.apply_sqlite_pragmas, dispatch_uid='app.db_profile.apply_sqlite_pragmas')
+
+
+@receiver(post_save, sender=APIConfiguration)
+@receiver(post_delete, sender=APIConfiguration)
+def invalidate_api_config_cache(sender, **kwargs):
+    """Make configuration changes take effect on the next request"""
+    api_config_cache.invalidate()
+
+
+@receiver(post_save, sender=FaxRecord)
+def count_saved_fax(sender, instance, created, using, **kwargs):
+    """Keep the stored fax counts shown on fax_list current"""
+    if created:
+        record_counts.adjust_fax_counts([instance.direction], using=using)
+
+
+@receiver(post_delete, sender=FaxRecord)
+def count_deleted_fax(sender, instance, using, **kwargs):
+    record_counts.adjust_fax_counts([instance.direction], -1, using=using)
+
+
+@receiver(records_written, sender=FaxRecord)
+def count_written_faxes(sender, instances, using=None, **kwargs):
+    record_counts.adjust_fax_counts([instance.direction for instance in instances], using=using)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    """
+    Recreate the full-text search triggers after migrations
+
+    SQLite migrations that alter FaxRecord or SMSRecord rebuild the table,
+    which drops its triggers.
+    """
+    if sender.name != 'app':
+        return
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and MigrationRecorder(connection).migration_qs.filter(
+            app='app', name='0009_record_search').exists():
+        record_search.install_fts(connection)
+
+
+@receiver(post_save, sender=FaxRecord)
+@receiver(post_save, sender=SMSRecord)
+def roll_up_saved_record(sender, instance, created, using, **kwargs):
+    """Keep the dashboard's daily stats current"""
+    if created:
+        daily_stats.count_inserted(sender, [instance], using)
+
+
+@receiver(records_written, sender=FaxRecord)
+@receiver(records_written, sender=SMSRecord)
+def roll_up_written_records(sender, instances, using=None, **kwargs):
+    daily_stats.count_inserted(sender, instances, using)
+
+
+@receiver(statuses_changed, sender=FaxRecord)
+@receiver(statuses_changed, sender=SMSRecord)
+def roll_up_status_changes(sender, changes, using=None, **kwargs):
+    daily_stats.count_status_changes(sender, changes, using)
@@ -0,0 +1,192 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .fax_providers import guess_provider
+from .humblefax_service import HumbleFaxService
+from .telnyx_fax_service import TelnyxFaxService
+from .models import FaxRecord
+from .status_updates import (
+    StatusUpdate, apply_status_updates, map_status, parse_event_time, HUMBLEFAX_STATUSES, TELNYX_FAX_STATUSES
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Shortest and longest time between polls of the same fax, in seconds
+    'min_interval': 15,
+    'max_interval': 900,
+    # Poll interval as a fraction of the fax's age, so young faxes are
+    # polled often and old stragglers rarely
+    'age_factor': 0.1,
+    # Faxes still in flight after this many hours are no longer polled
+    'max_age_hours': 48,
+    # Concurrent provider requests
+    'workers': 8,
+    # Page size and page limit for the provider list endpoints
+    'page_size': 100,
+    'max_pages': 10,
+}
+
+IN_FLIGHT_STATUSES = ('pending', 'sent')
+
+
+def poll_interval(age_seconds, min_interval, max_interval, age_factor):
+    """Seconds to wait between polls of a fax of the given age"""
+    return min(max(age_seconds * age_factor, min_interval), max_interval)
+
+
+class FaxStatusPoller:
+    """
+    Poll providers for faxes that are still pending or sent
+
+    Each cycle selects only in-flight rows, skips faxes polled too recently
+    for their age, reads statuses from the provider list endpoints where
+    possible and fetches per-fax details concurrently for the rest. Updates
+    go through apply_status_updates, so polling and webhooks can run side by
+    side without moving a status backwards.
+    """
+
+    def __init__(self, **options):
+        config = dict(DEFAULTS, **getattr(settings, 'FAX_STATUS_POLL', {}))
+        config.update(options)
+        self.min_interval = config['min_interval']
+        self.max_interval = config['max_interval']
+        self.age_factor = config['age_factor']
+        self.max_age = timedelta(hours=config['max_age_hours'])
+        self.workers = config['workers']
+        self.page_size = config['page_size']
+        self.max_pages = config['max_pages']
+
+        self._last_polled = {}
+        # Whether HumbleFax /sentFaxes returns statuses; unknown until first call
+        self._humblefax_list_has_status = None
+
+    def due_faxes(self, now=None):
+        """
+        In-flight faxes whose backoff interval has elapsed
+
+        Returns:
+            list: (fax_id, created_at, provider) tuples
+        """
+        now = now or timezone.now()
+        in_flight = FaxRecord.objects.filter(
+            status__in=IN_FLIGHT_STATUSES,
+            direction='outbound',
+            created_at__gte=now - self.max_age
+        ).values_list('fax_id', 'created_at', 'provider')
+
+        due = []
+        seen = set()
+        monotonic = time.monotonic()
+        for fax_id, created_at, provider in in_flight:
+            seen.add(fax_id)
+            age = (now - created_at).total_seconds()
+            last = self._last_polled.get(fax_id)
+            if last is None or monotonic - last >= poll_interval(age, self.min_interval, self.max_interval, self.age_factor):
+                due.append((fax_id, created_at, provider or guess_provider(fax_id)))
+
+        # Forget faxes that reached a final status or aged out
+        for fax_id in set(self._last_polled) - seen:
+            del self._last_polled[fax_id]
+        return due
+
+    def poll_once(self):
+        """
+        Run one polling cycle
+
+        Returns:
+            dict: Counts of faxes polled, statuses received and rows updated
+        """
+        due = self.due_faxes()
+        if not due:
+            return {'due': 0, 'received': 0, 'updated': 0}
+
+        telnyx_ids = {fax_id for fax_id, _, provider in due if provider == 'telnyx'}
+        humblefax_ids = {fax_id for fax_id, _, provider in due if provider == 'humblefax'}
+
+        # Services read their configuration here so worker threads never touch the database
+        telnyx = TelnyxFaxService() if telnyx_ids else None
+        if telnyx_ids and not telnyx.api_key:
+            logger.warning("No Telnyx API key configured, skipping Telnyx status poll")
+            telnyx_ids = set()
+
+        # Providers are polled side by side, each fanning out its own detail calls
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            humblefax_future = executor.submit(self._poll_humblefax, HumbleFaxService(), humblefax_ids) if humblefax_ids else None
+            telnyx_future = executor.submit(self._poll_telnyx, telnyx, telnyx_ids) if telnyx_ids else None
+            updates = []
+            for future in (humblefax_future, telnyx_future):
+                if future is not None:
+                    updates.extend(future.result())
+
+        polled_at = time.monotonic()
+        for fax_id, _, _ in due:
+            self._last_polled[fax_id] = polled_at
+
+        changed = apply_status_updates(FaxRecord, 'fax_id', updates)
+        logger.info(f"Polled {len(due)} faxes: {len(updates)} statuses received, {len(changed)} updated")
+        return {'due': len(due), 'received': len(updates), 'updated': len(changed)}
+
+    def _poll_humblefax(self, service, fax_ids):
+        updates = []
+        remaining = set(fax_ids)
+
+        if self._humblefax_list_has_status is not False:
+            for page in range(self.max_pages):
+                result = service.get_sent_fax_page(limit=self.page_size, offset=page * self.page_size)
+                if result is None:
+                    break
+                if result['faxes'] is None:
+                    # The list only carries IDs, so it cannot save detail calls
+                    self._humblefax_list_has_status = False
+                    break
+                self._humblefax_list_has_status = True
+                for fax in result['faxes']:
+                    if fax['id'] in remaining:
+                        remaining.discard(fax['id'])
+                        status = map_status(HUMBLEFAX_STATUSES, fax['status'])
+                        if status:
+                            updates.append(StatusUpdate(fax['id'], status, parse_event_time(fax['updated_at'])))
+                if not remaining or len(result['ids']) < self.page_size:
+                    break
+
+        # Per-fax details for anything the list did not cover
+        if remaining:
+            with ThreadPoolExecutor(max_workers=self.workers) as detail_executor:
+                remaining = sorted(remaining)
+                for fax_id, detail in zip(remaining, detail_executor.map(service.get_fax_detail, remaining)):
+                    status = map_status(HUMBLEFAX_STATUSES, detail.get('status')) if detail else None
+                    if status:
+                        updates.append(StatusUpdate(fax_id, status, parse_event_time(detail.get('updated_at'))))
+        return updates
+
+    def _poll_telnyx(self, service, fax_ids):
+        updates = []
+        remaining = set(fax_ids)
+
+        def add(fax):
+            status = map_status(TELNYX_FAX_STATUSES, fax.get('status'))
+            if status:
+                updates.append(StatusUpdate(fax['id'], status, parse_event_time(fax.get('updated_at'))))
+
+        for page in range(1, self.max_pages + 1):
+            result = service.list_faxes(page_number=page, page_size=self.page_size)
+            if result is None:
+                break
+            for fax in result.get('data', []):
+                if fax.get('id') in remaining:
+                    remaining.discard(fax['id'])
+                    add(fax)
+            total_pages = result.get('meta', {}).get('total_pages', page)
+            if not remaining or page >= total_pages:
+                break
+
+        if remaining:
+            with ThreadPoolExecutor(max_workers=self.workers) as detail_executor:
+                for fax in detail_executor.map(service.get_fax, remaining):
+                    if fax:
+                        add(fax)
+        return updates
@@ -0,0 +1,217 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from datetime import timezone as dt_timezone
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import FaxRecord, SMSRecord
+
+logger = logging.getLogger(__name__)
+
+# Sent with sender=model, changes=[(record, old_status), ...] and
+# using=<database alias> inside the transaction that applied them. bulk_update sends no post_save, so anything
+# derived from statuses listens here.
+statuses_changed = Signal()
+
+# A status change reported by a provider for one fax or message
+StatusUpdate = namedtuple('StatusUpdate', ['key', 'status', 'occurred_at'])
+
+# Statuses only move forward; equal-rank terminal statuses never replace each other
+STATUS_RANK = {
+    'pending': 0,
+    'sent': 1,
+    'delivered': 2,
+    'failed': 2,
+    'cancelled': 2,
+}
+TERMINAL_STATUSES = {'delivered', 'failed', 'cancelled'}
+
+TELNYX_FAX_STATUSES = {
+    'queued': 'sent',
+    'media.processed': 'sent',
+    'media_processed': 'sent',
+    'originated': 'sent',
+    'sending': 'sent',
+    'sending.started': 'sent',
+    'delivered': 'delivered',
+    'failed': 'failed',
+}
+
+HUMBLEFAX_STATUSES = {
+    'in progress': 'sent',
+    'in_progress': 'sent',
+    'queued': 'sent',
+    'sending': 'sent',
+    'sent': 'sent',
+    'success': 'delivered',
+    'delivered': 'delivered',
+    'failure': 'failed',
+    'failed': 'failed',
+    'cancelled': 'cancelled',
+}
+
+TWILIO_SMS_STATUSES = {
+    'accepted': 'sent',
+    'scheduled': 'sent',
+    'queued': 'sent',
+    'sending': 'sent',
+    'sent': 'sent',
+    'delivered': 'delivered',
+    'read': 'delivered',
+    'undelivered': 'failed',
+    'failed': 'failed',
+    'canceled': 'failed',
+}
+
+
+def map_status(mapping, raw_status):
+    """Map a provider status to a record status, or None if it is unknown"""
+    if not raw_status:
+        return None
+    return mapping.get(str(raw_status).strip().lower())
+
+
+def parse_event_time(value):
+    """Parse a provider timestamp, falling back to the time of receipt"""
+    if value:
+        try:
+            parsed = parse_datetime(str(value))
+            if parsed is not None:
+                return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+        except ValueError:
+            pass
+    return timezone.now()
+
+
+def _latest_per_key(updates):
+    """Collapse duplicate and out-of-order updates to the most advanced one per key"""
+    latest = {}
+    for update in updates:
+        if update.status not in STATUS_RANK:
+            continue
+        current = latest.get(update.key)
+        if current is None:
+            latest[update.key] = update
+            continue
+        if STATUS_RANK[update.status] > STATUS_RANK[current.status]:
+            latest[update.key] = update
+        elif STATUS_RANK[update.status] == STATUS_RANK[current.status] and update.status not in TERMINAL_STATUSES \
+                and update.occurred_at > current.occurred_at:
+            latest[update.key] = update
+    return latest
+
+
+def apply_status_updates(model, key_field, updates, batch_size=500, using=None):
+    """
+    Apply provider status updates to records in one transaction
+
+    Duplicate and out-of-order updates are harmless: a status only replaces
+    the stored one when it ranks higher (pending < sent < final), so a late
+    'sent' never overwrites 'delivered' and repeated events are no-ops.
+
+    Args:
+        model: FaxRecord or SMSRecord
+        key_field (str): Provider ID field, 'fax_id' or 'sid'
+        updates (list): StatusUpdate tuples
+        using (str): Database alias (default: the default database)
+
+    Returns:
+        list: (record, old_status) for every record whose status changed
+    """
+    latest = _latest_per_key(updates)
+    if not latest:
+        return []
+
+    using = using or DEFAULT_DB_ALIAS
+    now = timezone.now()
+    changed = []
+    with transaction.atomic(using=using):
+        records = model.objects.using(using).select_for_update().filter(**{f"{key_field}__in": list(latest)})
+        for record in records:
+            update = latest[getattr(record, key_field)]
+            if STATUS_RANK[update.status] <= STATUS_RANK.get(record.status, 0):
+                continue
+            changed.append((record, record.status))
+            record.status = update.status
+            record.status_updated_at = update.occurred_at or now
+            record.updated_at = now
+
+        if changed:
+            fields = ['status', 'status_updated_at']
+            if hasattr(model, 'updated_at'):
+                fields.append('updated_at')
+            model.objects.using(using).bulk_update([record for record, _ in changed], fields, batch_size=batch_size)
+            statuses_changed.send(sender=model, changes=changed, using=using)
+
+    logger.info(f"Applied {len(changed)} of {len(latest)} {model.__name__} status updates")
+    return changed
+
+
+class StatusUpdateBatcher:
+    """
+    Group commit for status updates arriving on concurrent webhook requests
+
+    The first request to arrive waits briefly for others, then applies every
+    queued update in one transaction. Each request returns only after its
+    updates are committed, so acknowledging a webhook never loses an event.
+    A request applies at most one batch: updates that queued up meanwhile
+    are applied by the oldest of their requests, so under steady traffic no
+    request is kept waiting on other requests' updates.
+    """
+
+    def __init__(self, model, key_field, max_wait=0.05):
+        self.model = model
+        self.key_field = key_field
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = []
+        self._flushing = False
+
+    def submit(self, updates):
+        entry = {'updates': list(updates), 'wake': threading.Event(), 'done': False, 'error': None}
+        with self._lock:
+            self._queue.append(entry)
+            leader = not self._flushing
+            if leader:
+                self._flushing = True
+
+        if leader:
+            time.sleep(self.max_wait)
+        else:
+            # Woken when a batch holding these updates is committed, or to lead the next one
+            entry['wake'].wait()
+        if not entry['done']:
+            self._flush()
+
+        if entry['error'] is not None:
+            raise entry['error']
+
+    def _flush(self):
+        """Apply the queued updates, then hand leadership to the oldest waiting request"""
+        with self._lock:
+            batch, self._queue = self._queue, []
+        try:
+            apply_status_updates(
+                self.model, self.key_field,
+                [update for queued in batch for update in queued['updates']]
+            )
+        except Exception as e:
+            logger.error(f"Error applying {self.model.__name__} status updates: {str(e)}")
+            for queued in batch:
+                queued['error'] = e
+        finally:
+            for queued in batch:
+                queued['done'] = True
+                queued['wake'].set()
+            with self._lock:
+                if self._queue:
+                    self._queue[0]['wake'].set()
+                else:
+                    self._flushing = False
+
+
+fax_status_batcher = StatusUpdateBatcher(FaxRecord, 'fax_id')
+sms_status_batcher = StatusUpdateBatcher(SMSRecord, 'sid')
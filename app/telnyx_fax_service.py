@@ -0,0 +1,277 @@
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from .api_config_cache import get_api_config
+from .circuit_breaker import CircuitOpenError, circuit_open_result, get_breaker, process_with_requeue
+from .multipart_upload import MultipartFileStream
+from .phone_numbers import to_e164
+
+logger = logging.getLogger(__name__)
+
+
+def _never_reached(error):
+    """
+    True when a request error proves the request never reached Telnyx:
+    the connection timed out or was refused before anything was sent
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    seen = set()
+    pending = [error]
+    while pending:
+        cause = pending.pop()
+        if cause is None or id(cause) in seen:
+            continue
+        seen.add(id(cause))
+        if isinstance(cause, ConnectionRefusedError):
+            return True
+        # requests wraps urllib3's MaxRetryError, whose reason wraps the socket error
+        pending.extend([cause.__cause__, getattr(cause, 'reason', None)])
+        pending.extend(arg for arg in getattr(cause, 'args', ()) if isinstance(arg, BaseException))
+    return False
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process-wide keep-alive session for Telnyx
+
+    The connection pool is sized to TELNYX_MAX_IN_FLIGHT so concurrent bulk
+    sends reuse warm TLS connections instead of opening one per request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = getattr(settings, 'TELNYX_MAX_IN_FLIGHT', 16)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+class TelnyxFaxService:
+    def __init__(self, api_key=None, from_number=None, connection_id=None):
+        # Telnyx API configuration - can be passed in or retrieved from database
+        config = None if api_key else get_api_config('telnyx')
+        self.api_key = api_key or (config.api_key if config else None) or getattr(settings, 'TELNYX_API_KEY', '')
+        self.from_number = from_number or (config.from_number if config else None) or getattr(settings, 'TELNYX_FROM_NUMBER', '')
+        self.connection_id = connection_id or (config.connection_id if config else None) or getattr(settings, 'TELNYX_CONNECTION_ID', '')
+        self.base_url = getattr(settings, 'TELNYX_BASE_URL', 'https://api.telnyx.com').rstrip('/')
+        self.session = get_session()
+
+    def _get_headers(self):
+        return {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+    def _request(self, method, endpoint, url, **kwargs):
+        """
+        Make an API request on the pooled session through the endpoint's circuit breaker
+
+        Raises:
+            CircuitOpenError: If the endpoint's breaker is open
+        """
+        headers = dict(self._get_headers(), **kwargs.pop('headers', {}))
+        return get_breaker(f"telnyx:{endpoint}").call(
+            self.session.request, method, url, headers=headers, **kwargs
+        )
+
+    def upload_media(self, document, filename, media_name, ttl=None):
+        """
+        Upload a document to Telnyx media storage
+
+        The multipart body is streamed from the document, so large files are
+        never held in memory.
+
+        Args:
+            document: Bytes, a file path or a file-like object
+            filename (str): Filename sent with the upload
+            media_name (str): Name to store the media under; faxes refer to it
+            ttl (int): Seconds until Telnyx deletes the media (Telnyx default 48h)
+
+        Returns:
+            dict: Upload result with 'media_name' and 'expires_at' (ISO 8601 or None)
+        """
+        fields = {'media_name': media_name}
+        if ttl:
+            fields['ttl'] = int(ttl)
+        try:
+            with MultipartFileStream('media', document, filename, fields=fields) as body:
+                logger.info(f"Uploading {filename} to Telnyx media storage as {media_name} ({body.file_size} bytes)")
+                response = self._request(
+                    'POST', 'media', f"{self.base_url}/v2/media",
+                    headers={"Content-Type": body.content_type},
+                    data=body,
+                    timeout=60  # Longer timeout for file upload
+                )
+
+            if response.status_code in (200, 201, 202):
+                media = response.json().get('data', {})
+                return {
+                    'success': True,
+                    'media_name': media.get('media_name', media_name),
+                    'expires_at': media.get('expires_at'),
+                    'message': 'Media uploaded successfully'
+                }
+
+            error_msg = f"Telnyx API Error: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'message': 'Failed to upload media'
+            }
+
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return circuit_open_result(e, 'Telnyx is temporarily unavailable')
+        except Exception as e:
+            error_msg = f"Error uploading media: {str(e)}"
+            logger.error(error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'message': 'Error uploading media'
+            }
+
+    def send_fax(self, to_number, media_url=None, media_name=None):
+        """
+        Send a fax with Telnyx
+
+        Args:
+            to_number (str): Recipient fax number
+            media_url (str): Public URL of the document to fax
+            media_name (str): Name of media previously uploaded to Telnyx
+
+        Returns:
+            dict: Fax sending result
+        """
+        data = {
+            "connection_id": self.connection_id,
+            "to": to_e164(to_number) or to_number,
+            "from": self.from_number,
+        }
+        if media_name:
+            data["media_name"] = media_name
+        else:
+            data["media_url"] = media_url
+        webhook_url = getattr(settings, 'TELNYX_WEBHOOK_URL', '')
+        if webhook_url:
+            data["webhook_url"] = webhook_url
+
+        try:
+            response = self._request('POST', 'faxes', f"{self.base_url}/v2/faxes", json=data, timeout=30)
+
+            if response.status_code in (200, 201, 202):
+                result = response.json()
+                # Telnyx v2 wraps resources in a "data" envelope
+                fax = result.get('data', result)
+                logger.info(f"Telnyx fax queued to {to_number}. Fax ID: {fax.get('id')}")
+                return {
+                    'success': True,
+                    'fax_id': fax.get('id'),
+                    'status': fax.get('status', 'queued'),
+                    'message': 'Fax sent successfully'
+                }
+
+            error_msg = f"Telnyx API Error: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'message': 'Failed to send fax',
+                # Rate limited or unavailable: the fax was not queued
+                'retryable': response.status_code in (429, 503)
+            }
+
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return circuit_open_result(e, 'Telnyx is temporarily unavailable')
+        except requests.ConnectionError as e:
+            error_msg = f"Error sending fax: {str(e)}"
+            logger.error(error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'message': 'Error sending fax',
+                # Any other connection error may have dropped after Telnyx queued
+                # the fax, and sending it elsewhere would fax it twice
+                'retryable': _never_reached(e)
+            }
+        except Exception as e:
+            error_msg = f"Error sending fax: {str(e)}"
+            logger.error(error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'message': 'Error sending fax'
+            }
+
+    def send_bulk(self, to_numbers, media_url=None, media_name=None, max_in_flight=None, max_pause_seconds=None):
+        """
+        Send the same document to many numbers concurrently
+
+        At most max_in_flight requests are outstanding at once. While the
+        circuit breaker is open, workers wait and retry until the shared pause
+        budget (BULK_CIRCUIT_PAUSE_SECONDS) is used up; the rest are deferred.
+
+        Yields:
+            tuple: (to_number, result) in input order
+        """
+        max_in_flight = max_in_flight or getattr(settings, 'TELNYX_MAX_IN_FLIGHT', 16)
+        yield from process_with_requeue(
+            to_numbers,
+            lambda to_number: self.send_fax(to_number, media_url=media_url, media_name=media_name),
+            max_pause_seconds=max_pause_seconds,
+            workers=max_in_flight
+        )
+
+    def get_fax(self, fax_id):
+        """
+        Get a fax by ID
+
+        Returns:
+            dict: The Telnyx fax object, or None if the request failed
+        """
+        try:
+            response = self._request('GET', 'faxDetail', f"{self.base_url}/v2/faxes/{fax_id}", timeout=30)
+            if response.status_code == 200:
+                return response.json().get('data')
+            logger.warning(f"Telnyx fax {fax_id} returned {response.status_code}: {response.text}")
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+        except Exception as e:
+            logger.error(f"Error getting Telnyx fax {fax_id}: {str(e)}")
+        return None
+
+    def list_faxes(self, page_number=1, page_size=100):
+        """
+        Get one page of faxes, newest first
+
+        Returns:
+            dict: 'data' (fax objects) and 'meta' (pagination), or None if the request failed
+        """
+        try:
+            response = self._request(
+                'GET', 'faxList', f"{self.base_url}/v2/faxes",
+                params={'page[number]': page_number, 'page[size]': page_size},
+                timeout=30
+            )
+            if response.status_code == 200:
+                return response.json()
+            logger.warning(f"Telnyx fax list returned {response.status_code}: {response.text}")
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+        except Exception as e:
+            logger.error(f"Error listing Telnyx faxes: {str(e)}")
+        return None
@@ -1,3 +1,1368 @@
-from django.test import TestCase
+import io
+import os
+import csv
+import gzip
+import base64
+import hmac
+import json
+import shutil
+import socket
+import hashlib
+import tempfile
+import time
+import random
+import threading
+from datetime import timedelta
+import requests
+from unittest import mock
+from django.db import OperationalError
+from django.db.models import QuerySet, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from app import api_config_cache, carrier_cache, circuit_breaker, fax_providers, record_search, views
+from app.archive import archive_records, find_archived
+from app.management.commands import bench_queries
+from app.bulk_sms_sender import BulkSMSSender, TokenBucket
+from app.carrier_cache import CarrierCache
+from app.circuit_breaker import CircuitBreaker, CircuitOpenError, PauseBudget, call_with_requeue, process_with_requeue
+from app.fake_providers import FakeProviderServer, LatencyModel, ReplayStore, sanitize
+from app import exports
+from app.document_store import DocumentStore
+from app.fax_providers import FaxProvider, FaxRouter
+from app.pdf_conversion_service import PDFConversionService, count_pdf_pages, file_sha256
+from app.multipart_upload import MultipartFileStream
+from app.media_stage import MediaStage, signed_media_query
+from app.models import APIConfiguration, CarrierLookup, DailyStat, DocumentBlob, FaxRecord, MediaUpload, RecordCount, SMSRecord
+from app.record_counts import fax_count
+from app.record_writer import BufferedRecordWriter, records_written
+from app.status_updates import StatusUpdate, StatusUpdateBatcher, apply_status_updates
+from app.phone_numbers import digits_only, split_numbers, to_e164, to_e164_many
+from app.status_poller import FaxStatusPoller, poll_interval
+from app.telnyx_fax_service import TelnyxFaxService, _never_reached
+from app.twilio_sms_service import TwilioSMSService
 
-# Create your tests here.
+
+class FakeProvider(FaxProvider):
+    """A provider that returns canned results and records who it was asked to fax"""
+
+    def __init__(self, name, result, accepted_content_types=None, accepts_media_url=False):
+        self.name = name
+        super().__init__(max_in_flight=4)
+        self.result = result
+        self.accepts_media_url = accepts_media_url
+        if accepted_content_types is not None:
+            self.accepted_content_types = frozenset(accepted_content_types)
+        self.calls = []
+
+    @property
+    def from_number(self):
+        return '+15550000000'
+
+    def is_configured(self):
+        return True
+
+    def send_fax(self, to_number, document=None, filename=None, media_url=None, patient_name=None):
+        self.calls.append(to_number)
+        return dict(self.result)
+
+
+class FirstChoice:
+    """Stands in for the router's random.Random: always picks the first candidate"""
+
+    def choices(self, population, weights):
+        return [population[0]]
+
+
+SENT = {'success': True, 'fax_id': 'fax-1', 'message': 'Fax sent successfully'}
+REFUSED = {'success': False, 'error': 'Unavailable', 'message': 'Failed to send fax', 'retryable': True}
+REJECTED = {'success': False, 'error': 'Invalid number', 'message': 'Failed to send fax'}
+
+
+class FaxRouterTests(TestCase):
+    def setUp(self):
+        fax_providers._health.clear()
+        self.store_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_root, ignore_errors=True)
+        settings_override = override_settings(DOCUMENT_STORE_ROOT=self.store_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def router(self, *providers):
+        return FaxRouter(providers=list(providers), rng=FirstChoice())
+
+    def test_fails_over_when_provider_refuses(self):
+        first, second = FakeProvider('first', REFUSED), FakeProvider('second', SENT)
+        result = self.router(first, second).send('+18175551234', document=b'%PDF-1.4', filename='a.pdf')
+        self.assertTrue(result['success'])
+        self.assertEqual(result['provider'], 'second')
+        self.assertEqual(first.calls, ['+18175551234'])
+        self.assertEqual(second.calls, ['+18175551234'])
+
+    def test_no_failover_when_provider_may_have_accepted(self):
+        first, second = FakeProvider('first', REJECTED), FakeProvider('second', SENT)
+        result = self.router(first, second).send('+18175551234', document=b'%PDF-1.4', filename='a.pdf')
+        self.assertFalse(result['success'])
+        self.assertEqual(result['provider'], 'first')
+        self.assertEqual(second.calls, [])
+
+    def test_document_goes_only_to_providers_accepting_its_type(self):
+        pdf_only = FakeProvider('pdf_only', SENT, accepted_content_types={'application/pdf'})
+        word = FakeProvider('word', SENT, accepted_content_types={
+            'application/pdf', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        })
+        router = self.router(pdf_only, word)
+        self.assertEqual(router.send('+18175551234', document=b'PK', filename='a.docx')['provider'], 'word')
+        self.assertEqual(router.send('+18175551234', document=b'%PDF-1.4', filename='a.pdf')['provider'], 'pdf_only')
+        self.assertEqual(pdf_only.calls, ['+18175551234'])
+
+    def test_no_provider_accepts_document_type(self):
+        pdf_only = FakeProvider('pdf_only', SENT, accepted_content_types={'application/pdf'})
+        result = self.router(pdf_only).send('+18175551234', document=b'PK', filename='a.docx')
+        self.assertFalse(result['success'])
+        self.assertIn('wordprocessingml', result['error'])
+        self.assertEqual(pdf_only.calls, [])
+
+    def test_media_url_needs_a_provider_that_fetches_urls(self):
+        documents_only = FakeProvider('documents_only', SENT)
+        result = self.router(documents_only).send('+18175551234', media_url='https://example.com/a.pdf')
+        self.assertFalse(result['success'])
+        self.assertEqual(documents_only.calls, [])
+
+    def test_fails_over_when_provider_circuit_is_open(self):
+        first = FakeProvider('first', {'success': False, 'error': 'open', 'message': 'Unavailable',
+                                       'circuit_open': True, 'retry_after': 1})
+        second = FakeProvider('second', SENT)
+        result = self.router(first, second).send('+18175551234', document=b'%PDF-1.4', filename='a.pdf')
+        self.assertEqual(result['provider'], 'second')
+
+    def test_provider_error_is_not_failed_over(self):
+        first, second = FakeProvider('first', SENT), FakeProvider('second', SENT)
+        first.send_fax = mock.Mock(side_effect=RuntimeError('read timed out'))
+        result = self.router(first, second).send('+18175551234', document=b'%PDF-1.4', filename='a.pdf')
+        self.assertFalse(result['success'])
+        self.assertEqual(result['provider'], 'first')
+        self.assertEqual(second.calls, [])
+
+    def test_send_many_fails_over_each_fax_in_order(self):
+        first, second = FakeProvider('first', REFUSED), FakeProvider('second', SENT)
+        numbers = ['+18175551234', '+18175551235', '+18175551236']
+        jobs = [{'to_number': number, 'document': b'%PDF-1.4', 'filename': 'a.pdf'} for number in numbers]
+        results = list(self.router(first, second).send_many(jobs))
+        self.assertEqual([job['to_number'] for job, _ in results], numbers)
+        self.assertTrue(all(result['success'] and result['provider'] == 'second' for _, result in results))
+        self.assertEqual(sorted(second.calls), numbers)
+
+
+@override_settings(WEBHOOK_VERIFY_SIGNATURES=True, HUMBLEFAX_WEBHOOK_ENABLED=True, HUMBLEFAX_WEBHOOK_SECRET='webhook-secret',
+                   HUMBLEFAX_WEBHOOK_SIGNATURE_HEADER='X-Test-Signature', HUMBLEFAX_WEBHOOK_SIGNATURE_SCHEME='hmac-sha256-hex',
+                   TELNYX_PUBLIC_KEY='', TWILIO_AUTH_TOKEN='')
+class WebhookSignatureTests(TestCase):
+    def setUp(self):
+        FaxRecord.objects.create(fax_id='12345', to_number='+18175551234', status='sent')
+        self.body = json.dumps({'sentFaxId': '12345', 'status': 'success'}).encode('utf-8')
+
+    def post_humblefax(self, signature):
+        return self.client.post(reverse('humblefax_webhook'), self.body, content_type='application/json',
+                                HTTP_X_TEST_SIGNATURE=signature)
+
+    def test_humblefax_rejects_bad_signature(self):
+        response = self.post_humblefax('0' * 64)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(FaxRecord.objects.get(fax_id='12345').status, 'sent')
+
+    def test_humblefax_accepts_valid_signature(self):
+        signature = hmac.new(b'webhook-secret', self.body, hashlib.sha256).hexdigest()
+        response = self.post_humblefax(signature)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(FaxRecord.objects.get(fax_id='12345').status, 'delivered')
+
+    @override_settings(HUMBLEFAX_WEBHOOK_SIGNATURE_SCHEME='hmac-sha1-base64')
+    def test_humblefax_signature_scheme_is_configurable(self):
+        signature = base64.b64encode(hmac.new(b'webhook-secret', self.body, hashlib.sha1).digest()).decode('ascii')
+        self.assertEqual(self.post_humblefax(signature).status_code, 200)
+        hex_signature = hmac.new(b'webhook-secret', self.body, hashlib.sha256).hexdigest()
+        self.assertEqual(self.post_humblefax(hex_signature).status_code, 403)
+
+    @override_settings(HUMBLEFAX_WEBHOOK_SIGNATURE_HEADER='')
+    def test_humblefax_rejected_until_signing_is_configured(self):
+        signature = hmac.new(b'webhook-secret', self.body, hashlib.sha256).hexdigest()
+        self.assertEqual(self.post_humblefax(signature).status_code, 403)
+
+    @override_settings(HUMBLEFAX_WEBHOOK_ENABLED=False)
+    def test_humblefax_webhook_off_by_default(self):
+        signature = hmac.new(b'webhook-secret', self.body, hashlib.sha256).hexdigest()
+        self.assertEqual(self.post_humblefax(signature).status_code, 404)
+        self.assertEqual(FaxRecord.objects.get(fax_id='12345').status, 'sent')
+
+    def test_telnyx_rejects_unsigned_request(self):
+        response = self.client.post(reverse('telnyx_webhook'), b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_twilio_rejects_unsigned_request(self):
+        response = self.client.post(reverse('twilio_sms_status_webhook'),
+                                    {'MessageSid': 'SM1', 'MessageStatus': 'delivered'})
+        self.assertEqual(response.status_code, 403)
+
+
+class KeysetPageTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Two pairs share a created_at, so ties are broken by id
+        for index, minutes in enumerate([0, 1, 1, 2, 3, 3, 4]):
+            FaxRecord.objects.create(fax_id=f'fax-{index}', to_number='+18175551234',
+                                     created_at=now - timedelta(minutes=minutes))
+        self.newest_first = list(FaxRecord.objects.order_by('-created_at', '-id').values_list('fax_id', flat=True))
+        self.factory = RequestFactory()
+
+    def page(self, **params):
+        request = self.factory.get('/faxes/', params)
+        rows, newer, older = views._keyset_page(FaxRecord.objects.all(), ('fax_id',), request, 3)
+        return [row[0] for row in rows], newer, older
+
+    def test_after_cursors_walk_every_row_once(self):
+        seen, cursor = [], None
+        while True:
+            ids, newer, older = self.page(**({'after': cursor} if cursor else {}))
+            if cursor is None:
+                self.assertIsNone(newer)
+            seen.extend(ids)
+            if older is None:
+                break
+            cursor = older
+        self.assertEqual(seen, self.newest_first)
+
+    def test_before_cursor_returns_previous_page(self):
+        first, _, older = self.page()
+        second, newer, _ = self.page(after=older)
+        self.assertEqual(second, self.newest_first[3:6])
+        self.assertEqual(self.page(before=newer)[0], first)
+
+    def test_malformed_cursor_starts_from_newest(self):
+        self.assertEqual(self.page(after='not-a-cursor')[0], self.newest_first[:3])
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_archived_rows_read_back(self):
+        old = timezone.now() - timedelta(days=400)
+        FaxRecord.objects.create(fax_id='old-fax', to_number='+18175551234', status='delivered',
+                                 patient_name='John Smith', created_at=old)
+        FaxRecord.objects.create(fax_id='new-fax', to_number='+18175551234')
+
+        with override_settings(ARCHIVE_ROOT=self.root):
+            stats = archive_records('fax', timezone.now() - timedelta(days=365), batch_size=10)
+            row, entry = find_archived('fax', 'old-fax')
+
+        self.assertEqual(stats['archived'], 1)
+        self.assertEqual(list(FaxRecord.objects.values_list('fax_id', flat=True)), ['new-fax'])
+        self.assertIsNotNone(entry)
+        self.assertEqual(row['patient_name'], 'John Smith')
+        self.assertEqual(row['status'], 'delivered')
+        # Archived as JSON, which keeps milliseconds
+        self.assertAlmostEqual(row['created_at'], old, delta=timedelta(milliseconds=1))
+
+    def test_unknown_key_is_not_archived(self):
+        with override_settings(ARCHIVE_ROOT=self.root):
+            self.assertEqual(find_archived('fax', 'missing'), (None, None))
+
+
+class DailyStatTests(TestCase):
+    def count(self, status):
+        return DailyStat.objects.filter(kind='fax', status=status).aggregate(total=Sum('count'))['total'] or 0
+
+    def test_saved_and_bulk_written_records_are_counted(self):
+        FaxRecord.objects.create(fax_id='fax-1', to_number='+18175551234', status='sent')
+        with BufferedRecordWriter(FaxRecord) as writer:
+            writer.add(FaxRecord(fax_id='fax-2', to_number='+18175551234', status='sent'))
+            writer.add(FaxRecord(fax_id='fax-3', to_number='+18175551234', status='failed'))
+        self.assertEqual(self.count('sent'), 2)
+        self.assertEqual(self.count('failed'), 1)
+
+    def test_status_change_moves_the_count(self):
+        FaxRecord.objects.create(fax_id='fax-1', to_number='+18175551234', status='sent')
+        FaxRecord.objects.create(fax_id='fax-2', to_number='+18175551234', status='sent')
+        apply_status_updates(FaxRecord, 'fax_id', [StatusUpdate('fax-1', 'delivered', timezone.now())])
+        self.assertEqual(self.count('sent'), 1)
+        self.assertEqual(self.count('delivered'), 1)
+
+    def test_ignored_status_update_changes_nothing(self):
+        FaxRecord.objects.create(fax_id='fax-1', to_number='+18175551234', status='delivered')
+        apply_status_updates(FaxRecord, 'fax_id', [StatusUpdate('fax-1', 'sent', timezone.now())])
+        self.assertEqual(self.count('delivered'), 1)
+        self.assertEqual(self.count('sent'), 0)
+
+
+class APIConfigCacheTests(TestCase):
+    def setUp(self):
+        api_config_cache.invalidate()
+        self.addCleanup(api_config_cache.invalidate)
+        self.config = APIConfiguration.objects.create(service='twilio', from_number='+18175550001')
+
+    def test_repeated_lookups_make_no_queries(self):
+        with override_settings(API_CONFIG_RECHECK_SECONDS=60):
+            api_config_cache.get_api_config('twilio')
+            with self.assertNumQueries(0):
+                for _ in range(10):
+                    self.assertEqual(api_config_cache.get_api_config('twilio').from_number, '+18175550001')
+
+    def test_save_in_this_process_takes_effect_at_once(self):
+        with override_settings(API_CONFIG_RECHECK_SECONDS=60):
+            api_config_cache.get_api_config('twilio')
+            self.config.from_number = '+18175550002'
+            self.config.save()
+            self.assertEqual(api_config_cache.get_api_config('twilio').from_number, '+18175550002')
+            self.config.delete()
+            self.assertIsNone(api_config_cache.get_api_config('twilio'))
+
+    def test_change_by_another_process_is_seen_after_recheck(self):
+        with override_settings(API_CONFIG_RECHECK_SECONDS=60):
+            api_config_cache.get_api_config('twilio')
+            # QuerySet.update sends no signal, like a write from another process
+            APIConfiguration.objects.filter(pk=self.config.pk).update(
+                from_number='+18175550003', updated_at=timezone.now() + timedelta(seconds=1)
+            )
+            self.assertEqual(api_config_cache.get_api_config('twilio').from_number, '+18175550001')
+        with override_settings(API_CONFIG_RECHECK_SECONDS=0):
+            self.assertEqual(api_config_cache.get_api_config('twilio').from_number, '+18175550003')
+
+    def test_inactive_configuration_is_left_out(self):
+        APIConfiguration.objects.create(service='telnyx', api_key='key', is_active=False)
+        self.assertIsNone(api_config_cache.get_api_config('telnyx'))
+
+
+class MultipartFileStreamTests(TestCase):
+    def expected_body(self, boundary, document):
+        return (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="ttl"\r\n\r\n3600\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="media"; filename="order.pdf"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'
+        ).encode('utf-8') + document + f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+    def test_body_bytes_and_length(self):
+        document = b'%PDF-1.4 ' + bytes(range(256)) * 300
+        with MultipartFileStream('media', document, 'order.pdf', fields={'ttl': 3600}) as body:
+            expected = self.expected_body(body.boundary, document)
+            self.assertEqual(body.content_type, f'multipart/form-data; boundary={body.boundary}')
+            self.assertEqual(len(body), len(expected))
+            self.assertEqual(body.file_size, len(document))
+            # Read in blocks smaller than the head, as requests does
+            self.assertEqual(b''.join(iter(lambda: body.read(7), b'')), expected)
+
+    def test_file_object_is_sent_from_its_position_and_left_there(self):
+        document = io.BytesIO(b'skipped%PDF-1.4 body')
+        document.seek(7)
+        for _ in range(2):
+            with MultipartFileStream('media', document, 'order.pdf', fields={'ttl': 3600}) as body:
+                self.assertEqual(body.read(), self.expected_body(body.boundary, b'%PDF-1.4 body'))
+            self.assertEqual(document.tell(), 7)
+
+    def test_rewind_sends_the_same_body_again(self):
+        with MultipartFileStream('media', io.BytesIO(b'%PDF-1.4 body'), 'order.pdf') as body:
+            first = body.read()
+            body.rewind()
+            self.assertEqual(body.read(), first)
+
+    def test_non_seekable_document_is_rejected(self):
+        class Pipe(io.RawIOBase):
+            def readable(self):
+                return True
+
+        with self.assertRaises(TypeError):
+            MultipartFileStream('media', Pipe(), 'order.pdf')
+
+
+TWO_PAGE_PDF = b'%PDF-1.4\n1 0 obj << /Type /Pages /Count 2 >>\n2 0 obj << /Type /Page >>\n3 0 obj << /Type /Page >>\n'
+
+
+class PDFConversionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def service(self, **kwargs):
+        return PDFConversionService(workers=1, cache_dir=self.cache_dir, soffice_path='/nonexistent/soffice', **kwargs)
+
+    def cached(self, name, size, age):
+        path = os.path.join(self.cache_dir, f"{name}.pdf")
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        used = time.time() - age
+        os.utime(path, (used, used))
+        return path
+
+    def test_counts_page_objects_not_the_page_tree(self):
+        path = os.path.join(self.cache_dir, 'order.pdf')
+        with open(path, 'wb') as f:
+            f.write(TWO_PAGE_PDF)
+        self.assertEqual(count_pdf_pages(path), 2)
+
+    def test_evicts_files_older_than_max_age(self):
+        old = self.cached('old', 10, age=7200)
+        fresh = self.cached('fresh', 10, age=60)
+        self.assertEqual(self.service(cache_max_age=3600).evict_cache(), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_evicts_least_recently_used_beyond_max_bytes(self):
+        paths = [self.cached(name, 100, age) for name, age in (('a', 30), ('b', 20), ('c', 10))]
+        self.assertEqual(self.service(cache_max_bytes=250).evict_cache(), 1)
+        self.assertEqual([os.path.exists(path) for path in paths], [False, True, True])
+
+    def test_cache_hit_needs_no_soffice_and_marks_the_file_used(self):
+        docx_path = os.path.join(self.cache_dir, 'order.docx')
+        with open(docx_path, 'wb') as f:
+            f.write(b'PK rendered order')
+        cached = self.cached(file_sha256(docx_path), 0, age=600)
+        with open(cached, 'wb') as f:
+            f.write(TWO_PAGE_PDF)
+        os.utime(cached, (time.time() - 600, time.time() - 600))
+
+        result = self.service().convert(docx_path)
+        self.assertTrue(result['cached'])
+        self.assertEqual((result['pdf_path'], result['num_pages']), (cached, 2))
+        self.assertGreater(os.path.getmtime(cached), time.time() - 60)
+
+    @override_settings(FAX_CONVERT_TO_PDF=True)
+    def test_falls_back_to_docx_without_soffice(self):
+        docx_path = os.path.join(self.cache_dir, 'order.docx')
+        with open(docx_path, 'wb') as f:
+            f.write(b'PK rendered order')
+        self.assertEqual(self.service().prepare_for_fax(docx_path, 'order.docx'), (docx_path, 'order.docx', 1))
+
+
+class FakeProvidersTests(SimpleTestCase):
+    def start_server(self, **options):
+        circuit_breaker._breakers.clear()
+        self.addCleanup(circuit_breaker._breakers.clear)
+        server = FakeProviderServer(('127.0.0.1', 0), seed=1, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        settings_override = override_settings(TELNYX_BASE_URL=base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return server, base_url
+
+    def telnyx(self):
+        return TelnyxFaxService(api_key='key', from_number='+18175550000', connection_id='connection')
+
+    def test_telnyx_fax_is_queued(self):
+        server, _ = self.start_server()
+        result = self.telnyx().send_fax('+18175551234', media_url='https://example.com/order.pdf')
+        self.assertTrue(result['success'])
+        self.assertIn(result['fax_id'], server.state.telnyx_faxes)
+        self.assertEqual(server.state.counters, {'create_telnyx_fax': 1})
+
+    def test_injected_errors_are_retryable_failures(self):
+        self.start_server(error_rate=1.0)
+        result = self.telnyx().send_fax('+18175551234', media_url='https://example.com/order.pdf')
+        self.assertFalse(result['success'])
+        self.assertTrue(result['retryable'])
+
+    def test_rate_limited_responses_carry_retry_after(self):
+        _, base_url = self.start_server(rate_limit_rate=1.0, retry_after=7)
+        response = requests.get(f"{base_url}/v2/faxes", timeout=5)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '7')
+
+    def test_unknown_route_is_404(self):
+        _, base_url = self.start_server()
+        self.assertEqual(requests.get(f"{base_url}/nowhere", timeout=5).status_code, 404)
+
+    def test_latency_specs(self):
+        self.assertEqual(LatencyModel.parse('fixed:50').sample(random.Random(1)), 0.05)
+        delay = LatencyModel.parse('uniform:20:200').sample(random.Random(1))
+        self.assertTrue(0.02 <= delay <= 0.2)
+        with self.assertRaises(ValueError):
+            LatencyModel.parse('uniform:20')
+
+    def test_recorded_responses_are_sanitized(self):
+        body = sanitize({'data': {'name': 'John Smith', 'to': '+1 (817) 555-1234', 'status': 'queued'}})
+        self.assertEqual(body, {'data': {'name': 'REDACTED', 'to': '+15550000000', 'status': 'queued'}})
+
+    def test_replay_cycles_with_fresh_ids(self):
+        path = os.path.join(tempfile.mkdtemp(), 'recorded.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for fax_id in ('a', 'b'):
+                f.write(json.dumps({'route': 'get_telnyx_fax', 'status': 200, 'body': {'data': {'id': fax_id}}}) + '\n')
+        store = ReplayStore(path)
+        ids = [store.get('get_telnyx_fax')[1]['data']['id'] for _ in range(3)]
+        self.assertEqual(ids, ['a-r1', 'b-r2', 'a-r3'])
+        self.assertIsNone(store.get('create_telnyx_fax'))
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+OPEN = {'success': False, 'error': 'open', 'message': 'Provider temporarily unavailable',
+        'circuit_open': True, 'retry_after': 0.01}
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def breaker(self):
+        return CircuitBreaker('test:endpoint', min_calls=2, window_size=4, failure_rate_threshold=0.5,
+                              open_seconds=0.05, half_open_probes=1)
+
+    def test_opens_on_failures_and_fails_fast(self):
+        breaker = self.breaker()
+        breaker.call(lambda: Response(200))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.call(lambda: Response(503))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        calls = []
+        with self.assertRaises(CircuitOpenError) as raised:
+            breaker.call(lambda: calls.append(1))
+        self.assertEqual(calls, [])
+        self.assertLessEqual(raised.exception.retry_after, 0.05)
+
+    def test_exceptions_count_as_failures(self):
+        breaker = self.breaker()
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                breaker.call(self.raise_connection_error)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def raise_connection_error(self):
+        raise requests.ConnectionError('refused')
+
+    def test_successful_probe_closes(self):
+        breaker = self.breaker()
+        breaker.call(lambda: Response(503))
+        breaker.call(lambda: Response(429))
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.call(lambda: Response(200))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_opens_again(self):
+        breaker = self.breaker()
+        breaker.call(lambda: Response(503))
+        breaker.call(lambda: Response(503))
+        time.sleep(0.06)
+        breaker.call(lambda: Response(500))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_client_errors_do_not_trip(self):
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.call(lambda: Response(422))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class RequeueTests(SimpleTestCase):
+    def test_retries_after_the_circuit_closes(self):
+        results = [OPEN, {'success': True}]
+        budget = PauseBudget(5)
+        self.assertEqual(call_with_requeue(lambda: results.pop(0), budget), {'success': True})
+        self.assertEqual(budget.paused, 0.5)
+
+    def test_deferred_once_the_budget_is_used_up(self):
+        calls = []
+
+        def send():
+            calls.append(1)
+            return OPEN
+
+        result = call_with_requeue(send, PauseBudget(0))
+        self.assertTrue(result['deferred'])
+        self.assertFalse(result['success'])
+        self.assertEqual(len(calls), 1)
+
+    def test_results_keep_input_order_with_workers(self):
+        def handler(item):
+            time.sleep(0.01 * (5 - item))
+            return {'success': True, 'item': item}
+
+        results = list(process_with_requeue(range(5), handler, max_pause_seconds=0, workers=3))
+        self.assertEqual([(item, result['item']) for item, result in results], [(i, i) for i in range(5)])
+
+    def test_items_share_one_budget(self):
+        results = list(process_with_requeue(['a', 'b'], lambda item: OPEN, max_pause_seconds=0.5))
+        self.assertEqual([result.get('deferred') for _, result in results], [True, True])
+
+
+class StatusUpdateBatcherTests(SimpleTestCase):
+    def test_leader_applies_one_batch_and_hands_over(self):
+        batcher = StatusUpdateBatcher(FaxRecord, 'fax_id', max_wait=0)
+        applied = []
+        late = StatusUpdate('fax-2', 'delivered', timezone.now())
+        second = threading.Thread(target=batcher.submit, args=([late],))
+
+        def apply(model, key_field, updates):
+            applied.append((threading.current_thread() is second, [update.key for update in updates]))
+            if len(applied) == 1:
+                # Another webhook arrives while the first batch is being committed
+                second.start()
+                while not batcher._queue:
+                    time.sleep(0.001)
+            return []
+
+        with mock.patch('app.status_updates.apply_status_updates', side_effect=apply):
+            batcher.submit([StatusUpdate('fax-1', 'sent', timezone.now())])
+            # The first request has its answer while the second commits its own batch
+            second.join(timeout=5)
+
+        self.assertEqual(applied, [(False, ['fax-1']), (True, ['fax-2'])])
+        self.assertFalse(batcher._flushing)
+
+    def test_errors_reach_every_request_in_the_batch(self):
+        batcher = StatusUpdateBatcher(FaxRecord, 'fax_id', max_wait=0)
+        with mock.patch('app.status_updates.apply_status_updates', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                batcher.submit([StatusUpdate('fax-1', 'sent', timezone.now())])
+        self.assertFalse(batcher._flushing)
+
+
+class FakeTelnyxStatuses:
+    """Stands in for TelnyxFaxService in the poller: one list page, then per-fax details"""
+
+    api_key = 'key'
+
+    def __init__(self, listed, details):
+        self.listed = listed
+        self.details = details
+        self.detail_calls = []
+
+    def list_faxes(self, page_number=1, page_size=100):
+        return {'data': self.listed if page_number == 1 else [], 'meta': {'total_pages': 1}}
+
+    def get_fax(self, fax_id):
+        self.detail_calls.append(fax_id)
+        return self.details.get(fax_id)
+
+
+class FaxStatusPollerTests(TestCase):
+    def fax(self, fax_id, status='sent', age=timedelta(minutes=5), **fields):
+        return FaxRecord.objects.create(fax_id=fax_id, to_number='+18175551234', status=status, provider='telnyx',
+                                        created_at=timezone.now() - age, **fields)
+
+    def test_interval_grows_with_age_within_bounds(self):
+        self.assertEqual(poll_interval(10, 15, 900, 0.1), 15)
+        self.assertEqual(poll_interval(3000, 15, 900, 0.1), 300)
+        self.assertEqual(poll_interval(86400, 15, 900, 0.1), 900)
+
+    def test_only_recent_in_flight_outbound_faxes_are_due(self):
+        self.fax('sent')
+        self.fax('pending', status='pending')
+        self.fax('delivered', status='delivered')
+        self.fax('inbound', direction='inbound')
+        self.fax('too-old', age=timedelta(hours=72))
+        poller = FaxStatusPoller(max_age_hours=48)
+        self.assertEqual(sorted(fax_id for fax_id, _, _ in poller.due_faxes()), ['pending', 'sent'])
+
+    def test_recently_polled_faxes_wait_for_their_interval(self):
+        self.fax('sent')
+        poller = FaxStatusPoller(min_interval=60)
+        poller._last_polled['sent'] = time.monotonic()
+        self.assertEqual(poller.due_faxes(), [])
+        poller._last_polled['sent'] = time.monotonic() - 61
+        self.assertEqual(len(poller.due_faxes()), 1)
+
+    def test_poll_reads_the_list_then_details_and_applies_statuses(self):
+        self.fax('listed')
+        self.fax('detailed')
+        service = FakeTelnyxStatuses(
+            listed=[{'id': 'listed', 'status': 'delivered'}, {'id': 'other', 'status': 'failed'}],
+            details={'detailed': {'id': 'detailed', 'status': 'failed'}},
+        )
+        with mock.patch('app.status_poller.TelnyxFaxService', return_value=service):
+            stats = FaxStatusPoller().poll_once()
+
+        self.assertEqual(stats, {'due': 2, 'received': 2, 'updated': 2})
+        self.assertEqual(service.detail_calls, ['detailed'])
+        self.assertEqual(dict(FaxRecord.objects.values_list('fax_id', 'status')),
+                         {'listed': 'delivered', 'detailed': 'failed'})
+
+
+class CarrierCacheTests(TestCase):
+    def test_stored_lookups_are_shared_through_the_table(self):
+        CarrierCache().set('+18175551234', 'mobile', 'Fake Carrier')
+        info = CarrierCache().get('+18175551234')
+        self.assertEqual((info.carrier_type, info.carrier_name, info.is_mobile), ('mobile', 'Fake Carrier', True))
+        self.assertFalse(CarrierCache().set('+18175550000', 'landline').is_mobile)
+
+    def test_repeat_numbers_are_answered_from_memory(self):
+        cache = CarrierCache()
+        cache.set('+18175551234', 'voip')
+        with self.assertNumQueries(0):
+            self.assertTrue(cache.get('+18175551234').is_mobile)
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+
+    def test_entries_older_than_the_ttl_are_misses(self):
+        cache = CarrierCache(ttl=3600)
+        cache.set('+18175551234', 'mobile')
+        CarrierLookup.objects.update(looked_up_at=timezone.now() - timedelta(hours=2))
+        self.assertIsNotNone(cache.get('+18175551234'))  # Still in memory, and fresh there
+        self.assertIsNone(CarrierCache(ttl=3600).get('+18175551234'))
+
+    def test_least_recently_used_numbers_leave_memory_first(self):
+        cache = CarrierCache(maxsize=2)
+        cache.set_many([('+18175550001', 'mobile', None), ('+18175550002', 'mobile', None)])
+        cache.get('+18175550001')
+        cache.set('+18175550003', 'mobile')
+        self.assertEqual(list(cache._lru), ['+18175550001', '+18175550003'])
+        # Evicted from memory but still in the table
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(cache.get('+18175550002'))
+
+    def test_get_many_makes_one_query(self):
+        cache = CarrierCache()
+        CarrierCache().set_many([('+18175550001', 'mobile', None), ('+18175550002', 'landline', None)])
+        with self.assertNumQueries(1):
+            found = cache.get_many(['+18175550001', '+18175550002', '+18175550003', '+18175550001'])
+        self.assertEqual(sorted(found), ['+18175550001', '+18175550002'])
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class FakeLookups(TwilioSMSService):
+    """Twilio service whose Lookup API answers from a dict; None is a failed lookup"""
+
+    def __init__(self, carriers):
+        super().__init__(account_sid='AC123', auth_token='token', from_number='+18175550000')
+        self.carriers = carriers
+        self.looked_up = []
+
+    def lookup_carrier(self, e164_number):
+        self.looked_up.append(e164_number)
+        carrier_type = self.carriers.get(e164_number)
+        return (carrier_type, 'Fake Carrier') if carrier_type else None
+
+
+class ResolveCarriersTests(TestCase):
+    def setUp(self):
+        carrier_cache._cache = None
+        self.addCleanup(setattr, carrier_cache, '_cache', None)
+
+    def test_sorts_numbers_and_looks_up_only_misses(self):
+        carrier_cache.get_carrier_cache().set('+18175550001', 'mobile')
+        service = FakeLookups({'+18175550002': 'landline', '+18175550003': 'voip'})
+        result = service.resolve_carriers(
+            ['817-555-0001', '(817) 555-0002', '8175550003', '+1 817 555 0001', 'not a number', '8175550004'],
+            max_workers=2,
+        )
+        self.assertEqual(result['sendable'], [
+            ('817-555-0001', '+18175550001'), ('8175550003', '+18175550003'), ('8175550004', '+18175550004'),
+        ])
+        self.assertEqual(result['landline'], ['(817) 555-0002'])
+        self.assertEqual(result['invalid'], ['not a number'])
+        self.assertEqual(result['duplicate'], ['+1 817 555 0001'])
+        self.assertEqual(sorted(service.looked_up), ['+18175550002', '+18175550003', '+18175550004'])
+        self.assertEqual(result['lookups'], 3)
+
+    def test_results_are_cached_but_failed_lookups_are_not(self):
+        FakeLookups({'+18175550002': 'landline'}).resolve_carriers(['8175550002', '8175550004'])
+        service = FakeLookups({})
+        result = service.resolve_carriers(['8175550002', '8175550004'])
+        self.assertEqual(service.looked_up, ['+18175550004'])
+        self.assertEqual(result['landline'], ['8175550002'])
+
+
+class FakeSMS:
+    """Stands in for TwilioSMSService: numbers ending in 9 fail"""
+
+    def __init__(self, from_number):
+        self.from_number = from_number
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_sms(self, to_number, message, skip_lookup=False):
+        time.sleep(0.01)
+        with self._lock:
+            self.sent.append(to_number)
+        if to_number.endswith('9'):
+            return {'success': False, 'error': 'Invalid number', 'message': 'Failed to send SMS'}
+        return {'success': True, 'sms_id': f"SM{to_number[1:]}"}
+
+
+@override_settings(TWILIO_SENDER_RATES={'+18175550100': 0, '+18175550101': 0})
+class BulkSMSSenderTests(TestCase):
+    def recipients(self, count):
+        return [(f"Patient {index}", f"+1817555{index:04d}") for index in range(count)]
+
+    def test_results_in_input_order_and_sent_messages_recorded(self):
+        sender = BulkSMSSender(FakeSMS('+18175550100'), workers=4)
+        recipients = self.recipients(10)
+        results = list(sender.send(recipients, 'Your order shipped'))
+        self.assertEqual([recipient for recipient, _ in results], recipients)
+        self.assertEqual(sorted(SMSRecord.objects.values_list('to_number', flat=True)),
+                         sorted(label for label, number in recipients if not number.endswith('9')))
+        self.assertEqual((sender.stats()['sent'], sender.stats()['failed']), (9, 1))
+
+    def test_stopping_early_still_records_messages_that_went_out(self):
+        service = FakeSMS('+18175550101')
+        sender = BulkSMSSender(service, workers=4)
+        for _ in sender.send(self.recipients(8), 'Your order shipped'):
+            break
+        self.assertEqual(SMSRecord.objects.count(), len([number for number in service.sent if not number.endswith('9')]))
+
+    def test_token_bucket_paces_sends(self):
+        bucket = TokenBucket(rate=50)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        # The first token is free, the other five wait 20ms each
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class PhoneNumberTests(SimpleTestCase):
+    def test_formats_normalize_to_e164(self):
+        for value in ('(817) 555-1234', '817.555.1234', '+1 817 555 1234', '18175551234', 8175551234.0, ' 817-555-1234 '):
+            self.assertEqual(to_e164(value), '+18175551234', value)
+
+    def test_lengths_outside_e164_are_invalid(self):
+        self.assertIsNone(to_e164('555-1234'))
+        self.assertIsNone(to_e164('123456789'))
+        self.assertEqual(to_e164('447911123456789'), '+447911123456789')  # 15 digits
+        self.assertIsNone(to_e164('4479111234567890'))  # 16 digits
+
+    def test_empty_values_are_invalid(self):
+        for value in (None, '', float('nan'), 'call me'):
+            self.assertIsNone(to_e164(value), value)
+
+    def test_non_ascii_digits_are_dropped(self):
+        self.assertEqual(to_e164('\uff18817 555 1234'), '+18175551234')
+        self.assertEqual(digits_only('+1 (817) 555-1234\u2009'), '18175551234')
+
+    def test_lists_and_separators(self):
+        self.assertEqual(split_numbers('817-555-1234, 8175550000;\n\n+1 214 555 0000'),
+                         ['817-555-1234', '8175550000', '+1 214 555 0000'])
+        self.assertEqual(to_e164_many(['8175551234', 'bad']), ['+18175551234', None])
+
+    def test_series_keeps_its_index(self):
+        try:
+            import pandas as pd
+        except ImportError:
+            self.skipTest('pandas is not installed')
+        series = pd.Series(['8175551234', None, 8175551234.0, 'bad'], index=[10, 11, 12, 13])
+        result = to_e164_many(series)
+        self.assertEqual(list(result.index), [10, 11, 12, 13])
+        self.assertEqual(list(result), ['+18175551234', None, '+18175551234', None])
+
+
+class RecordWriterTests(TestCase):
+    def writer(self):
+        writer = BufferedRecordWriter(FaxRecord, batch_size=10, flush_seconds=3600)
+        self.addCleanup(writer.close)
+        return writer
+
+    def record(self, fax_id):
+        return FaxRecord(fax_id=fax_id, to_number='+18175551234', status='sent')
+
+    def test_locked_database_keeps_the_batch(self):
+        writer = self.writer()
+        writer.add(self.record('fax-1'))
+        writer.add(self.record('fax-2'))
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                writer.flush()
+        writer.add(self.record('fax-3'))
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(sorted(FaxRecord.objects.values_list('fax_id', flat=True)), ['fax-1', 'fax-2', 'fax-3'])
+        self.assertEqual(writer.failed, 0)
+
+    def test_receiver_error_rolls_back_and_keeps_the_batch(self):
+        def fail(sender, instances, **kwargs):
+            raise RuntimeError('receiver failed')
+        writer = self.writer()
+        writer.add(self.record('fax-1'))
+        records_written.connect(fail, sender=FaxRecord)
+        try:
+            with self.assertRaises(RuntimeError):
+                writer.flush()
+        finally:
+            records_written.disconnect(fail, sender=FaxRecord)
+        self.assertFalse(FaxRecord.objects.exists())
+        self.assertEqual(writer.flush(), 1)
+        self.assertTrue(FaxRecord.objects.filter(fax_id='fax-1').exists())
+
+    def test_duplicate_is_skipped_and_the_rest_saved(self):
+        FaxRecord.objects.create(fax_id='fax-1', to_number='+18175551234', status='sent')
+        writer = self.writer()
+        writer.add(self.record('fax-1'))
+        writer.add(self.record('fax-2'))
+        with self.assertLogs('app.record_writer', 'ERROR') as logs:
+            self.assertEqual(writer.flush(), 1)
+        self.assertIn('fax_id=fax-1', logs.output[0])
+        self.assertEqual(writer.failed, 1)
+
+    def test_rows_dropped_on_close_are_logged(self):
+        writer = self.writer()
+        writer.add(self.record('fax-1'))
+        writer.add(self.record('fax-2'))
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('app.record_writer', 'ERROR') as logs, self.assertRaises(OperationalError):
+                writer.close()
+        self.assertTrue(any('fax_id=fax-1' in line for line in logs.output))
+        self.assertTrue(any('fax_id=fax-2' in line for line in logs.output))
+        self.assertEqual(writer.failed, 2)
+
+
+class TelnyxRetryableTests(SimpleTestCase):
+    def setUp(self):
+        circuit_breaker._breakers.clear()
+        self.addCleanup(circuit_breaker._breakers.clear)
+
+    def send(self, base_url='https://api.telnyx.example'):
+        with override_settings(TELNYX_BASE_URL=base_url):
+            service = TelnyxFaxService(api_key='key', from_number='+18175550000', connection_id='connection')
+        return service.send_fax('+18175551234', media_url='https://example.com/order.pdf')
+
+    def test_errors_before_sending_never_reached_telnyx(self):
+        self.assertTrue(_never_reached(requests.ConnectTimeout('connect timed out')))
+        self.assertTrue(_never_reached(requests.ConnectionError(ConnectionRefusedError(111, 'Connection refused'))))
+        wrapped = requests.ConnectionError('max retries')
+        wrapped.__cause__ = OSError('new connection')
+        wrapped.__cause__.__cause__ = ConnectionRefusedError(111, 'Connection refused')
+        self.assertTrue(_never_reached(wrapped))
+
+    def test_errors_after_sending_may_have_reached_telnyx(self):
+        self.assertFalse(_never_reached(requests.ReadTimeout('read timed out')))
+        self.assertFalse(_never_reached(requests.ConnectionError(ConnectionResetError(104, 'Connection reset by peer'))))
+        self.assertFalse(_never_reached(requests.ConnectionError('Remote end closed connection without response')))
+
+    def test_refused_connection_is_retryable(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        result = self.send(f"http://127.0.0.1:{port}")
+        self.assertFalse(result['success'])
+        self.assertTrue(result['retryable'])
+
+    def test_dropped_connection_is_not_retryable(self):
+        error = requests.ConnectionError(ConnectionResetError(104, 'Connection reset by peer'))
+        with mock.patch.object(TelnyxFaxService, '_request', side_effect=error):
+            result = self.send()
+        self.assertFalse(result['success'])
+        self.assertFalse(result['retryable'])
+
+    def test_only_rate_limited_or_unavailable_responses_are_retryable(self):
+        for status_code, retryable in ((429, True), (503, True), (400, False), (500, False)):
+            response = mock.Mock(status_code=status_code, text='error')
+            with mock.patch.object(TelnyxFaxService, '_request', return_value=response):
+                self.assertEqual(self.send()['retryable'], retryable, status_code)
+
+
+class SendFormTests(TestCase):
+    def setUp(self):
+        fax_providers._health.clear()
+        store_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_root, ignore_errors=True)
+        settings_override = override_settings(DOCUMENT_STORE_ROOT=store_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_send_pages_render_the_upload_field(self):
+        for name in ('sendfax', 'bulk_fax_sender'):
+            content = self.client.get(reverse(name)).content.decode()
+            self.assertIn('enctype="multipart/form-data"', content, name)
+            self.assertIn('type="file" name="document"', content, name)
+
+    def test_uploaded_document_is_sent(self):
+        provider = FakeProvider('telnyx', dict(SENT, from_number='+15550000000'))
+        upload = io.BytesIO(b'%PDF-1.4 order')
+        upload.name = 'order.pdf'
+        with mock.patch('app.views._fax_router', return_value=FaxRouter(providers=[provider], rng=FirstChoice())):
+            response = self.client.post(reverse('sendfax'), {'fax_to': '+18175551234', 'document': upload})
+        self.assertContains(response, 'Fax sent successfully')
+        self.assertEqual(provider.calls, ['+18175551234'])
+        self.assertTrue(FaxRecord.objects.filter(fax_id='fax-1').exists())
+
+    def test_document_or_url_is_required(self):
+        response = self.client.post(reverse('bulk_fax_sender'), {'fax_numbers': '+18175551234'})
+        self.assertContains(response, 'Enter a media URL or upload a document.')
+
+
+class MediaStageTests(TestCase):
+    def stage(self, expires_in):
+        telnyx = mock.Mock()
+        telnyx.upload_media.return_value = {'success': True, 'media_name': 'fresh', 'expires_at': None}
+        content_hash = hashlib.sha256(b'%PDF-1.4').hexdigest()
+        MediaUpload.objects.create(content_hash=content_hash, backend='telnyx', media_name='staged',
+                                   expires_at=timezone.now() + expires_in)
+        with override_settings(FAX_MEDIA_REUSE_MARGIN=600):
+            result = MediaStage(backend='telnyx', telnyx=telnyx).stage(b'%PDF-1.4', 'order.pdf')
+        return result, telnyx
+
+    def test_media_outside_the_margin_is_reused(self):
+        result, telnyx = self.stage(timedelta(hours=1))
+        self.assertTrue(result['reused'])
+        self.assertEqual(result['media'].media_name, 'staged')
+        telnyx.upload_media.assert_not_called()
+
+    def test_media_inside_the_margin_is_uploaded_again(self):
+        result, telnyx = self.stage(timedelta(minutes=5))
+        self.assertFalse(result['reused'])
+        self.assertEqual(result['media'].media_name, 'fresh')
+        self.assertEqual(MediaUpload.objects.count(), 1)
+        telnyx.upload_media.assert_called_once()
+
+
+class FaxMediaTests(TestCase):
+    DOCUMENT = b'%PDF-1.4 0123456789'
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(FAX_MEDIA_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media = MediaStage(backend='local').stage(self.DOCUMENT, 'order.pdf')['media']
+        self.etag = f'"{self.media.content_hash}"'
+
+    def get(self, query=None, **headers):
+        query = query if query is not None else signed_media_query(self.media.media_name)
+        return self.client.get(f"{reverse('fax_media', args=[self.media.media_name])}?{query}", headers=headers)
+
+    def test_signed_url_serves_the_document(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.DOCUMENT)
+        self.assertEqual(response['ETag'], self.etag)
+
+    def test_expired_or_tampered_signature_is_refused(self):
+        self.assertEqual(self.get(signed_media_query(self.media.media_name, ttl=-1)).status_code, 403)
+        query = signed_media_query(self.media.media_name)
+        self.assertEqual(self.get(query[:-1] + ('0' if query[-1] != '0' else '1')).status_code, 403)
+        self.assertEqual(self.get('').status_code, 403)
+
+    def test_byte_range(self):
+        response = self.get(Range='bytes=9-12')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f"bytes 9-12/{len(self.DOCUMENT)}")
+        self.assertEqual(b''.join(response.streaming_content), self.DOCUMENT[9:13])
+        suffix = self.get(Range='bytes=-4')
+        self.assertEqual(b''.join(suffix.streaming_content), self.DOCUMENT[-4:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range=f"bytes={len(self.DOCUMENT)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f"bytes */{len(self.DOCUMENT)}")
+
+    def test_if_range_mismatch_sends_the_whole_document(self):
+        response = self.get(Range='bytes=0-3', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.DOCUMENT)
+        self.assertEqual(self.get(Range='bytes=0-3', **{'If-Range': self.etag}).status_code, 206)
+
+    def test_matching_etag_is_not_modified(self):
+        self.assertEqual(self.get(**{'If-None-Match': self.etag}).status_code, 304)
+
+
+class BenchQueriesTests(TransactionTestCase):
+    def test_benchmark_runs_on_the_current_schema(self):
+        command = bench_queries.Command(stdout=io.StringIO())
+        results = command.run_benchmark({'rows': 50, 'sms_rows': 20, 'days': 30, 'repeat': 1, 'seed': 1})
+        labels = [label for label, _ in bench_queries.view_queries(['x'], ['y'], timezone.now())]
+        self.assertEqual(list(results['before']), labels)
+        self.assertNotIn('app_fax_created_idx', results['before']['fax_list (first 100)']['plan'])
+        self.assertIn('app_fax_created_idx', results['after']['fax_list (first 100)']['plan'])
+        self.assertEqual(FaxRecord.objects.count(), 50)
+
+
+class RecordCountTests(TestCase):
+    def fax(self, fax_id, direction='outbound'):
+        return FaxRecord(fax_id=fax_id, to_number='+18175551234', status='sent', direction=direction)
+
+    def test_counts_follow_saves_batches_and_deletes_without_recounting(self):
+        self.fax('fax-1').save()
+        self.assertEqual(fax_count(), 1)
+        self.assertEqual(fax_count('inbound'), 0)
+        with BufferedRecordWriter(FaxRecord) as writer:
+            writer.add(self.fax('fax-2', 'inbound'))
+            writer.add(self.fax('fax-3'))
+        FaxRecord.objects.get(fax_id='fax-1').delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(fax_count(), 2)
+        self.assertEqual(fax_count('inbound'), 1)
+        self.assertEqual(fax_count('outbound'), 1)
+
+    def test_counts_are_shared_through_the_database(self):
+        self.assertEqual(fax_count(), 0)
+        RecordCount.objects.filter(key='faxrecord:all').update(count=7)
+        self.assertEqual(fax_count(), 7)
+
+    @override_settings(FAX_COUNT_MAX_AGE=60)
+    def test_stale_count_is_recounted(self):
+        self.assertEqual(fax_count(), 0)
+        FaxRecord.objects.bulk_create([self.fax('fax-1')])
+        self.assertEqual(fax_count(), 0)
+        RecordCount.objects.update(counted_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(fax_count(), 1)
+
+
+class RecordSearchTests(TestCase):
+    def setUp(self):
+        record_search._ready.clear()
+        self.addCleanup(record_search._ready.clear)
+        FaxRecord.objects.create(fax_id='fax-1', to_number='(817) 555-1234', patient_name='John Smith', status='sent')
+        FaxRecord.objects.create(fax_id='fax-2', to_number='+1 214 555 0000', patient_name='Jane Doe', status='sent')
+
+    def found(self, text):
+        return [row['fax_id'] for row in record_search.search_faxes(text)]
+
+    def assert_searches(self):
+        for text in ('817-555-1234', '8175551234', '+1 (817) 555', '18175551234', '(817) 5'):
+            self.assertEqual(self.found(text), ['fax-1'], text)
+        self.assertEqual(self.found('2145550000'), ['fax-2'])
+        self.assertEqual(self.found('jo smi'), ['fax-1'])
+        self.assertEqual(self.found('9995551234'), [])
+
+    def test_numbers_match_in_any_format(self):
+        self.assertTrue(record_search._fts_ready('app_faxrecord_fts'))
+        self.assert_searches()
+
+    def test_updated_number_is_reindexed(self):
+        FaxRecord.objects.filter(fax_id='fax-1').update(to_number='972.555.9999')
+        self.assertEqual(self.found('8175551234'), [])
+        self.assertEqual(self.found('972 555 9999'), ['fax-1'])
+
+    def test_fallback_without_fts_matches_the_same(self):
+        record_search._ready.update({'app_faxrecord_fts': False, 'app_smsrecord_fts': False})
+        self.assert_searches()
+
+    def test_phone_queries_are_one_digit_term(self):
+        self.assertEqual(record_search.query_terms('(817) 555-1234'), (['8175551234'], True))
+        self.assertEqual(record_search.query_terms('2024 order'), (['2024', 'order'], False))
+        self.assertEqual(record_search.fts_match(['817555'], True), 'to_number : (("817555"* OR "1817555"*))')
+
+
+@override_settings(DOCUMENT_STORE_COMPRESSION='gzip')
+class DocumentStoreTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def store(self, **options):
+        return DocumentStore(root=self.root, **options)
+
+    def read(self, store, blob):
+        reader = store.read(blob)
+        self.assertIsNotNone(reader)
+        with reader:
+            return reader.read()
+
+    def test_round_trip_in_chunks(self):
+        # Larger than one chunk and than the in-memory spool
+        document = os.urandom(2 * 1024 * 1024 + 17)
+        path = os.path.join(self.root, 'order.pdf')
+        with open(path, 'wb') as f:
+            f.write(document)
+        store = self.store()
+        blob = store.put(path)
+        self.assertEqual(blob.filename, 'order.pdf')
+        self.assertEqual(blob.size, len(document))
+        self.assertEqual(blob.stored_size, os.path.getsize(os.path.join(self.root, blob.path)))
+        self.assertEqual(self.read(store, blob), document)
+
+    def test_file_objects_are_rewound_and_stored_once(self):
+        upload = io.BytesIO(b'xx%PDF-1.4 order')
+        upload.seek(2)
+        store = self.store()
+        blob = store.put(upload, 'order.pdf')
+        self.assertEqual(upload.tell(), 2)
+        self.assertEqual(store.put(b'%PDF-1.4 order', 'again.pdf').pk, blob.pk)
+        self.assertEqual(DocumentBlob.objects.count(), 1)
+        self.assertEqual(self.read(store, blob), b'%PDF-1.4 order')
+
+    def test_damaged_document_is_not_read(self):
+        store = self.store()
+        blob = store.put(b'%PDF-1.4 order', 'order.pdf')
+        with open(os.path.join(self.root, blob.path), 'wb') as f:
+            f.write(b'not gzip')
+        self.assertIsNone(store.read(blob))
+
+    def test_least_recently_used_are_evicted_over_max_bytes(self):
+        store = self.store(max_bytes=10 ** 6)
+        first = store.put(os.urandom(1000), 'first.pdf')
+        second = store.put(os.urandom(1000), 'second.pdf')
+        fax = FaxRecord.objects.create(fax_id='fax-1', to_number='+18175551234', status='sent', document=first)
+        store.read(second).close()
+        DocumentBlob.objects.filter(pk=first.pk).update(last_used_at=timezone.now() - timedelta(minutes=1))
+        store.max_bytes = second.stored_size + 10
+        self.assertEqual(store.evict(), 1)
+        self.assertEqual(list(DocumentBlob.objects.values_list('pk', flat=True)), [second.pk])
+        self.assertFalse(os.path.exists(os.path.join(self.root, first.path)))
+        fax.refresh_from_db()
+        self.assertIsNone(fax.document_id)
+
+    def test_unused_documents_expire(self):
+        store = self.store(max_age=3600)
+        old = store.put(b'%PDF-1.4 old', 'old.pdf')
+        DocumentBlob.objects.filter(pk=old.pk).update(last_used_at=timezone.now() - timedelta(hours=2))
+        recent = store.put(b'%PDF-1.4 recent', 'recent.pdf')
+        self.assertEqual(list(DocumentBlob.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertFalse(os.path.exists(os.path.join(self.root, old.path)))
+
+    def test_evict_documents_command(self):
+        old = self.store().put(b'%PDF-1.4 old', 'old.pdf')
+        DocumentBlob.objects.filter(pk=old.pk).update(last_used_at=timezone.now() - timedelta(days=2))
+        with override_settings(DOCUMENT_STORE_ROOT=self.root):
+            call_command('evict_documents', max_age=86400, stdout=io.StringIO())
+        self.assertFalse(DocumentBlob.objects.exists())
+
+    def test_resend_sends_the_stored_document(self):
+        received = []
+
+        class Recording(FakeProvider):
+            def send_fax(self, to_number, document=None, filename=None, media_url=None, patient_name=None):
+                received.append((document if isinstance(document, bytes) else document.read(), filename))
+                return super().send_fax(to_number, document, filename, media_url, patient_name)
+
+        fax_providers._health.clear()
+        router = FaxRouter(providers=[Recording('humblefax', SENT)], store=self.store(), rng=FirstChoice())
+        sent = router.send('+18175551234', document=b'%PDF-1.4 order', filename='order.pdf')
+        self.assertTrue(sent['success'])
+        fax = FaxRecord.objects.create(fax_id='fax-1', to_number='+18175551234', status='failed',
+                                       document_id=sent['document_id'])
+        received.clear()
+        self.assertTrue(router.resend(fax)['success'])
+        self.assertEqual(received, [(b'%PDF-1.4 order', 'order.pdf')])
+
+    def test_resend_failed_faxes_shares_one_extracted_file(self):
+        received = []
+
+        class Recording(FakeProvider):
+            def send_fax(self, to_number, document=None, filename=None, media_url=None, patient_name=None):
+                with open(document, 'rb') as f:
+                    received.append((to_number, os.path.splitext(document)[1], f.read()))
+                return dict(super().send_fax(to_number, document, filename, media_url, patient_name),
+                            fax_id=f"fax-{to_number}")
+
+        fax_providers._health.clear()
+        store = self.store()
+        blob = store.put(b'%PDF-1.4 order', 'order.pdf')
+        for number in ('+18175551234', '+18175551235'):
+            FaxRecord.objects.create(fax_id=f"failed-{number}", to_number=number, status='failed', document=blob)
+        router = FaxRouter(providers=[Recording('humblefax', SENT)], store=store, rng=FirstChoice())
+        with mock.patch('app.management.commands.resend_failed_faxes.FaxRouter', return_value=router):
+            call_command('resend_failed_faxes', stdout=io.StringIO())
+        self.assertEqual(sorted(received), [('+18175551234', '.pdf', b'%PDF-1.4 order'),
+                                            ('+18175551235', '.pdf', b'%PDF-1.4 order')])
+        self.assertEqual(FaxRecord.objects.filter(status='sent').count(), 2)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for i, status in enumerate(('delivered', 'failed', 'delivered')):
+            fax = FaxRecord.objects.create(fax_id=f"fax-{i}", to_number='+18175551234', status=status,
+                                           patient_name=f"Patient {i}\x01", num_pages=i + 1)
+            FaxRecord.objects.filter(pk=fax.pk).update(created_at=now - timedelta(days=i))
+        self.now = now
+
+    def export(self, kind='fax', **params):
+        return self.client.get(reverse('export_records', args=[kind]), params)
+
+    def test_csv_rows_newest_first(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(tuple(rows[0]), exports.EXPORTS['fax'][1])
+        self.assertEqual([row[0] for row in rows[1:]], ['fax-0', 'fax-1', 'fax-2'])
+        fax = dict(zip(rows[0], rows[1]))
+        self.assertEqual(fax['num_pages'], '1')
+        self.assertEqual(fax['created_at'], timezone.localtime(self.now).isoformat(sep=' ', timespec='seconds'))
+
+    def test_csv_is_streamed_in_chunks(self):
+        rows = FaxRecord.objects.order_by('-created_at').values_list('fax_id')
+        self.assertEqual(len(list(exports.stream_csv(rows, ('fax_id',)))), 2)
+
+    def exported_ids(self, **params):
+        rows = list(csv.reader(io.StringIO(b''.join(self.export(**params).streaming_content).decode())))
+        return [row[0] for row in rows[1:]]
+
+    def test_filters(self):
+        self.assertEqual(self.exported_ids(status='failed'), ['fax-1'])
+        self.assertEqual(self.exported_ids(status='failed,delivered'), ['fax-0', 'fax-1', 'fax-2'])
+        self.assertEqual(self.exported_ids(since=timezone.localdate(self.now - timedelta(days=1)).isoformat()),
+                         ['fax-0', 'fax-1'])
+        self.assertEqual(self.exported_ids(until=timezone.localdate(self.now - timedelta(days=2)).isoformat()),
+                         ['fax-2'])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.export(since='yesterday').status_code, 400)
+        self.assertEqual(self.export(format='pdf').status_code, 400)
+        self.assertEqual(self.export(kind='letters').status_code, 404)
+
+    def load_xlsx(self, response):
+        try:
+            import openpyxl
+        except ImportError:
+            self.skipTest('openpyxl is not installed')
+        return openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_xlsx_content(self):
+        workbook = self.load_xlsx(self.export(format='xlsx'))
+        self.assertEqual(workbook.sheetnames, ['Faxes'])
+        sheet = workbook['Faxes']
+        rows = list(sheet.values)
+        self.assertEqual(rows[0], exports.EXPORTS['fax'][1])
+        fax = dict(zip(rows[0], rows[1]))
+        self.assertEqual(fax['fax_id'], 'fax-0')
+        self.assertEqual(fax['patient_name'], 'Patient 0')
+        self.assertEqual(fax['num_pages'], 1)
+        expected = timezone.localtime(self.now).replace(tzinfo=None)
+        self.assertLess(abs(fax['created_at'] - expected), timedelta(milliseconds=1))
+
+    def test_xlsx_rolls_over_to_new_sheets(self):
+        with mock.patch.object(exports, 'XLSX_MAX_ROWS', 2):
+            workbook = self.load_xlsx(self.export(format='xlsx'))
+        self.assertEqual(workbook.sheetnames, ['Faxes', 'Faxes 2'])
+        self.assertEqual([row[0] for row in workbook['Faxes 2'].values], ['fax_id', 'fax-2'])
+
+
+class ConditionalAPITests(TestCase):
+    def setUp(self):
+        for i in range(5):
+            FaxRecord.objects.create(fax_id=f"fax-{i}", to_number='+18175551234', status='sent',
+                                     patient_name=f"Patient {i}")
+
+    def get(self, name='api_fax_list', args=(), **headers):
+        return self.client.get(reverse(name, args=args), headers=headers)
+
+    def test_unchanged_page_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.get(**{'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.get(**{'If-Modified-Since': response['Last-Modified']}).status_code, 304)
+
+    def test_changed_row_changes_the_etag(self):
+        etag = self.get()['ETag']
+        FaxRecord.objects.filter(fax_id='fax-3').update(status='delivered', updated_at=timezone.now() + timedelta(seconds=1))
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_compressed_response_has_a_weak_etag(self):
+        plain = self.get()
+        response = self.get(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], f"W/{plain['ETag']}")
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), json.loads(plain.content))
+
+    def test_weak_and_strong_etags_both_revalidate(self):
+        strong = self.get()['ETag']
+        weak = self.get(**{'Accept-Encoding': 'gzip'})['ETag']
+        for etag in (strong, weak):
+            response = self.get(**{'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, etag)
+            self.assertEqual(response['ETag'], weak)
+        self.assertEqual(self.get(**{'If-None-Match': weak})['ETag'], strong)
+
+    def test_fax_detail(self):
+        response = self.get('api_fax_detail', ['fax-1'])
+        self.assertEqual(response.json()['fax_id'], 'fax-1')
+        self.assertEqual(self.get('api_fax_detail', ['fax-1'], **{'If-None-Match': response['ETag']}).status_code, 304)
+        self.assertEqual(self.get('api_fax_detail', ['missing']).status_code, 404)
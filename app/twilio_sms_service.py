@@ -1,16 +1,35 @@
 import requests
 import logging
-import re
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from .api_config_cache import get_api_config
+from .carrier_cache import get_carrier_cache
+from .phone_numbers import to_e164
+from .circuit_breaker import CircuitOpenError, circuit_open_result, get_breaker
 
 logger = logging.getLogger(__name__)
 
 class TwilioSMSService:
-    def __init__(self):
-        self.account_sid = getattr(settings, 'TWILIO_ACCOUNT_SID', 'your_twilio_account_sid_here')
-        self.auth_token = getattr(settings, 'TWILIO_AUTH_TOKEN', 'your_twilio_auth_token_here')
-        self.from_number = getattr(settings, 'TWILIO_FROM_NUMBER', '+1234567890')
-        self.base_url = f"https://api.twilio.com/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+    def __init__(self, account_sid=None, auth_token=None, from_number=None):
+        # Twilio API configuration - can be passed in or retrieved from database
+        if account_sid and auth_token:
+            self.account_sid = account_sid
+            self.auth_token = auth_token
+            self.from_number = from_number or '+1234567890'
+        else:
+            # Try the cached database configuration first, then fall back to settings
+            config = get_api_config('twilio')
+            if config and config.account_sid and config.auth_token:
+                self.account_sid = config.account_sid
+                self.auth_token = config.auth_token
+                self.from_number = config.from_number or getattr(settings, 'TWILIO_FROM_NUMBER', '+1234567890')
+            else:
+                self.account_sid = getattr(settings, 'TWILIO_ACCOUNT_SID', 'your_twilio_account_sid_here')
+                self.auth_token = getattr(settings, 'TWILIO_AUTH_TOKEN', 'your_twilio_auth_token_here')
+                self.from_number = getattr(settings, 'TWILIO_FROM_NUMBER', '+1234567890')
+        self.api_base_url = getattr(settings, 'TWILIO_BASE_URL', "https://api.twilio.com").rstrip('/')
+        self.lookup_base_url = getattr(settings, 'TWILIO_LOOKUP_BASE_URL', "https://lookups.twilio.com").rstrip('/')
+        self.base_url = f"{self.api_base_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
         
     def _get_auth_headers(self):
         """
@@ -29,40 +48,39 @@ class TwilioSMSService:
         logger.info(f"Generated Twilio Authorization header: Basic {auth_b64[:20]}...")
         return headers
     
-    def is_mobile_number(self, phone_number):
+    def _request(self, method, endpoint, url, **kwargs):
         """
-        Check if the given phone number is a mobile number
-        Uses Twilio's Lookup API to determine if it's a mobile number
+        Make an API request through the circuit breaker for the endpoint
+        
+        Raises:
+            CircuitOpenError: If the endpoint's breaker is open
+        """
+        return get_breaker(f"twilio:{endpoint}").call(requests.request, method, url, **kwargs)
+    
+    def lookup_carrier(self, e164_number):
+        """
+        Look up the carrier type of a number with Twilio's Lookup API
         
         Args:
-            phone_number (str): The phone number to check
+            e164_number (str): Number in E.164 format
             
         Returns:
-            bool: True if mobile, False if landline or invalid
+            tuple: (carrier_type, carrier_name), or None if the lookup failed
         """
+        cache = get_carrier_cache()
+        cache.count('lookups')
         try:
-            # Clean the phone number
-            cleaned_number = re.sub(r'\D', '', str(phone_number))
-            
-            if len(cleaned_number) < 10:
-                logger.warning(f"Phone number {phone_number} is too short")
-                return False
-            
-            # Add country code if not present
-            if len(cleaned_number) == 10:
-                cleaned_number = f"1{cleaned_number}"
-            
-            # Use Twilio Lookup API to check carrier type
-            lookup_url = f"https://lookups.twilio.com/v2/PhoneNumbers/{cleaned_number}"
+            lookup_url = f"{self.lookup_base_url}/v2/PhoneNumbers/{e164_number}"
             params = {
                 "Fields": "carrier"
             }
             
             headers = self._get_auth_headers()
             
-            logger.info(f"Checking if {cleaned_number} is a mobile number...")
+            logger.info(f"Looking up carrier for {e164_number}...")
             
-            response = requests.get(
+            response = self._request(
+                'GET', 'lookup',
                 lookup_url,
                 headers=headers,
                 params=params,
@@ -70,23 +88,105 @@ class TwilioSMSService:
             )
             
             if response.status_code == 200:
-                result = response.json()
-                carrier_info = result.get('carrier', {})
-                carrier_type = carrier_info.get('type', '').lower()
-                
-                is_mobile = carrier_type in ['mobile', 'voip']
-                logger.info(f"Phone number {cleaned_number} carrier type: {carrier_type}, is_mobile: {is_mobile}")
-                
-                return is_mobile
-            else:
-                logger.warning(f"Twilio Lookup API returned {response.status_code}: {response.text}")
-                # If lookup fails, assume it's mobile to be safe
-                return True
-                
+                carrier_info = response.json().get('carrier') or {}
+                return (carrier_info.get('type') or '').lower(), carrier_info.get('name')
+            
+            logger.warning(f"Twilio Lookup API returned {response.status_code}: {response.text}")
         except Exception as e:
-            logger.error(f"Error checking if {phone_number} is mobile: {str(e)}")
-            # If there's an error, assume it's mobile to be safe
+            logger.error(f"Error looking up carrier for {e164_number}: {str(e)}")
+        cache.count('lookup_errors')
+        return None
+    
+    def resolve_carriers(self, phone_numbers, max_workers=None):
+        """
+        Resolve carrier types for many numbers before a bulk send
+        
+        Numbers are normalized and de-duplicated, cached carrier types are read
+        with one query, and the rest are looked up concurrently with a bounded
+        pool. New results are written back to the cache in one transaction.
+        
+        Args:
+            phone_numbers (list): Phone numbers as entered
+            max_workers (int): Concurrent Lookup API requests
+            
+        Returns:
+            dict: 'sendable' (original, E.164) pairs in input order, plus the
+                  'landline', 'invalid' and 'duplicate' numbers that were dropped
+                  and the number of 'lookups' made
+        """
+        max_workers = max_workers or getattr(settings, 'TWILIO_LOOKUP_WORKERS', 8)
+        
+        recipients = []
+        seen = set()
+        invalid = []
+        duplicate = []
+        for phone in phone_numbers:
+            e164_number = self.format_phone_number(phone)
+            if not e164_number:
+                invalid.append(phone)
+            elif e164_number in seen:
+                duplicate.append(phone)
+            else:
+                seen.add(e164_number)
+                recipients.append((phone, e164_number))
+        
+        cache = get_carrier_cache()
+        numbers = [e164_number for _, e164_number in recipients]
+        carriers = {number: info.is_mobile for number, info in cache.get_many(numbers).items()}
+        
+        misses = [number for number in numbers if number not in carriers]
+        if misses:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(self.lookup_carrier, misses))
+            found = [(number,) + result for number, result in zip(misses, results) if result is not None]
+            for info in cache.set_many(found):
+                carriers[info.phone_number] = info.is_mobile
+            # Failed lookups are assumed mobile, as in is_mobile_number
+            for number in misses:
+                carriers.setdefault(number, True)
+        
+        sendable = [(phone, number) for phone, number in recipients if carriers[number]]
+        landline = [phone for phone, number in recipients if not carriers[number]]
+        logger.info(f"Resolved {len(recipients)} numbers ({len(misses)} lookups): {len(sendable)} sendable, "
+                    f"{len(landline)} landline, {len(invalid)} invalid, {len(duplicate)} duplicate")
+        return {
+            'sendable': sendable,
+            'landline': landline,
+            'invalid': invalid,
+            'duplicate': duplicate,
+            'lookups': len(misses),
+        }
+    
+    def is_mobile_number(self, phone_number):
+        """
+        Check if the given phone number is a mobile number
+        Uses the carrier cache, and Twilio's Lookup API on a cache miss
+        
+        Args:
+            phone_number (str): The phone number to check
+            
+        Returns:
+            bool: True if mobile, False if landline or invalid
+        """
+        e164_number = to_e164(phone_number)
+        if not e164_number:
+            logger.warning(f"Phone number {phone_number} is not a valid number")
+            return False
+        
+        cache = get_carrier_cache()
+        cached = cache.get(e164_number)
+        if cached is not None:
+            logger.info(f"Phone number {e164_number} carrier type (cached): {cached.carrier_type}, is_mobile: {cached.is_mobile}")
+            return cached.is_mobile
+        
+        result = self.lookup_carrier(e164_number)
+        if result is None:
+            # If lookup fails, assume it's mobile to be safe (and don't cache it)
             return True
+        
+        info = cache.set(e164_number, *result)
+        logger.info(f"Phone number {e164_number} carrier type: {info.carrier_type}, is_mobile: {info.is_mobile}")
+        return info.is_mobile
     
     def format_phone_number(self, phone_number):
         """
@@ -98,31 +198,15 @@ class TwilioSMSService:
         Returns:
             str: Formatted phone number or None if invalid
         """
-        try:
-            # Remove all non-digit characters
-            digits_only = re.sub(r'\D', '', str(phone_number))
-            
-            # Check minimum length
-            if len(digits_only) < 10:
-                logger.warning(f"Phone number {phone_number} has only {len(digits_only)} digits")
-                return None
-            
-            # Add country code if needed
-            if len(digits_only) == 10:
-                formatted_number = f"+1{digits_only}"
-            elif len(digits_only) == 11 and digits_only.startswith('1'):
-                formatted_number = f"+{digits_only}"
-            else:
-                formatted_number = f"+{digits_only}"
-            
-            logger.info(f"Formatted phone number {phone_number} -> {formatted_number}")
-            return formatted_number
-            
-        except Exception as e:
-            logger.error(f"Error formatting phone number {phone_number}: {str(e)}")
+        formatted_number = to_e164(phone_number)
+        if not formatted_number:
+            logger.warning(f"Phone number {phone_number} is not a valid number")
             return None
+        
+        logger.debug(f"Formatted phone number {phone_number} -> {formatted_number}")
+        return formatted_number
     
-    def send_sms(self, to_number, message, name=None):
+    def send_sms(self, to_number, message, name=None, skip_lookup=False):
         """
         Send SMS using Twilio API
         
@@ -130,6 +214,8 @@ class TwilioSMSService:
             to_number (str): Recipient phone number
             message (str): Message content
             name (str): Recipient name for logging
+            skip_lookup (bool): Skip the mobile check for numbers already
+                resolved with resolve_carriers
             
         Returns:
             dict: SMS sending result
@@ -149,7 +235,7 @@ class TwilioSMSService:
                 }
             
             # Check if it's a mobile number
-            if not self.is_mobile_number(formatted_number):
+            if not skip_lookup and not self.is_mobile_number(formatted_number):
                 return {
                     'success': False,
                     'error': f"Phone number {formatted_number} is not a mobile number",
@@ -162,12 +248,16 @@ class TwilioSMSService:
                 "From": self.from_number,
                 "Body": message
             }
+            status_callback = getattr(settings, 'TWILIO_STATUS_CALLBACK_URL', '')
+            if status_callback:
+                data["StatusCallback"] = status_callback
             
             headers = self._get_auth_headers()
             
             logger.info(f"Sending SMS via Twilio to {formatted_number}")
             
-            response = requests.post(
+            response = self._request(
+                'POST', 'messages',
                 self.base_url,
                 headers=headers,
                 data=data,
@@ -197,6 +287,9 @@ class TwilioSMSService:
                     'message': 'Failed to send SMS'
                 }
                 
+        except CircuitOpenError as e:
+            logger.warning(str(e))
+            return circuit_open_result(e, 'Twilio is temporarily unavailable')
         except Exception as e:
             error_msg = f"Error sending SMS: {str(e)}"
             logger.error(error_msg)
@@ -249,9 +342,10 @@ class TwilioSMSService:
             headers = self._get_auth_headers()
             
             # Try to get account information
-            account_url = f"https://api.twilio.com/2010-04-01/Accounts/{self.account_sid}.json"
+            account_url = f"{self.api_base_url}/2010-04-01/Accounts/{self.account_sid}.json"
             
-            response = requests.get(
+            response = self._request(
+                'GET', 'account',
                 account_url,
                 headers=headers,
                 timeout=10
@@ -1,8 +1,9 @@
 from django.urls import path
-from . import views
+from . import views, webhooks
 
 urlpatterns = [
     path('',views.dashboard, name='dashboard'),
+    path('dashboard/stats/', views.dashboard_stats, name='dashboard_stats'),
     path('api-config/', views.api_configuration, name='api_configuration'),
     path('single-fax/',views.new, name='new'),
     path('genknee', views.genknee, name='genknee'),
@@ -11,10 +12,21 @@ urlpatterns = [
     path('fax_list/', views.fax_list, name='fax_list'),
     path('fax_detail/<str:fax_id>/',views.fax_detail, name='fax_detail'),
     path('fax_resend/<str:fax_id>/', views.fax_resend, name='fax_resend'),
+    path('search/', views.search, name='search'),
+    path('export/<str:kind>/', views.export_records, name='export_records'),
+    path('api/faxes/', views.api_fax_list, name='api_fax_list'),
+    path('api/faxes/<str:fax_id>/', views.api_fax_detail, name='api_fax_detail'),
+    path('api/sms/', views.api_sms_list, name='api_sms_list'),
     path('bulk-fax/', views.bulk_fax_generator, name='bulk_fax_generator'),
     path('bulk-fax/send/', views.bulk_fax_sender, name='bulk_fax_sender'),
+    path('fax-media/<str:media_name>', views.fax_media, name='fax_media'),
     	path('test-humblefax/', views.test_humblefax_connection, name='test_humblefax_connection'),
 	path('single-sms/', views.single_sms, name='single_sms'),
 	path('bulk-sms/', views.bulk_sms, name='bulk_sms'),
 	path('test-twilio/', views.test_twilio_connection, name='test_twilio_connection'),
+	path('carrier-cache/stats/', views.carrier_cache_stats, name='carrier_cache_stats'),
+	path('fax-providers/stats/', views.fax_provider_stats, name='fax_provider_stats'),
+	path('webhooks/humblefax/', webhooks.humblefax_webhook, name='humblefax_webhook'),
+	path('webhooks/telnyx/', webhooks.telnyx_webhook, name='telnyx_webhook'),
+	path('webhooks/twilio/sms-status/', webhooks.twilio_sms_status_webhook, name='twilio_sms_status_webhook'),
 ]
@@ -1,14 +1,25 @@
 import os
 import base64
+import hashlib
 import logging
 import csv
+import time
 import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.shortcuts import render, redirect
 from django.urls import reverse
-from django.http import HttpResponse, JsonResponse
+from django.http import (
+    HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse, Http404,
+    HttpResponseForbidden, HttpResponseNotModified
+)
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.contrib import messages
-from .models import FaxRecord, SMSRecord, APIConfiguration
+from django.db.models import Q
+from .models import FaxRecord, SMSRecord, APIConfiguration, MediaUpload
 from .forms import (
     TelnyxConfigForm, HumbleFaxConfigForm, TwilioConfigForm,
     SendFaxForm, SendSMSForm, BulkFaxForm, BulkSMSForm, SingleFaxForm, BulkUploadForm
@@ -16,10 +27,47 @@ from .forms import (
 from .document_generator import DocumentGenerator
 from .humblefax_service import HumbleFaxService
 from .twilio_sms_service import TwilioSMSService
+from .api_config_cache import get_api_config
+from .carrier_cache import get_carrier_cache
+from .bulk_sms_sender import BulkSMSSender
+from .phone_numbers import split_numbers
+from .record_writer import BufferedRecordWriter
+from .record_counts import fax_count
+from .record_search import search_faxes, search_sms
+from .archive import find_archived
+from . import daily_stats
+from .exports import EXPORTS, FORMATS, ExportError, export_queryset, stream_csv, stream_xlsx
+from .fax_providers import FaxRouter
+from .http_compression import compress_response
+from .media_stage import local_media_root, verify_media_signature
+from .pdf_conversion_service import get_conversion_service
 import requests
 
 logger = logging.getLogger(__name__)
 
+def _fax_router(request, provider=None):
+    """
+    Router over every configured fax provider, or just the one picked on a form
+
+    Anything other than a known provider name (e.g. 'auto') routes automatically.
+    """
+    names = [provider] if provider in dict(FaxRecord.PROVIDER_CHOICES) else None
+    return FaxRouter(names=names, base_url=request.build_absolute_uri('/'))
+
+def _no_provider_response(request):
+    return HttpResponse("""
+        <div style='text-align: center; padding: 50px;'>
+            <h2 style='color: red;'>✗ Fax Provider Not Configured</h2>
+            <p>Please configure HumbleFax or Telnyx API settings first to send faxes.</p>
+            <br>
+            <a href="{}" class="btn btn-primary">Configure API</a>
+            <a href="{}" class="btn btn-secondary">Back to Dashboard</a>
+        </div>
+    """.format(
+        reverse('api_configuration'),
+        reverse('dashboard')
+    ))
+
 def dashboard(request):
     return render(request, 'app/dashboard.html')
 
@@ -86,7 +134,7 @@ def api_configuration(request):
 
 def test_humblefax_connection(request):
     try:
-        config = APIConfiguration.objects.filter(service='humblefax', is_active=True).first()
+        config = get_api_config('humblefax')
         if not config:
             return JsonResponse({"status": "error", "message": "HumbleFax not configured"})
         
@@ -128,50 +176,37 @@ def new(request): #type new to access docx file
                 doc_generator = DocumentGenerator()
                 temp_path, filename = doc_generator.generate_from_template(form_data, device_type)
                 
-                # Read the generated file
-                with open(temp_path, 'rb') as f:
-                    file_content = f.read()
-                
                 # Check if user wants to send fax
                 send_fax = request.POST.get('send_fax') == 'on'
                 fax_number = request.POST.get('fax_number', '').strip()
                 
                 if send_fax and fax_number:
-                    # Check if HumbleFax is configured
-                    humblefax_config = APIConfiguration.objects.filter(service='humblefax', is_active=True).first()
-                    if not humblefax_config:
+                    # Route through the chosen provider, or the healthiest one
+                    router = _fax_router(request, request.POST.get('fax_provider'))
+                    if not router.providers:
                         # Clean up temporary file
                         os.remove(temp_path)
-                        return HttpResponse("""
-                            <div style='text-align: center; padding: 50px;'>
-                                <h2 style='color: red;'>✗ HumbleFax Not Configured</h2>
-                                <p>Please configure HumbleFax API settings first to send faxes.</p>
-                                <br>
-                                <a href="{}" class="btn btn-primary">Configure API</a>
-                                <a href="{}" class="btn btn-secondary">Back to Dashboard</a>
-                            </div>
-                        """.format(
-                            reverse('api_configuration'),
-                            reverse('dashboard')
-                        ))
+                        return _no_provider_response(request)
                     
                     try:
-                        # Send fax using HumbleFax
-                        humblefax = HumbleFaxService(
-                            access_key=humblefax_config.api_key,
-                            secret_key=humblefax_config.secret_key,
-                            from_number=humblefax_config.from_number
-                        )
-                        fax_result = humblefax.send_fax(fax_number, file_content, filename, form_data.get('name'))
+                        # Convert to PDF locally when LibreOffice is available
+                        fax_path, fax_filename, num_pages = get_conversion_service().prepare_for_fax(temp_path, filename)
+                        fax_result = router.send(fax_number, document=fax_path, filename=fax_filename,
+                                                 patient_name=form_data.get('name'))
                         
                         if fax_result['success']:
                             # Save fax record to database
                             FaxRecord.objects.create(
                                 fax_id=fax_result.get('fax_id', ''),
                                 to_number=fax_number,
-                                from_number=humblefax_config.from_number or '+1234567890',
+                                from_number=fax_result.get('from_number') or '+1234567890',
                                 status='sent',
+                                provider=fax_result['provider'],
+                                media_url=fax_result.get('media_url'),
+                                media_name=fax_result.get('media_name'),
+                                document_id=fax_result.get('document_id'),
                                 subject=f"Medical Order - {device_type.replace('_', ' ').title()}",
+                                num_pages=num_pages,
                                 patient_name=form_data.get('name', ''),
                                 device_type=device_type
                             )
@@ -233,6 +268,9 @@ def new(request): #type new to access docx file
                         ))
                 else:
                     # Just download the document
+                    with open(temp_path, 'rb') as f:
+                        file_content = f.read()
+                    
                     # Clean up temporary file
                     os.remove(temp_path)
                     
@@ -272,53 +310,40 @@ def geninvoice(request):
 
 def sendfax(request):
     if request.method == 'POST':
-        form = SendFaxForm(request.POST)
+        form = SendFaxForm(request.POST, request.FILES)
         if form.is_valid():
             fax_to = form.cleaned_data['fax_to']
             media_url = form.cleaned_data['media_url']
+            document = form.cleaned_data.get('document')
             subject = form.cleaned_data.get('subject', '')
             
-            # Get Telnyx configuration
-            config = APIConfiguration.objects.filter(service='telnyx', is_active=True).first()
-            if not config or not config.api_key:
-                return HttpResponse("Telnyx not configured. Please configure API settings first.")
+            router = _fax_router(request)
+            if not router.providers:
+                return HttpResponse("No fax provider configured. Please configure API settings first.")
             
             try:
-                # Define the API endpoint and authentication credentials
-                endpoint = "https://api.telnyx.com/v2/faxes"
-                api_key = config.api_key
-
-                # Define the fax content and recipient information
-                data = {
-                    "media_url": media_url,
-                    "connection_id": "2047423188568114992",
-                    "to": fax_to,
-                    "from": config.from_number or "+18177800212",
-                }
-
-                # Make the API request to send the fax
-                response = requests.post(endpoint, json=data, headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {api_key}"
-                })
-
-                # Check the API response to see if the fax was sent successfully
-                if response.status_code == 201:
-                    fax = response.json()
+                # An uploaded document can go through any provider; Telnyx stages it once
+                # and every later send of the same bytes reuses the upload
+                result = router.send(fax_to, document=document.read() if document else None,
+                                     filename=document.name if document else None, media_url=media_url)
+                if result['success']:
                     
                     # Save to database
                     FaxRecord.objects.create(
-                        fax_id=fax['id'],
+                        fax_id=result['fax_id'],
                         to_number=fax_to,
-                        from_number=config.from_number or "+18177800212",
+                        from_number=result['from_number'],
                         status='sent',
-                        media_url=media_url,
+                        provider=result['provider'],
+                        media_url=result.get('media_url'),
+                        media_name=result.get('media_name'),
+                        document_id=result.get('document_id'),
                         subject=subject
                     )
                     
-                    return HttpResponse(f"Fax sent successfully! Fax ID: {fax['id']}")
+                    return HttpResponse(f"Fax sent successfully! Fax ID: {result['fax_id']}")
                 else:
-                    return HttpResponse(f"Fax failed to send. API response: {response.text}")
+                    return HttpResponse(f"Fax failed to send. {result.get('error', result['message'])}")
             
             except Exception as e:
                 return HttpResponse(f"Error sending fax: {str(e)}")
@@ -327,30 +352,104 @@ def sendfax(request):
     
     return render(request, 'send_fax.html', {'form': form})
 
+# Columns fax_list.html displays, in the order its rows unpack them
+FAX_LIST_COLUMNS = ('fax_id', 'to_number', 'from_number', 'status', 'updated_at', 'direction', 'subject', 'num_pages')
+FAX_LIST_PAGE_SIZE = 50
+FAX_LIST_MAX_PAGE_SIZE = 200
+SEARCH_RESULT_LIMIT = 100
+
+# Fields the JSON API returns, besides created_at
+API_FAX_COLUMNS = (
+    'fax_id', 'direction', 'status', 'provider', 'to_number', 'from_number', 'patient_name',
+    'device_type', 'subject', 'num_pages', 'status_updated_at', 'updated_at',
+)
+API_SMS_COLUMNS = ('sid', 'status', 'to_number', 'from_number', 'message', 'status_updated_at', 'updated_at')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _encode_cursor(created_at, pk):
+    """Opaque keyset cursor for the row (created_at, id)"""
+    delta = created_at - _EPOCH
+    return f"{(delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds}-{pk}"
+
+
+def _decode_cursor(cursor):
+    """(created_at, id) from a cursor, or None if it is malformed"""
+    try:
+        micros, pk = cursor.split('-', 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def _page_limit(request):
+    try:
+        return min(max(int(request.GET.get('limit', FAX_LIST_PAGE_SIZE)), 1), FAX_LIST_MAX_PAGE_SIZE)
+    except ValueError:
+        return FAX_LIST_PAGE_SIZE
+
+def _keyset_page(queryset, columns, request, limit):
+    """
+    One page of rows, newest first, keyset-paginated on (created_at, id)
+
+    ?after=<cursor> pages older, ?before=<cursor> pages newer, so every page
+    is an index range scan of one page of rows however large the table is.
+
+    Returns:
+        tuple: (rows of columns + (created_at, id), newer cursor, older cursor)
+    """
+    after = _decode_cursor(request.GET.get('after'))
+    before = None if after else _decode_cursor(request.GET.get('before'))
+    columns = tuple(columns) + ('created_at', 'id')
+
+    # created_at__lte/gte bounds the index range; the OR only breaks ties
+    if before:
+        created_at, pk = before
+        rows = list(queryset.filter(
+            Q(created_at__gt=created_at) | Q(id__gt=pk), created_at__gte=created_at
+        ).order_by('created_at', 'id').values_list(*columns)[:limit + 1])
+        has_newer = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_older = True
+    else:
+        if after:
+            created_at, pk = after
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(id__lt=pk), created_at__lte=created_at)
+        rows = list(queryset.order_by('-created_at', '-id').values_list(*columns)[:limit + 1])
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+        has_newer = after is not None
+
+    newer_cursor = _encode_cursor(rows[0][-2], rows[0][-1]) if rows and has_newer else None
+    older_cursor = _encode_cursor(rows[-1][-2], rows[-1][-1]) if rows and has_older else None
+    return rows, newer_cursor, older_cursor
+
 def fax_list(request):
     """
-    Get fax history from database
+    Get fax history from database, newest first
+
+    Pages are keyset-paginated (see _keyset_page). Only the displayed
+    columns are fetched and the total comes from the stored fax counts.
     """
     try:
+        direction = request.GET.get('direction')
+        if direction not in ('outbound', 'inbound'):
+            direction = None
+        limit = _page_limit(request)
+
         faxes = FaxRecord.objects.all()
-        
-        # Format data for template
-        fax_data = []
-        for fax in faxes:
-            fax_data.append((
-                fax.fax_id,
-                fax.to_number,
-                fax.from_number,
-                fax.status,
-                fax.updated_at,
-                fax.direction,
-                fax.subject,
-                fax.num_pages
-            ))
-        
+        if direction:
+            faxes = faxes.filter(direction=direction)
+        rows, newer_cursor, older_cursor = _keyset_page(faxes, FAX_LIST_COLUMNS, request, limit)
+
         context = {
-            "fax_data": fax_data,
-            "total_count": len(faxes),
+            "fax_data": [row[:len(FAX_LIST_COLUMNS)] for row in rows],
+            "total_count": fax_count(direction),
+            "direction": direction,
+            "limit": limit,
+            "newer_cursor": newer_cursor,
+            "older_cursor": older_cursor,
         }
         
         return render(request, 'fax_list.html', context)
@@ -360,19 +459,46 @@ def fax_list(request):
         logger.error(error_msg)
         return render(request, 'fax_list.html', {"error_msg": error_msg})
 
+def search(request):
+    """
+    Search fax and SMS history by patient, subject, device, number or message text
+    """
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('type', 'all')
+    context = {"query": query, "type": kind}
+    if query:
+        try:
+            start = time.perf_counter()
+            if kind in ('all', 'fax'):
+                context["faxes"] = search_faxes(query, limit=SEARCH_RESULT_LIMIT)
+            if kind in ('all', 'sms'):
+                context["sms_messages"] = search_sms(query, limit=SEARCH_RESULT_LIMIT)
+            context["elapsed_ms"] = (time.perf_counter() - start) * 1000
+            context["limit"] = SEARCH_RESULT_LIMIT
+        except Exception as e:
+            error_msg = f"Error searching history: {str(e)}"
+            logger.error(error_msg)
+            context["error_msg"] = error_msg
+    return render(request, 'search.html', context)
+
 def fax_detail(request, fax_id):
     """
-    Get detailed information about a specific fax
+    Get detailed information about a specific fax, from the archive if it
+    has been moved out of FaxRecord
     """
     try:
         fax = FaxRecord.objects.filter(fax_id=fax_id).first()
+        archived = None
+        if fax:
+            record = {field.attname: getattr(fax, field.attname) for field in FaxRecord._meta.concrete_fields}
+        else:
+            record, archived = find_archived('fax', fax_id)
+            if not record:
+                error_msg = "Fax not found" if archived is None else "Fax is archived but its archive segment could not be read"
+                return render(request, 'fax_detail.html', {"error_msg": error_msg})
         
-        if not fax:
-            return render(request, 'fax_detail.html', {"error_msg": "Fax not found"})
-        
-        context = {
-            "fax": fax
-        }
+        # The template reads the fields directly
+        context = dict(record, fax=fax or record, archived=archived)
         
         return render(request, 'fax_detail.html', context)
             
@@ -389,24 +515,26 @@ def single_sms(request):
             message = form.cleaned_data['message']
             
             # Get Twilio configuration
-            config = APIConfiguration.objects.filter(service='twilio', is_active=True).first()
+            config = get_api_config('twilio')
             if not config or not config.account_sid or not config.auth_token:
                 return HttpResponse("Twilio not configured. Please configure API settings first.")
             
             try:
-                twilio_service = TwilioSMSService()
+                twilio_service = TwilioSMSService(config.account_sid, config.auth_token, config.from_number)
                 result = twilio_service.send_sms(phone_number, message)
+                if not result['success']:
+                    return HttpResponse(f"Error sending SMS: {result.get('error', result['message'])}")
                 
                 # Save to database
                 SMSRecord.objects.create(
-                    sid=result,
+                    sid=result['sms_id'],
                     to_number=phone_number,
                     from_number=config.from_number or "+15612209629",
                     message=message,
                     status='sent'
                 )
                 
-                return HttpResponse(f"SMS sent successfully! SID: {result}")
+                return HttpResponse(f"SMS sent successfully! SID: {result['sms_id']}")
             except Exception as e:
                 return HttpResponse(f"Error sending SMS: {str(e)}")
     else:
@@ -422,39 +550,54 @@ def bulk_sms(request):
             message = form.cleaned_data['message']
             
             # Get Twilio configuration
-            config = APIConfiguration.objects.filter(service='twilio', is_active=True).first()
+            config = get_api_config('twilio')
             if not config or not config.account_sid or not config.auth_token:
                 return HttpResponse("Twilio not configured. Please configure API settings first.")
             
             # Split phone numbers by comma or newline
-            phone_list = [phone.strip() for phone in phone_numbers.replace('\n', ',').split(',') if phone.strip()]
+            phone_list = split_numbers(phone_numbers)
             
             if not phone_list:
                 return HttpResponse("No valid phone numbers provided")
             
             try:
-                twilio_service = TwilioSMSService()
-                results = []
+                twilio_service = TwilioSMSService(config.account_sid, config.auth_token, config.from_number)
                 
-                for phone in phone_list:
-                    try:
-                        result = twilio_service.send_sms(phone, message)
-                        results.append(f"✓ {phone}: Success (SID: {result})")
-                        
-                        # Save to database
-                        SMSRecord.objects.create(
-                            sid=result,
-                            to_number=phone,
-                            from_number=config.from_number or "+15612209629",
-                            message=message,
-                            status='sent'
-                        )
-                    except Exception as e:
-                        results.append(f"✗ {phone}: Failed - {str(e)}")
-                
-                return HttpResponse("<br>".join(results))
+                # Pre-flight: drop duplicates, invalid numbers and landlines before sending
+                resolved = twilio_service.resolve_carriers(phone_list)
             except Exception as e:
                 return HttpResponse(f"Error sending bulk SMS: {str(e)}")
+            
+            def send_results():
+                yield (f"{len(resolved['sendable'])} of {len(phone_list)} recipients sendable "
+                       f"({len(resolved['landline'])} landline, {len(resolved['invalid'])} invalid, "
+                       f"{len(resolved['duplicate'])} duplicate)<br>")
+                for phone in resolved['landline']:
+                    yield f"✗ {phone}: Skipped - not a mobile number<br>"
+                for phone in resolved['invalid']:
+                    yield f"✗ {phone}: Skipped - invalid phone number<br>"
+                yield "<br>"
+                
+                # Concurrent sends paced to the sender number's rate; records are saved in batches
+                sender = BulkSMSSender(twilio_service)
+                try:
+                    for (phone, _), result in sender.send(resolved['sendable'], message, from_number=config.from_number or "+15612209629"):
+                        if result['success']:
+                            yield f"✓ {phone}: Success (SID: {result['sms_id']})<br>"
+                        elif result.get('deferred'):
+                            yield f"✗ {phone}: {result['message']}<br>"
+                        else:
+                            yield f"✗ {phone}: Failed - {result['error']}<br>"
+                except Exception as e:
+                    yield f"Error sending bulk SMS: {str(e)}<br>"
+                
+                stats = sender.stats()
+                yield (f"<br>{stats['sent']} sent, {stats['failed']} failed in {stats['elapsed_seconds']:.1f}s "
+                       f"({stats['messages_per_second']:.1f} msg/s, latency p50 {stats['p50_seconds'] * 1000:.0f}ms, "
+                       f"p95 {stats['p95_seconds'] * 1000:.0f}ms, p99 {stats['p99_seconds'] * 1000:.0f}ms)")
+            
+            # Stream so the summary shows before the sends finish
+            return StreamingHttpResponse(send_results())
     else:
         form = BulkSMSForm()
     
@@ -462,7 +605,7 @@ def bulk_sms(request):
 
 def test_twilio_connection(request):
     try:
-        config = APIConfiguration.objects.filter(service='twilio', is_active=True).first()
+        config = get_api_config('twilio')
         if not config:
             return JsonResponse({"status": "error", "message": "Twilio not configured"})
         
@@ -472,6 +615,144 @@ def test_twilio_connection(request):
     except Exception as e:
         return JsonResponse({"status": "error", "message": str(e)})
 
+def carrier_cache_stats(request):
+    """Carrier lookup cache hit rates for this process"""
+    return JsonResponse(get_carrier_cache().stats())
+
+def dashboard_stats(request):
+    """Fax and SMS counts per day, status and attribute, from the daily rollups"""
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 366)
+    except ValueError:
+        days = 30
+    return JsonResponse(daily_stats.summary(days=days))
+
+def export_records(request, kind):
+    """
+    Download fax or SMS history as CSV or XLSX (?format=xlsx)
+
+    Filters: since/until (inclusive dates), status (comma separated) and,
+    for faxes, device and direction. The file is streamed as rows are read,
+    so large exports start at once and use constant memory.
+    """
+    if kind not in EXPORTS:
+        raise Http404("Unknown export")
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in FORMATS:
+        return HttpResponse(f"format must be one of {', '.join(FORMATS)}", status=400)
+    try:
+        rows = export_queryset(kind, request.GET)
+    except ExportError as e:
+        return HttpResponse(str(e), status=400)
+
+    _, columns = EXPORTS[kind]
+    title = 'Faxes' if kind == 'fax' else 'SMS'
+    if export_format == 'xlsx':
+        response = StreamingHttpResponse(
+            stream_xlsx(rows, columns, title=title),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    else:
+        response = StreamingHttpResponse(stream_csv(rows, columns), content_type='text/csv; charset=utf-8')
+    filename = f"{title.lower()}-{timezone.localdate():%Y-%m-%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Let the download start now rather than after a proxy buffers all of it
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _conditional_json(request, versions, payload):
+    """
+    JSON response validated by the rows it is built from
+
+    The ETag hashes each row's key and updated_at (and anything else that
+    shapes the response, such as page cursors); Last-Modified is the latest
+    updated_at. A request whose validators still match gets a 304 without
+    building or sending the body.
+
+    Args:
+        versions (list): (key, updated_at) pairs, plus any extra values
+        payload: Callable returning the JSON-serializable body
+    """
+    digest = hashlib.sha256()
+    last_modified = None
+    for key, updated_at in versions:
+        digest.update(f"{key}:{updated_at.isoformat() if updated_at else ''}\n".encode('utf-8'))
+        if updated_at and (last_modified is None or updated_at > last_modified):
+            last_modified = updated_at
+    etag = f'"{digest.hexdigest()[:32]}"'
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = JsonResponse(payload())
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    # Cacheable, but revalidated on every use
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _api_page(request, queryset, columns, key):
+    limit = _page_limit(request)
+    rows, newer_cursor, older_cursor = _keyset_page(queryset, columns, request, limit)
+    names = tuple(columns) + ('created_at', 'id')
+    key_index, updated_index = names.index(key), names.index('updated_at')
+    versions = [(row[key_index], row[updated_index]) for row in rows]
+    versions.append((f"cursors:{newer_cursor}:{older_cursor}", None))
+
+    def payload():
+        return {
+            'results': [dict(zip(names[:-1], row[:-1])) for row in rows],
+            'limit': limit,
+            'newer_cursor': newer_cursor,
+            'older_cursor': older_cursor,
+        }
+    return _conditional_json(request, versions, payload)
+
+@require_http_methods(['GET', 'HEAD'])
+@compress_response
+def api_fax_list(request):
+    """
+    Fax history as JSON, newest first
+
+    Keyset-paginated like fax_list (?after/?before cursors, ?limit,
+    ?direction). Poll with If-None-Match/If-Modified-Since to get a 304
+    while the page is unchanged.
+    """
+    faxes = FaxRecord.objects.all()
+    direction = request.GET.get('direction')
+    if direction in ('outbound', 'inbound'):
+        faxes = faxes.filter(direction=direction)
+    return _api_page(request, faxes, API_FAX_COLUMNS, 'fax_id')
+
+@require_http_methods(['GET', 'HEAD'])
+@compress_response
+def api_fax_detail(request, fax_id):
+    """One fax as JSON, from the archive if it has been moved out of FaxRecord"""
+    columns = API_FAX_COLUMNS + ('created_at',)
+    record = FaxRecord.objects.filter(fax_id=fax_id).values(*columns).first()
+    archived = False
+    if record is None:
+        row, entry = find_archived('fax', fax_id)
+        if row is None:
+            error = "Fax not found" if entry is None else "Fax is archived but its archive segment could not be read"
+            return JsonResponse({'error': error}, status=404 if entry is None else 500)
+        record = {column: row.get(column) for column in columns}
+        archived = True
+    record['archived'] = archived
+    versions = [(fax_id, record['updated_at']), (f"archived:{archived}", None)]
+    return _conditional_json(request, versions, lambda: record)
+
+@require_http_methods(['GET', 'HEAD'])
+@compress_response
+def api_sms_list(request):
+    """SMS history as JSON, newest first, paginated and validated like api_fax_list"""
+    return _api_page(request, SMSRecord.objects.all(), API_SMS_COLUMNS, 'sid')
+
+def fax_provider_stats(request):
+    """Fax provider latency, error rate and routing share for this process"""
+    return JsonResponse({'providers': FaxRouter().stats()})
+
 def fax_resend(request, fax_id):
     """
     Resend a fax
@@ -481,41 +762,24 @@ def fax_resend(request, fax_id):
         if not fax:
             return JsonResponse({"status": "error", "message": "Fax not found"})
         
-        # Get Telnyx configuration
-        config = APIConfiguration.objects.filter(service='telnyx', is_active=True).first()
-        if not config or not config.api_key:
-            return JsonResponse({"status": "error", "message": "Telnyx not configured"})
-        
-        # Resend fax via Telnyx
-        endpoint = "https://api.telnyx.com/v2/faxes"
-        api_key = config.api_key
-        
-        data = {
-            "media_url": fax.media_url,
-            "connection_id": "2047423188568114992",
-            "to": fax.to_number,
-            "from": config.from_number or "+18177800212",
-        }
-        
-        response = requests.post(endpoint, json=data, headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        })
-        
-        if response.status_code == 201:
-            new_fax = response.json()
+        # Resend through the provider that carried the fax
+        result = _fax_router(request).resend(fax)
+        if result['success']:
             # Create new record for resent fax
             FaxRecord.objects.create(
-                fax_id=new_fax['id'],
+                fax_id=result['fax_id'],
                 to_number=fax.to_number,
-                from_number=config.from_number or "+18177800212",
+                from_number=result['from_number'] or fax.from_number,
                 status='sent',
-                media_url=fax.media_url,
+                provider=result['provider'],
+                media_url=result.get('media_url'),
+                media_name=result.get('media_name'),
+                document_id=result.get('document_id'),
                 subject=f"Resent: {fax.subject or ''}"
             )
             return JsonResponse({"status": "success", "message": f"Fax {fax_id} resent successfully"})
         else:
-            return JsonResponse({"status": "error", "message": "Failed to resend fax"})
+            return JsonResponse({"status": "error", "message": f"Failed to resend fax: {result.get('error', 'Unknown error')}"})
             
     except Exception as e:
         error_msg = f"Error resending fax: {str(e)}"
@@ -547,32 +811,18 @@ def bulk_fax_generator(request):
                 send_faxes = request.POST.get('send_faxes') == 'on'
                 
                 if send_faxes:
-                    # Check if HumbleFax is configured
-                    humblefax_config = APIConfiguration.objects.filter(service='humblefax', is_active=True).first()
-                    if not humblefax_config:
-                        return HttpResponse("""
-                            <div style='text-align: center; padding: 50px;'>
-                                <h2 style='color: red;'>✗ HumbleFax Not Configured</h2>
-                                <p>Please configure HumbleFax API settings first to send faxes.</p>
-                                <br>
-                                <a href="{}" class="btn btn-primary">Configure API</a>
-                                <a href="{}" class="btn btn-secondary">Back to Dashboard</a>
-                            </div>
-                        """.format(
-                            reverse('api_configuration'),
-                            reverse('dashboard')
-                        ))
+                    # Route through the chosen provider, or spread over every healthy one
+                    router = _fax_router(request, request.POST.get('fax_provider'))
+                    if not router.providers:
+                        return _no_provider_response(request)
                     
-                    # Send faxes for each record
-                    humblefax = HumbleFaxService(
-                        access_key=humblefax_config.api_key,
-                        secret_key=humblefax_config.secret_key,
-                        from_number=humblefax_config.from_number
-                    )
                     results = []
                     successful_sends = 0
                     failed_sends = 0
+                    doc_generator = DocumentGenerator()
+                    pending = []
                     
+                    # Render every document first so they can be converted to PDF in parallel
                     for i, record in enumerate(records):
                         try:
                             # Convert CSV record to form data format
@@ -598,46 +848,69 @@ def bulk_fax_generator(request):
                             # Get fax number from record
                             fax_number = record.get('pcp_fax', '').strip()
                             if not fax_number:
-                                results.append(f"Record {i+1} ({form_data.get('name', 'Unknown')}): No fax number provided")
+                                results.append((i, f"Record {i+1} ({form_data.get('name', 'Unknown')}): No fax number provided"))
                                 failed_sends += 1
                                 continue
                             
                             # Generate document
-                            doc_generator = DocumentGenerator()
                             temp_path, filename = doc_generator.generate_from_template(form_data, device_type)
-                            
-                            # Read the generated file
-                            with open(temp_path, 'rb') as f:
-                                file_content = f.read()
-                            
-                            # Send fax
-                            fax_result = humblefax.send_fax(fax_number, file_content, filename, form_data.get('name'))
-                            
-                            if fax_result['success']:
-                                # Save fax record to database
-                                FaxRecord.objects.create(
-                                    fax_id=fax_result.get('fax_id', ''),
-                                    to_number=fax_number,
-                                    from_number=humblefax_config.from_number or '+1234567890',
-                                    status='sent',
-                                    subject=f"Medical Order - {device_type.replace('_', ' ').title()}",
-                                    patient_name=form_data.get('name', ''),
-                                    device_type=device_type
-                                )
-                                
-                                results.append(f"✓ Record {i+1} ({form_data.get('name', 'Unknown')}): Fax sent successfully to {fax_number}")
-                                successful_sends += 1
-                            else:
-                                results.append(f"✗ Record {i+1} ({form_data.get('name', 'Unknown')}): Fax failed - {fax_result.get('error', 'Unknown error')}")
-                                failed_sends += 1
-                            
-                            # Clean up temporary file
-                            os.remove(temp_path)
+                            pending.append((i, form_data, fax_number, temp_path, filename))
                             
                         except Exception as e:
-                            results.append(f"✗ Record {i+1} ({form_data.get('name', 'Unknown')}): Error - {str(e)}")
+                            results.append((i, f"✗ Record {i+1} ({record.get('name', 'Unknown')}): Error - {str(e)}"))
                             failed_sends += 1
-                            continue
+                    
+                    prepared = get_conversion_service().prepare_many_for_fax(
+                        [(temp_path, filename) for _, _, _, temp_path, filename in pending]
+                    )
+                    
+                    items = list(zip(pending, prepared))
+                    jobs = [
+                        {'to_number': fax_number, 'document': fax_path, 'filename': fax_filename,
+                         'patient_name': form_data.get('name')}
+                        for (i, form_data, fax_number, temp_path, filename), (fax_path, fax_filename, num_pages) in items
+                    ]
+                    
+                    # Send concurrently across providers, pausing while all of them are unavailable
+                    # instead of timing out on every record; records are saved in batches as the sends complete
+                    with BufferedRecordWriter(FaxRecord) as writer:
+                        for item, (job, fax_result) in zip(items, router.send_many(jobs)):
+                            (i, form_data, fax_number, temp_path, filename), (fax_path, fax_filename, num_pages) = item
+                            try:
+                                if fax_result['success']:
+                                    writer.add(FaxRecord(
+                                        fax_id=fax_result.get('fax_id', ''),
+                                        to_number=fax_number,
+                                        from_number=fax_result.get('from_number') or '+1234567890',
+                                        status='sent',
+                                        provider=fax_result['provider'],
+                                        media_url=fax_result.get('media_url'),
+                                        media_name=fax_result.get('media_name'),
+                                        document_id=fax_result.get('document_id'),
+                                        subject=f"Medical Order - {device_type.replace('_', ' ').title()}",
+                                        num_pages=num_pages,
+                                        patient_name=form_data.get('name', ''),
+                                        device_type=device_type
+                                    ))
+                                    
+                                    results.append((i, f"✓ Record {i+1} ({form_data.get('name', 'Unknown')}): Fax sent successfully to {fax_number}"))
+                                    successful_sends += 1
+                                elif fax_result.get('deferred'):
+                                    results.append((i, f"✗ Record {i+1} ({form_data.get('name', 'Unknown')}): {fax_result['message']}"))
+                                    failed_sends += 1
+                                else:
+                                    results.append((i, f"✗ Record {i+1} ({form_data.get('name', 'Unknown')}): Fax failed - {fax_result.get('error', 'Unknown error')}"))
+                                    failed_sends += 1
+                                
+                            except Exception as e:
+                                results.append((i, f"✗ Record {i+1} ({form_data.get('name', 'Unknown')}): Error - {str(e)}"))
+                                failed_sends += 1
+                            finally:
+                                # Clean up temporary file
+                                os.remove(temp_path)
+                                writer.flush_if_due()
+                    
+                    results = [line for _, line in sorted(results, key=lambda item: item[0])]
                     
                     # Return results
                     return HttpResponse("""
@@ -744,61 +1017,53 @@ def bulk_fax_generator(request):
 
 def bulk_fax_sender(request):
     if request.method == 'POST':
-        form = BulkFaxForm(request.POST)
+        form = BulkFaxForm(request.POST, request.FILES)
         if form.is_valid():
             fax_numbers = form.cleaned_data['fax_numbers']
             media_url = form.cleaned_data['media_url']
+            document = form.cleaned_data.get('document')
             subject = form.cleaned_data.get('subject', '')
             
-            # Get Telnyx configuration
-            config = APIConfiguration.objects.filter(service='telnyx', is_active=True).first()
-            if not config or not config.api_key:
-                return HttpResponse("Telnyx not configured. Please configure API settings first.")
+            router = _fax_router(request)
+            if not router.providers:
+                return HttpResponse("No fax provider configured. Please configure API settings first.")
             
             # Split fax numbers by comma or newline
-            fax_list = [fax.strip() for fax in fax_numbers.replace('\n', ',').split(',') if fax.strip()]
+            fax_list = split_numbers(fax_numbers)
             
             if not fax_list:
                 return HttpResponse("No valid fax numbers provided")
             
             try:
-                endpoint = "https://api.telnyx.com/v2/faxes"
-                api_key = config.api_key
-                
                 results = []
+                # Read an uploaded document once; Telnyx stages it a single time and every
+                # recipient gets the same media reference
+                job = {'document': document.read() if document else None,
+                       'filename': document.name if document else None, 'media_url': media_url}
                 
-                for fax_number in fax_list:
-                    try:
-                        data = {
-                            "media_url": media_url,
-                            "connection_id": "2047423188568114992",
-                            "to": fax_number,
-                            "from": config.from_number or "+18177800212",
-                        }
-                        
-                        response = requests.post(endpoint, json=data, headers={
-                            "Content-Type": "application/json",
-                            "Authorization": f"Bearer {api_key}"
-                        })
-                        
-                        if response.status_code == 201:
-                            fax = response.json()
-                            results.append(f"✓ {fax_number}: Success (Fax ID: {fax['id']})")
+                # Concurrent sends spread across providers with bounded in-flight requests;
+                # results come back in input order and records are saved in batches as they complete
+                with BufferedRecordWriter(FaxRecord) as writer:
+                    for fax_number, (_, result) in zip(fax_list, router.send_many(dict(job, to_number=number) for number in fax_list)):
+                        if result['success']:
+                            results.append(f"✓ {fax_number}: Success via {result['provider']} (Fax ID: {result['fax_id']})")
                             
-                            # Save to database
-                            FaxRecord.objects.create(
-                                fax_id=fax['id'],
+                            writer.add(FaxRecord(
+                                fax_id=result['fax_id'],
                                 to_number=fax_number,
-                                from_number=config.from_number or "+18177800212",
+                                from_number=result['from_number'],
                                 status='sent',
-                                media_url=media_url,
+                                provider=result['provider'],
+                                media_url=result.get('media_url'),
+                                media_name=result.get('media_name'),
+                                document_id=result.get('document_id'),
                                 subject=subject
-                            )
+                            ))
+                        elif result.get('deferred'):
+                            results.append(f"✗ {fax_number}: {result['message']}")
                         else:
-                            results.append(f"✗ {fax_number}: Failed - {response.text}")
-                            
-                    except Exception as e:
-                        results.append(f"✗ {fax_number}: Error - {str(e)}")
+                            results.append(f"✗ {fax_number}: {result['error']}")
+                        writer.flush_if_due()
                 
                 return HttpResponse("<br>".join(results))
             except Exception as e:
@@ -806,4 +1071,112 @@ def bulk_fax_sender(request):
     else:
         form = BulkFaxForm()
     
-    return render(request, 'app/bulk_fax.html', {'form': form}) 
\ No newline at end of file
+    return render(request, 'app/bulk_fax_send.html', {'form': form}) 
+
+def _parse_byte_range(header, size):
+    """
+    Parse a single "bytes=" Range header against the file size
+
+    Returns:
+        tuple: (start, end) inclusive; None to ignore the header and send
+        the whole file (other units, multiple or malformed ranges); False
+        if the range cannot be satisfied
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    start, sep, end = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0 or size == 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return False
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+def _read_range(path, start, length, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+@require_http_methods(['GET', 'HEAD'])
+def fax_media(request, media_name):
+    """
+    Serve a locally staged fax document (FAX_MEDIA_BACKEND = 'local')
+    
+    Telnyx fetches the document from the signed, expiring URL it was given
+    when it dials. The ETag is the stored content hash, so conditional and
+    single byte-range requests are answered without reading the file.
+    """
+    expires = request.GET.get('expires')
+    if not verify_media_signature(media_name, expires, request.GET.get('signature')):
+        return HttpResponseForbidden("Invalid or expired media URL")
+    
+    media = MediaUpload.objects.filter(media_name=media_name, backend='local').first()
+    path = os.path.join(local_media_root(), media_name) if media else None
+    if not path or not os.path.exists(path):
+        raise Http404("Media not found")
+    
+    content_type = media.content_type or 'application/octet-stream'
+    etag = f'"{media.content_hash}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(media.uploaded_at.timestamp()),
+        'Accept-Ranges': 'bytes',
+        # The bytes behind a name never change; cache until the URL expires
+        'Cache-Control': f"private, max-age={max(int(expires) - int(time.time()), 0)}, immutable",
+    }
+    
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+    
+    size = os.path.getsize(path)
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        byte_range = _parse_byte_range(range_header, size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+    
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        if request.method == 'HEAD':
+            response = HttpResponse(status=206, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(_read_range(path, start, length), status=206, content_type=content_type)
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        length = size
+    else:
+        # FileResponse lets the server use sendfile via wsgi.file_wrapper
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        length = size
+    
+    response['Content-Length'] = str(length)
+    for name, value in headers.items():
+        response[name] = value
+    return response
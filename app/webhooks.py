@@ -0,0 +1,225 @@
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .api_config_cache import get_api_config
+from .status_updates import (
+    StatusUpdate, map_status, parse_event_time, fax_status_batcher, sms_status_batcher,
+    HUMBLEFAX_STATUSES, TELNYX_FAX_STATUSES, TWILIO_SMS_STATUSES
+)
+
+logger = logging.getLogger(__name__)
+
+# Reject Telnyx webhooks signed more than this many seconds ago (replay protection)
+TELNYX_TIMESTAMP_TOLERANCE = 300
+
+
+def _verification_enabled():
+    return getattr(settings, 'WEBHOOK_VERIFY_SIGNATURES', True)
+
+
+def _load_json(request):
+    try:
+        return json.loads(request.body.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+# HumbleFax signing schemes: (digest, encoding of the signature header)
+HUMBLEFAX_SIGNATURE_SCHEMES = {
+    'hmac-sha256-hex': (hashlib.sha256, 'hex'),
+    'hmac-sha256-base64': (hashlib.sha256, 'base64'),
+    'hmac-sha1-hex': (hashlib.sha1, 'hex'),
+    'hmac-sha1-base64': (hashlib.sha1, 'base64'),
+}
+
+
+def verify_humblefax_signature(request):
+    """
+    Check the HMAC of the raw body against the configured signature header
+
+    HumbleFax does not document how it signs callbacks, so the header
+    (HUMBLEFAX_WEBHOOK_SIGNATURE_HEADER) and the scheme
+    (HUMBLEFAX_WEBHOOK_SIGNATURE_SCHEME) are settings; until both are set
+    every callback is rejected. The secret is the webhook signing secret
+    from the HumbleFax dashboard.
+    """
+    secret = getattr(settings, 'HUMBLEFAX_WEBHOOK_SECRET', '')
+    header = getattr(settings, 'HUMBLEFAX_WEBHOOK_SIGNATURE_HEADER', '')
+    scheme = HUMBLEFAX_SIGNATURE_SCHEMES.get(getattr(settings, 'HUMBLEFAX_WEBHOOK_SIGNATURE_SCHEME', 'hmac-sha256-hex'))
+    if not secret or not header or scheme is None:
+        logger.error("HumbleFax webhook signing is not configured")
+        return False
+    signature = request.headers.get(header, '').strip()
+    if not signature:
+        return False
+    digest, encoding = scheme
+    mac = hmac.new(secret.encode('utf-8'), request.body, digest)
+    if encoding == 'hex':
+        return hmac.compare_digest(mac.hexdigest(), signature.lower())
+    return hmac.compare_digest(base64.b64encode(mac.digest()).decode('ascii'), signature)
+
+
+def _verify_ed25519(public_key, signature, message):
+    """Verify an Ed25519 signature with cryptography, or PyNaCl if that is what is installed"""
+    try:
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+        try:
+            Ed25519PublicKey.from_public_bytes(public_key).verify(signature, message)
+            return True
+        except (InvalidSignature, ValueError):
+            return False
+    except ImportError:
+        pass
+
+    try:
+        from nacl.exceptions import BadSignatureError
+        from nacl.signing import VerifyKey
+        try:
+            VerifyKey(public_key).verify(message, signature)
+            return True
+        except (BadSignatureError, ValueError):
+            return False
+    except ImportError:
+        logger.error("Telnyx webhook verification needs the cryptography or PyNaCl package")
+        return False
+
+
+def verify_telnyx_signature(request):
+    """
+    Check the Ed25519 signature Telnyx sends over "<timestamp>|<body>"
+
+    Uses the public key from the Telnyx portal (TELNYX_PUBLIC_KEY, base64).
+    """
+    public_key = getattr(settings, 'TELNYX_PUBLIC_KEY', '')
+    signature = request.headers.get('Telnyx-Signature-Ed25519', '')
+    timestamp = request.headers.get('Telnyx-Timestamp', '')
+    if not public_key or not signature or not timestamp:
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > TELNYX_TIMESTAMP_TOLERANCE:
+            logger.warning(f"Telnyx webhook timestamp {timestamp} is outside the tolerance")
+            return False
+        key_bytes = base64.b64decode(public_key)
+        signature_bytes = base64.b64decode(signature)
+    except ValueError:
+        return False
+    return _verify_ed25519(key_bytes, signature_bytes, timestamp.encode('utf-8') + b'|' + request.body)
+
+
+def verify_twilio_signature(request):
+    """
+    Check X-Twilio-Signature: base64 HMAC-SHA1 of the callback URL followed by
+    the sorted POST parameters, keyed with the account's auth token
+    """
+    config = get_api_config('twilio')
+    auth_token = (config.auth_token if config and config.auth_token else '') or getattr(settings, 'TWILIO_AUTH_TOKEN', '')
+    signature = request.headers.get('X-Twilio-Signature', '')
+    if not auth_token or not signature:
+        return False
+
+    # Behind a proxy the URL Django sees can differ from the one Twilio
+    # signed, so prefer the callback URL we gave Twilio when it is set
+    url = getattr(settings, 'TWILIO_STATUS_CALLBACK_URL', '') or request.build_absolute_uri()
+    payload = url + ''.join(f"{key}{value}" for key in sorted(request.POST) for value in request.POST.getlist(key))
+    expected = base64.b64encode(hmac.new(auth_token.encode('utf-8'), payload.encode('utf-8'), hashlib.sha1).digest()).decode('ascii')
+    return hmac.compare_digest(expected, signature)
+
+
+def _apply(batcher, updates, provider):
+    """Commit updates and build the webhook response"""
+    if not updates:
+        return JsonResponse({'received': 0})
+    try:
+        batcher.submit(updates)
+    except Exception as e:
+        # A non-2xx response makes the provider retry the delivery
+        logger.error(f"Error applying {provider} status webhook: {str(e)}")
+        return JsonResponse({'error': 'Could not apply status update'}, status=500)
+    return JsonResponse({'received': len(updates)})
+
+
+def _humblefax_updates(payload):
+    """Extract status updates from a HumbleFax callback (one event or a list)"""
+    events = payload if isinstance(payload, list) else [payload]
+    updates = []
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        data = event.get('data', event)
+        fax = data.get('sentFax') or data.get('SentFax') or data
+        fax_id = fax.get('sentFaxId') or fax.get('id')
+        status = map_status(HUMBLEFAX_STATUSES, fax.get('status'))
+        if fax_id and status:
+            occurred_at = parse_event_time(fax.get('timestamp') or fax.get('updatedAt') or event.get('timestamp'))
+            updates.append(StatusUpdate(str(fax_id), status, occurred_at))
+    return updates
+
+
+def _telnyx_updates(payload):
+    """Extract the status update from a Telnyx fax event"""
+    data = payload.get('data', {}) if isinstance(payload, dict) else {}
+    event_payload = data.get('payload', {})
+    fax_id = event_payload.get('fax_id')
+    event_type = data.get('event_type', '')
+    status = map_status(TELNYX_FAX_STATUSES, event_payload.get('status'))
+    if status is None and event_type.startswith('fax.'):
+        status = map_status(TELNYX_FAX_STATUSES, event_type[len('fax.'):])
+    if not fax_id or not status:
+        return []
+    return [StatusUpdate(str(fax_id), status, parse_event_time(data.get('occurred_at')))]
+
+
+@csrf_exempt
+@require_POST
+def humblefax_webhook(request):
+    """
+    Fax status callback from HumbleFax
+
+    Off unless HUMBLEFAX_WEBHOOK_ENABLED is set, once the signing scheme is
+    confirmed; the status poller covers HumbleFax faxes meanwhile.
+    """
+    if not getattr(settings, 'HUMBLEFAX_WEBHOOK_ENABLED', False):
+        return HttpResponse(status=404)
+    if _verification_enabled() and not verify_humblefax_signature(request):
+        logger.warning("Rejected HumbleFax webhook with an invalid signature")
+        return HttpResponse(status=403)
+    payload = _load_json(request)
+    if payload is None:
+        return HttpResponse(status=400)
+    return _apply(fax_status_batcher, _humblefax_updates(payload), 'HumbleFax')
+
+
+@csrf_exempt
+@require_POST
+def telnyx_webhook(request):
+    """Fax status callback from Telnyx"""
+    if _verification_enabled() and not verify_telnyx_signature(request):
+        logger.warning("Rejected Telnyx webhook with an invalid signature")
+        return HttpResponse(status=403)
+    payload = _load_json(request)
+    if payload is None:
+        return HttpResponse(status=400)
+    return _apply(fax_status_batcher, _telnyx_updates(payload), 'Telnyx')
+
+
+@csrf_exempt
+@require_POST
+def twilio_sms_status_webhook(request):
+    """SMS status callback from Twilio (form-encoded MessageSid and MessageStatus)"""
+    if _verification_enabled() and not verify_twilio_signature(request):
+        logger.warning("Rejected Twilio webhook with an invalid signature")
+        return HttpResponse(status=403)
+    sid = request.POST.get('MessageSid') or request.POST.get('SmsSid')
+    status = map_status(TWILIO_SMS_STATUSES, request.POST.get('MessageStatus') or request.POST.get('SmsStatus'))
+    # Twilio callbacks carry no event time, so order by time of receipt
+    updates = [StatusUpdate(sid, status, timezone.now())] if sid and status else []
+    return _apply(sms_status_batcher, updates, 'Twilio')
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import django
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -75,11 +76,51 @@ WSGI_APPLICATION = 'blank_django.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# DATABASE_PROFILE picks the database: 'sqlite' (default) or 'postgres'.
+#
+# SQLite connections get SQLITE_PRAGMAS when they open (app/db_profile.py):
+# WAL lets readers run alongside the one writer and, with synchronous=NORMAL,
+# commits without an fsync per transaction; busy_timeout makes a writer wait
+# for the lock instead of failing with "database is locked". On Django 5.1+
+# transactions start IMMEDIATE so a read-then-write transaction takes the
+# write lock up front rather than failing when it tries to upgrade.
+#
+# The postgres profile needs psycopg2 and keeps connections open for
+# DATABASE_CONN_MAX_AGE seconds, checking them before reuse (Django 4.1+).
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'humblefax'),
+            'USER': os.environ.get('DATABASE_USER', 'humblefax'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DATABASE_CONNECT_TIMEOUT', '5')),
+            },
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {},
+        }
+    }
+    if django.VERSION >= (5, 1):
+        DATABASES['default']['OPTIONS']['transaction_mode'] = os.environ.get('SQLITE_TRANSACTION_MODE', 'IMMEDIATE')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '30000')),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
 }
 
 
@@ -133,4 +174,145 @@ HUMBLEFAX_FROM_NUMBER = os.environ.get('HUMBLEFAX_FROM_NUMBER', '')
 # Replace these with your actual Twilio API credentials
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', '')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', '')
-TWILIO_FROM_NUMBER = os.environ.get('TWILIO_FROM_NUMBER', '') 
\ No newline at end of file
+TWILIO_FROM_NUMBER = os.environ.get('TWILIO_FROM_NUMBER', '')
+
+# Provider credentials saved in APIConfiguration are cached per process; each
+# process checks the table for changes made elsewhere at most this often
+API_CONFIG_RECHECK_SECONDS = float(os.environ.get('API_CONFIG_RECHECK_SECONDS', '5'))
+
+# Local .docx -> PDF conversion before upload (requires LibreOffice)
+FAX_CONVERT_TO_PDF = os.environ.get('FAX_CONVERT_TO_PDF', 'true').lower() in ('1', 'true', 'yes')
+LIBREOFFICE_PATH = os.environ.get('LIBREOFFICE_PATH', '')
+PDF_CONVERSION_WORKERS = int(os.environ.get('PDF_CONVERSION_WORKERS', '2'))
+PDF_CONVERSION_TIMEOUT = int(os.environ.get('PDF_CONVERSION_TIMEOUT', '120'))
+PDF_CONVERSION_CACHE_DIR = os.environ.get('PDF_CONVERSION_CACHE_DIR', os.path.join(BASE_DIR, 'pdf_cache'))
+# Converted orders are patient data: cached PDFs unused for this many seconds,
+# and the least recently used beyond this many bytes, are deleted
+PDF_CONVERSION_CACHE_MAX_AGE = int(os.environ.get('PDF_CONVERSION_CACHE_MAX_AGE', '3600'))
+PDF_CONVERSION_CACHE_MAX_BYTES = int(os.environ.get('PDF_CONVERSION_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Provider API base URLs - point these at the fake provider server
+# (python manage.py fake_providers) for local benchmarks and load tests
+HUMBLEFAX_BASE_URL = os.environ.get('HUMBLEFAX_BASE_URL', 'https://api.humblefax.com')
+TELNYX_BASE_URL = os.environ.get('TELNYX_BASE_URL', 'https://api.telnyx.com')
+TWILIO_BASE_URL = os.environ.get('TWILIO_BASE_URL', 'https://api.twilio.com')
+TWILIO_LOOKUP_BASE_URL = os.environ.get('TWILIO_LOOKUP_BASE_URL', 'https://lookups.twilio.com')
+
+# Circuit breakers around provider endpoints (see app/circuit_breaker.py for
+# all options). Per-provider overrides go under 'providers', e.g.
+# {'providers': {'humblefax': {'open_seconds': 60}}}
+CIRCUIT_BREAKER = {
+    'window_size': 20,
+    'min_calls': 5,
+    'failure_rate_threshold': 0.5,
+    'slow_call_seconds': 10.0,
+    'slow_call_rate_threshold': 0.8,
+    'open_seconds': 30.0,
+    'half_open_probes': 2,
+}
+# Longest total time a bulk job pauses for open breakers before deferring the rest
+BULK_CIRCUIT_PAUSE_SECONDS = int(os.environ.get('BULK_CIRCUIT_PAUSE_SECONDS', '120'))
+
+# Delivery-status webhooks (app/webhooks.py). Point the providers at
+# /webhooks/humblefax/, /webhooks/telnyx/ and /webhooks/twilio/sms-status/
+WEBHOOK_VERIFY_SIGNATURES = os.environ.get('WEBHOOK_VERIFY_SIGNATURES', 'true').lower() in ('1', 'true', 'yes')
+# HumbleFax does not document how it signs callbacks: its webhook stays off
+# until the signature header and scheme are confirmed and set here
+HUMBLEFAX_WEBHOOK_ENABLED = os.environ.get('HUMBLEFAX_WEBHOOK_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+HUMBLEFAX_WEBHOOK_SECRET = os.environ.get('HUMBLEFAX_WEBHOOK_SECRET', '')
+HUMBLEFAX_WEBHOOK_SIGNATURE_HEADER = os.environ.get('HUMBLEFAX_WEBHOOK_SIGNATURE_HEADER', '')
+# hmac-sha256-hex, hmac-sha256-base64, hmac-sha1-hex or hmac-sha1-base64
+HUMBLEFAX_WEBHOOK_SIGNATURE_SCHEME = os.environ.get('HUMBLEFAX_WEBHOOK_SIGNATURE_SCHEME', 'hmac-sha256-hex')
+# Base64 Ed25519 public key from the Telnyx portal
+TELNYX_PUBLIC_KEY = os.environ.get('TELNYX_PUBLIC_KEY', '')
+# Sent as webhook_url / StatusCallback on each request when set
+TELNYX_WEBHOOK_URL = os.environ.get('TELNYX_WEBHOOK_URL', '')
+TWILIO_STATUS_CALLBACK_URL = os.environ.get('TWILIO_STATUS_CALLBACK_URL', '')
+
+# Status polling for deployments without webhooks (python manage.py
+# poll_fax_status); see app/status_poller.py for all options
+FAX_STATUS_POLL = {
+    'min_interval': 15,
+    'max_interval': 900,
+    'age_factor': 0.1,
+    'max_age_hours': 48,
+    'workers': 8,
+}
+
+# Twilio carrier lookups are cached in the CarrierLookup table for this many
+# seconds, with an in-process LRU of TWILIO_LOOKUP_CACHE_SIZE numbers in front
+TWILIO_LOOKUP_CACHE_TTL = int(os.environ.get('TWILIO_LOOKUP_CACHE_TTL', str(90 * 24 * 3600)))
+TWILIO_LOOKUP_CACHE_SIZE = int(os.environ.get('TWILIO_LOOKUP_CACHE_SIZE', '10000'))
+# Concurrent Lookup API requests when resolving bulk SMS recipients
+TWILIO_LOOKUP_WORKERS = int(os.environ.get('TWILIO_LOOKUP_WORKERS', '8'))
+
+# Bulk SMS: concurrent sends, paced per sender number. Twilio allows about
+# 1 msg/s on long codes, 3 on toll-free and 100 on short codes; set
+# per-number rates in TWILIO_SENDER_RATES, e.g. {'+18005550100': 3}
+BULK_SMS_WORKERS = int(os.environ.get('BULK_SMS_WORKERS', '8'))
+TWILIO_MESSAGES_PER_SECOND = float(os.environ.get('TWILIO_MESSAGES_PER_SECOND', '1'))
+TWILIO_SENDER_RATES = {}
+
+# Bulk jobs save FaxRecord/SMSRecord rows in batches of this many rows, or
+# after this many seconds, whichever comes first (app/record_writer.py)
+RECORD_WRITER_BATCH_SIZE = int(os.environ.get('RECORD_WRITER_BATCH_SIZE', '200'))
+RECORD_WRITER_FLUSH_SECONDS = float(os.environ.get('RECORD_WRITER_FLUSH_SECONDS', '5'))
+
+# Rows older than ARCHIVE_AFTER_DAYS are moved by `manage.py archive_records`
+# into compressed JSONL segments under ARCHIVE_ROOT (zstd if the zstandard
+# package is installed, else gzip; force one with ARCHIVE_COMPRESSION)
+ARCHIVE_ROOT = os.environ.get('ARCHIVE_ROOT', os.path.join(BASE_DIR, 'archive'))
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_COMPRESSION = os.environ.get('ARCHIVE_COMPRESSION', 'auto')
+
+# Every faxed document is kept once per SHA-256 under DOCUMENT_STORE_ROOT,
+# compressed like archive segments, so resends send the exact bytes again.
+# Least recently used documents are evicted above DOCUMENT_STORE_MAX_BYTES
+# (compressed size on disk). The documents hold PHI, so any not sent or resent
+# for DOCUMENT_STORE_MAX_AGE seconds are deleted (0 keeps them); schedule
+# `manage.py evict_documents` to enforce it when nothing new is being stored
+DOCUMENT_STORE_ROOT = os.environ.get('DOCUMENT_STORE_ROOT', os.path.join(BASE_DIR, 'documents'))
+DOCUMENT_STORE_MAX_BYTES = int(os.environ.get('DOCUMENT_STORE_MAX_BYTES', str(2 * 1024 ** 3)))
+DOCUMENT_STORE_MAX_AGE = int(os.environ.get('DOCUMENT_STORE_MAX_AGE', str(30 * 86400)))
+DOCUMENT_STORE_COMPRESSION = os.environ.get('DOCUMENT_STORE_COMPRESSION', 'auto')
+
+# fax_list totals are stored in RecordCount and kept current on save/delete;
+# they are recounted at most this often to pick up writes that bypass the
+# signals, such as QuerySet.update or raw SQL (app/record_counts.py)
+FAX_COUNT_MAX_AGE = int(os.environ.get('FAX_COUNT_MAX_AGE', '300'))
+
+# Rows fetched per database round trip, and per streamed chunk, by the CSV/XLSX exports
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
+
+# Telnyx fax defaults used when the API configuration leaves them blank, and
+# the most concurrent requests a bulk send keeps open (also the pool size)
+TELNYX_CONNECTION_ID = os.environ.get('TELNYX_CONNECTION_ID', '2047423188568114992')
+TELNYX_FROM_NUMBER = os.environ.get('TELNYX_FROM_NUMBER', '+18177800212')
+TELNYX_MAX_IN_FLIGHT = int(os.environ.get('TELNYX_MAX_IN_FLIGHT', '16'))
+
+# Uploaded and generated fax documents are staged once per content hash
+# (app/media_stage.py): 'telnyx' uploads to Telnyx media storage, 'local'
+# keeps them in FAX_MEDIA_ROOT and lets Telnyx fetch them from
+# FAX_MEDIA_BASE_URL (defaults to the host of the current request)
+FAX_MEDIA_BACKEND = os.environ.get('FAX_MEDIA_BACKEND', 'telnyx')
+FAX_MEDIA_ROOT = os.environ.get('FAX_MEDIA_ROOT', os.path.join(BASE_DIR, 'fax_media'))
+FAX_MEDIA_BASE_URL = os.environ.get('FAX_MEDIA_BASE_URL', '')
+# Telnyx keeps media for this many seconds; staged media is re-uploaded
+# once it is within FAX_MEDIA_REUSE_MARGIN seconds of expiring
+FAX_MEDIA_TTL = int(os.environ.get('FAX_MEDIA_TTL', str(48 * 3600)))
+FAX_MEDIA_REUSE_MARGIN = int(os.environ.get('FAX_MEDIA_REUSE_MARGIN', '600'))
+# Local media URLs are HMAC-signed (with SECRET_KEY unless a separate key is
+# set) and stop working after FAX_MEDIA_URL_TTL seconds
+FAX_MEDIA_SIGNING_KEY = os.environ.get('FAX_MEDIA_SIGNING_KEY', '')
+FAX_MEDIA_URL_TTL = int(os.environ.get('FAX_MEDIA_URL_TTL', str(24 * 3600)))
+
+# Fax routing (app/fax_providers.py): each send goes to a configured provider
+# picked by recent latency and error rate, failing over when one refuses a
+# fax; bulk jobs use every provider at once up to its in-flight limit
+FAX_ROUTING = {
+    'providers': ['telnyx', 'humblefax'],
+    'alpha': 0.2,
+    'error_penalty': 4.0,
+    'max_in_flight': {'humblefax': int(os.environ.get('HUMBLEFAX_MAX_IN_FLIGHT', '4'))},
+}